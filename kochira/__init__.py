@@ -1,5 +1,11 @@
+import time
+
+_import_start = time.monotonic()
+
 from .bot import Bot
 
+_import_time = time.monotonic() - _import_start
+
 def main():
     import os
     import logging
@@ -7,6 +13,9 @@ def main():
 
     define("config", default="config.yml", help="Configuration file.")
     define("console", default=False, help="Whether to start the console instead of the bot.")
+    define("profile_startup", default=False, help="Report how long each part of startup takes, then exit without connecting.")
+    define("supervise", default=False, help="Run each network, or group of networks, in a worker process of its own.")
+    define("shard", default=None, help="Only run the networks in this shard. Used by the supervisor to start workers.")
 
     parse_command_line()
 
@@ -19,7 +28,15 @@ If this is your first time starting Kochira, copy the file `config.yml.dist` to
 """, options.config)
         return
 
-    bot = Bot(options.config)
+    if options.supervise:
+        from .supervisor import Supervisor
+        Supervisor(options.config).run()
+        return
+
+    bot = Bot(options.config, profile_startup=options.profile_startup,
+              shard=options.shard)
+    bot.startup_timings["import"] = _import_time
+    bot.startup_timings.move_to_end("import", last=False)
     if options.console:
         banner = """\
 Welcome to the Kochira console!
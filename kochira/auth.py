@@ -10,8 +10,9 @@ def acl_for(client, target=None):
         else:
             channel_acl = {}
 
+        # the configured sets are read-only, so make new ones
         for hostmask, permissions in channel_acl.items():
-            acl.setdefault(hostmask, set([])).update(permissions)
+            acl[hostmask] = acl.get(hostmask, frozenset()) | permissions
 
     return acl
 
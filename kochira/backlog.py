@@ -0,0 +1,89 @@
+import collections
+import itertools
+import sys
+import time
+
+Line = collections.namedtuple("Line", ["by", "message", "ts", "id"])
+
+
+class Backlogs(dict):
+    """
+    Recent lines for each of a client's targets, newest first.
+
+    Each backlog is a ring buffer, so adding a line costs the same however
+    long the backlog is. Channels keep ``max_backlog`` lines, unless their
+    own configuration says otherwise. Private message backlogs are evicted
+    once they've been idle for ``private_backlog_ttl`` seconds, or to make
+    room when there are more than ``max_private_backlogs`` of them.
+    """
+
+    def __init__(self, client):
+        super().__init__()
+
+        self.client = client
+
+        # private targets, least recently active first
+        self._private = collections.OrderedDict()
+        self._ids = itertools.count()
+
+    def _max_length(self, target):
+        channel = self.client.config.channels.get(target)
+
+        if channel is not None and channel.max_backlog is not None:
+            return channel.max_backlog
+
+        return self.client.bot.config.core.max_backlog
+
+    def add(self, target, by, message):
+        """
+        Add a line to a target's backlog.
+        """
+        core = self.client.bot.config.core
+        backlog = self.get(target)
+
+        if backlog is None:
+            backlog = collections.deque(maxlen=self._max_length(target))
+            self[target] = backlog
+
+        # nicknames repeat a lot, so only keep one copy of each
+        backlog.appendleft(Line(sys.intern(by), message,
+                                time.time() if core.backlog_timestamps else None,
+                                next(self._ids)))
+
+        if not self.client.is_channel(target):
+            now = time.monotonic()
+            self._private[target] = now
+            self._private.move_to_end(target)
+            self._evict(now)
+
+    def _evict(self, now):
+        core = self.client.bot.config.core
+
+        while self._private:
+            target, last_active = next(iter(self._private.items()))
+
+            if len(self._private) <= core.max_private_backlogs and \
+                now - last_active <= core.private_backlog_ttl:
+                break
+
+            del self._private[target]
+            self.pop(target, None)
+
+    def resize(self):
+        """
+        Apply changes to the configured backlog lengths, keeping the newest
+        lines.
+        """
+        for target, backlog in list(self.items()):
+            max_length = self._max_length(target)
+
+            if backlog.maxlen != max_length:
+                self[target] = collections.deque(
+                    itertools.islice(backlog, max_length), maxlen=max_length)
+
+    def discard(self, target):
+        """
+        Forget a target's backlog, e.g. after leaving a channel.
+        """
+        self._private.pop(target, None)
+        self.pop(target, None)
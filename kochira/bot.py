@@ -1,6 +1,7 @@
-from concurrent.futures import ThreadPoolExecutor, Future
+from concurrent.futures import Future, ThreadPoolExecutor
 
 import collections
+import contextlib
 import functools
 import imp
 import importlib
@@ -8,33 +9,64 @@ import locale
 import heapq
 import logging
 import multiprocessing
-from peewee import SqliteDatabase
 import signal
+import sys
+import threading
+import time
+import types
 import yaml
 
-from pydle.async import EventLoop, coroutine
+from pydle.async import EventLoop
 
-from . import config
+from . import config, handoff, http, ipc, metrics
 from .client import Client
-from .db import database
-from .scheduler import Scheduler
+from .db import database, SqliteDatabase
+from .executor import BoundedExecutor, ProcessExecutor, preload_modules
+from .journal import JournalWriter
+from .rehash import diff_config
+from .scheduler import Scheduler, ScheduledJob
+from .storage import make_storage
 from .util import Expando
 from .service import Service, BoundService, HookContext, Config as ServiceConfig
+from .supervisor import Settings as SupervisorSettings, primary_shard, shard_of
 from .userdata import UserDataKVPair
+from .watchdog import Watchdog
 
 from kochira import services
 
 
 logger = logging.getLogger(__name__)
 
+SERVICE_LOAD_TIME = metrics.registry.gauge(
+    "kochira_service_load_seconds",
+    "Time taken to import and set up each service when it was last loaded.",
+    ["service", "phase"])
+
 
 class ServiceConfigLoader(collections.Mapping):
+    """
+    The settings of each service, built when the configuration is, with the
+    config class of the service if it's loaded. A service's settings are
+    built again with its own class when it's loaded later.
+    """
+
     def __init__(self, bot, values):
+        if values is None:
+            values = {}
+
+        if not isinstance(values, collections.Mapping):
+            raise config.ConfigError("", "expected a mapping, not {!r}".format(values))
+
         self.bot = bot
         self.configs = values
         self._cache = {}
 
+        for name in self.configs:
+            self._build(name, self._config_factory_for(name))
+
     def _config_factory_for(self, name):
+        name = self.bot._qualify_service_name(name)
+
         if name not in self.bot.services:
             config_factory = ServiceConfig
         else:
@@ -43,18 +75,45 @@ class ServiceConfigLoader(collections.Mapping):
 
         return config_factory
 
-    def __getitem__(self, name):
-        config_factory = self._config_factory_for(name)
-
+    def _key(self, name):
         # if we can't find the service name immediately, try removing
         # services.__name__ from the start
         if name.startswith(services.__name__) and name not in self.configs:
             name = name[len(services.__name__):]
+        return name
 
-        if name not in self._cache or \
-            not isinstance(self._cache[name], config_factory):
+    def _build(self, name, config_factory):
+        try:
             self._cache[name] = config_factory(self.configs[name])
-        return self._cache[name]
+        except config.ConfigError as e:
+            raise e.within(name)
+
+    def rebuild(self, name, config_factory):
+        """
+        Build a service's settings again with its config class, e.g. when
+        it's loaded, raising ``ConfigError`` if they aren't valid.
+        """
+        name = self._key(name)
+
+        if name not in self.configs:
+            return
+
+        self._build(name, config_factory)
+
+        try:
+            self._cache[name].validate()
+        except config.ConfigError as e:
+            raise e.within(name)
+
+    def validate(self):
+        for name, service_config in self._cache.items():
+            try:
+                service_config.validate()
+            except config.ConfigError as e:
+                raise e.within(name)
+
+    def __getitem__(self, name):
+        return self._cache[self._key(name)]
 
     def __iter__(self):
         return iter(self.configs)
@@ -63,6 +122,15 @@ class ServiceConfigLoader(collections.Mapping):
         return len(self.configs)
 
 
+def _chain_future(fut, source):
+    exc = source.exception()
+
+    if exc is not None:
+        fut.set_exception(exc)
+    else:
+        fut.set_result(source.result())
+
+
 def _config_class_factory(bot):
     lang, _ = locale.getdefaultlocale()
 
@@ -84,6 +152,7 @@ def _config_class_factory(bot):
 
             authenticated_userdata = config.Field(doc="Does user data need authentication?", default=True)
             response_format = config.Field(doc="How should responses be formatted?", default="{origin}: {message}")
+            max_lines = config.Field(doc="Max lines to split a long message into. The last line is cut short if there would be more.", default=4)
 
             class TLS(config.Config):
                 enabled = config.Field(doc="Enable TLS?", default=False)
@@ -97,28 +166,53 @@ def _config_class_factory(bot):
                 username = config.Field(doc="SASL username.", default=None)
                 password = config.Field(doc="SASL password.", default=None)
 
+            class Flood(config.Config):
+                rate = config.Field(doc="Lines per second to send once the burst is used up. 0 disables flood control.", default=0.5)
+                burst = config.Field(doc="Lines that can be sent at once.", default=5)
+                coalesce = config.Field(doc="Join lines queued for the same channel into one when flood control holds them up.", default=True)
+
             class Channel(config.Config):
                 autojoin = config.Field(doc="Whether or not to autojoin to the channel.", default=True)
                 password = config.Field(doc="Password for the channel, if any.", default=None)
                 services = config.Field(doc="Mapping of per-channel service settings.", type=service_config_loader)
                 acl = config.Field(doc="Mapping of per-channel access control lists.", type=config.Mapping(config.Many(str, is_set=True)))
                 locale = config.Field(doc="Per-channel locale.", default=None)
+                max_backlog = config.Field(doc="Maximum backlog lines to store for this channel, if not the core setting.", default=None)
 
             tls = config.Field(doc="TLS settings.", type=TLS, default=TLS())
             sasl = config.Field(doc="SASL settings.", type=SASL, default=SASL())
+            flood = config.Field(doc="Flood control settings.", type=Flood, default=Flood())
 
             channels = config.Field(doc="Mapping of channel settings.", type=config.Mapping(Channel))
             services = config.Field(doc="Mapping of per-client service settings.", type=service_config_loader)
             acl = config.Field(doc="Mapping of per-client access control lists.", type=config.Mapping(config.Many(str, is_set=True)))
             locale = config.Field(doc="Per-network locale.", default=None)
+            shard = config.Field(doc="Worker process to run this network in, when supervised. Networks without one get a worker of their own.", default=None)
 
         class Core(config.Config):
+            class Executor(config.Config):
+                max_workers = config.Field(doc="Max threads.", default=None)
+                max_queue = config.Field(doc="Max work waiting for a thread. 0 is unbounded.", default=None)
+                policy = config.Field(doc="What to do when the queue is full: \"reject\" new work or \"drop_oldest\" queued work.", default=None)
+                max_per_origin = config.Field(doc="Max work queued or running for any one user. 0 is unlimited.", default=None)
+
             database = config.Field(doc="Database file to use", default="kochira.db")
-            max_backlog = config.Field(doc="Maximum backlog lines to store.", default=10)
-            max_workers = config.Field(doc="Max thread pool workers.", default=0)
+            max_backlog = config.Field(doc="Maximum backlog lines to store per channel or user.", default=10)
+            max_private_backlogs = config.Field(doc="Maximum number of users to keep private message backlogs for.", default=100)
+            private_backlog_ttl = config.Field(doc="Forget private message backlogs idle for this many seconds.", default=3600)
+            backlog_timestamps = config.Field(doc="Store when each backlog line was received.", default=False)
+            max_workers = config.Field(doc="Max thread pool workers for the io pool.", default=0)
+            executors = config.Field(doc="Mapping of executor pool (io, cpu, subprocess) settings, overriding the defaults.", type=config.Mapping(Executor))
+            max_processes = config.Field(doc="Max worker processes for CPU-bound work. 0 is one per CPU.", default=0)
+            import_workers = config.Field(doc="Threads to import service modules with at startup. 1 imports them one at a time.", default=4)
+            max_http_clients = config.Field(doc="Max simultaneous asynchronous HTTP requests.", default=10)
+            stall_threshold = config.Field(doc="Log the event loop's stack if it is stalled for longer than this many seconds. 0 disables this.", default=1.0)
+            slow_hook_threshold = config.Field(doc="Log hooks that run on the event loop for longer than this many seconds. 0 disables this.", default=0.25)
             version = config.Field(doc="CTCP VERSION reply.", default="kochira IRC bot")
             locale_path = config.Field(doc="Path to locales.", default="/usr/share/locale")
             locale = config.Field(doc="Locale to use.", default=lang)
+            supervisor = config.Field(doc="Settings for running networks in separate worker processes.", type=SupervisorSettings, default=SupervisorSettings())
+            journal = config.Field(doc="Record incoming IRC traffic to this file, to replay with scripts/replay_journal.py. Compressed if it ends in .gz.", default=None)
 
         core = config.Field(doc="Core configuration settings.", type=Core)
         clients = config.Field(doc="Clients to connect.", type=config.Mapping(Network))
@@ -132,7 +226,8 @@ class Bot:
     The core bot.
     """
 
-    def __init__(self, config_file="config.yml"):
+    def __init__(self, config_file="config.yml", profile_startup=False,
+                 shard=None):
         self.services = {}
         self.clients = {}
         self.event_loop = EventLoop()
@@ -141,29 +236,142 @@ class Bot:
         self.config_file = config_file
 
         self.stopping = False
+        self.profile_startup = profile_startup
 
-        self.rehash()
-        self._connect_to_db()
+        # the networks this process runs, when a supervisor runs the rest
+        self.shard = shard
+        self.ipc = None
+
+        self.journal = None
+
+        self.startup_timings = collections.OrderedDict()
+        self.rehash_timings = {}
+        self.service_timings = {}
+        self._import_times = {}
+
+        # combined service configs, by service, client and channel
+        self.service_config_cache = {}
+
+        # sockets to pass on when restarting with a handoff, by name
+        self.handoff_sockets = {}
+        self._handoff = handoff.load() or {}
+
+        self._loop_thread = None
+        self._deferred = collections.deque()
+        self._deferred_scheduled = False
+        self._deferred_lock = threading.Lock()
+
+        with self._timed("rehash"):
+            self.rehash()
+
+        with self._timed("connect_to_db"):
+            self._connect_to_db()
+
+    @contextlib.contextmanager
+    def _timed(self, phase):
+        start = time.monotonic()
+
+        try:
+            yield
+        finally:
+            self.startup_timings[phase] = time.monotonic() - start
 
     def run(self):
-        self.executor = ThreadPoolExecutor(self.config.core.max_workers or multiprocessing.cpu_count())
-        self.scheduler = Scheduler(self)
+        with self._timed("start_executors"):
+            self._start_executors()
+            http.configure(self.config.core.max_http_clients)
+            self.scheduler = Scheduler(self)
+            self.watchdog = Watchdog(self, self.config.core.stall_threshold,
+                                     self.config.core.slow_hook_threshold)
+            self.watchdog.start()
 
         signal.signal(signal.SIGHUP, self._handle_sighup)
 
-        self._load_services()
-        self._connect_to_irc()
+        if self.shard is not None:
+            with self._timed("connect_to_supervisor"):
+                self.ipc = ipc.Channel(self, self.config.core.supervisor.socket,
+                                       ipc.inherited_authkey())
+
+        with self._timed("load_services"):
+            self._load_services()
+
+        if self.profile_startup:
+            # stop short of connecting, which doesn't finish until long after
+            # this returns, and would fight a running bot over its nickname
+            print(self.startup_report())
+            self.stop()
+            return
+
+        self._open_journal()
+
+        with self._timed("connect_to_irc"):
+            self._connect_to_irc()
 
         signal.signal(signal.SIGTERM, self._handle_sigterm)
         signal.signal(signal.SIGINT, self._handle_sigterm)
 
+        self._loop_thread = threading.get_ident()
         self.event_loop.run()
 
     def stop(self):
         self.stopping = True
+        self.watchdog.stop()
         self.event_loop.stop()
         for service in list(self.services.keys()):
             self.unload_service(service)
+        self.scheduler.close()
+        self.process_executor.shutdown(wait=False)
+
+        for executor in self.executors.values():
+            executor.shutdown(wait=False)
+
+        # nothing should keep the clients around for the metrics' sake
+        for client in self.clients.values():
+            client.outbox.close()
+
+        if self.ipc is not None:
+            self.ipc.close()
+
+        if self.journal is not None:
+            self.journal.close()
+            self.journal = None
+
+    def _open_journal(self):
+        path = self.config.core.journal
+
+        if path is not None and self.shard is not None:
+            # workers can't all write to the same file
+            root, ext = (path[:-3], ".gz") if path.endswith(".gz") \
+                else (path, "")
+            path = "{}.{}{}".format(root, self.shard, ext)
+
+        if path is not None:
+            self.journal = JournalWriter(path)
+
+    @property
+    def is_primary(self):
+        """
+        Whether this process runs the shared services, which is always true
+        unless a supervisor runs networks in several processes.
+        """
+        return self.shard is None or self.shard == primary_shard(
+            self.config.core.supervisor, self.config.clients)
+
+    def runs_client(self, name):
+        """
+        Whether this process runs the given network.
+        """
+        return self.shard is None or \
+            shard_of(name, self.config.clients[name]) == self.shard
+
+    def runs_service(self, name):
+        """
+        Whether this process runs the given service. Shared services only
+        run in the primary process.
+        """
+        return self.is_primary or self._qualify_service_name(name) not in \
+            set(self._qualify_service_name(shared) for shared in
+                self.config.core.supervisor.shared_services)
 
     def connect(self, name):
         client = Client.from_config(self, name,
@@ -179,89 +387,384 @@ class Bot:
         self.event_loop.schedule(client.quit)
 
         del self.clients[name]
+        client.outbox.close()
+
+    def _start_executors(self):
+        cpu_count = multiprocessing.cpu_count()
+
+        # first, before any threads are started, in case workers have to be
+        # forked from this process; services' modules are imported in them
+        # as the services are loaded
+        self.process_executor = ProcessExecutor(
+            self.config.core.max_processes or cpu_count)
+
+        pools = {
+            # mostly waiting on the network, so this can be larger
+            "io": {
+                "max_workers": self.config.core.max_workers or cpu_count * 4,
+                "max_queue": 100,
+                "policy": BoundedExecutor.REJECT,
+                "max_per_origin": 5
+            },
+            "cpu": {
+                "max_workers": cpu_count,
+                "max_queue": 50,
+                "policy": BoundedExecutor.DROP_OLDEST,
+                "max_per_origin": 3
+            },
+            "subprocess": {
+                "max_workers": 2,
+                "max_queue": 10,
+                "policy": BoundedExecutor.REJECT,
+                "max_per_origin": 0
+            }
+        }
+
+        self.executors = {}
+
+        for name, settings in pools.items():
+            overrides = self.config.core.executors.get(name, {})
+            settings.update((k, v) for k, v in overrides.items()
+                            if v is not None)
+
+            self.executors[name] = BoundedExecutor(
+                name, settings["max_workers"],
+                max_queue=settings["max_queue"],
+                policy=settings["policy"],
+                max_per_key=settings["max_per_origin"])
+
+        # for anything that still wants the one executor
+        self.executor = self.executors["io"]
+
+
+    def _connect_to_db(self, db_name=None):
+        if db_name is None:
+            db_name = self.config.core.database
 
-    def _connect_to_db(self):
-        db_name = self.config.core.database
         database.initialize(SqliteDatabase(db_name, check_same_thread=True))
         logger.info("Opened database connection: %s", db_name)
         UserDataKVPair.create_table(True)
+        ScheduledJob.create_table(True)
 
     def _connect_to_irc(self):
+        handed_off = self._handoff.pop("clients", {})
+
         for name, config in self.config.clients.items():
-            if config.autoconnect:
+            if name in handed_off:
+                try:
+                    self.clients[name] = Client.from_handoff(
+                        self, name, config, handed_off.pop(name))
+                except:
+                    logger.exception("Couldn't resume connection %s; reconnecting", name)
+                else:
+                    continue
+
+            if config.autoconnect and self.runs_client(name):
                 self.connect(name)
 
+        # networks removed from the config while we were restarting
+        for state in handed_off.values():
+            handoff.socket_from_state(state["socket"]).close()
+
+    def take_inherited_sockets(self, name):
+        """
+        Take the sockets the previous process handed over under the given
+        name, if any.
+        """
+        return [handoff.socket_from_state(state)
+                for state in self._handoff.get("sockets", {}).pop(name, [])]
+
+    def prepare_handoff(self, quit_message):
+        """
+        Get ready to restart without dropping connections.
+
+        Connections which can be handed over are detached, and their state is
+        saved along with any sockets in ``handoff_sockets`` for the next
+        process to pick up. Connections which can't be are quit.
+        """
+        state = {"clients": {}, "sockets": {}}
+
+        for name, client in list(self.clients.items()):
+            if client.can_hand_off:
+                state["clients"][name] = client.handoff_state()
+            else:
+                client.quit(quit_message)
+
+        for name, sockets in self.handoff_sockets.items():
+            state["sockets"][name] = [handoff.socket_state(sock)
+                                      for sock in sockets]
+
+        handoff.save(state)
+        logger.info("Handing off %d client(s)", len(state["clients"]))
+
+    def _import_service(self, name):
+        start = time.monotonic()
+
+        try:
+            importlib.import_module(name)
+        except:
+            # load_service will try again and log it
+            return
+
+        self._import_times[name] = time.monotonic() - start
+
     def _load_services(self):
-        for service, config in self.config.services.items():
-            if config.autoload:
-                try:
-                    self.load_service(service)
-                except:
-                    pass # it gets logged
+        names = [self._qualify_service_name(service)
+                 for service, config in self.config.services.items()
+                 if config.autoload and self.runs_service(service)]
 
-    def defer_from_thread(self, fn, *args, **kwargs):
-        fut = Future()
+        # importing is safe to do in parallel, and much of it is waiting on
+        # the disk or loading extension modules; setting up isn't
+        if self.config.core.import_workers > 1:
+            with ThreadPoolExecutor(self.config.core.import_workers) as pool:
+                list(pool.map(self._import_service, names))
 
-        @coroutine
-        def _callback():
+        for name in names:
             try:
-                r = fn(*args, **kwargs)
-            except Exception as e:
-                fut.set_exception(e)
+                self.load_service(name)
+            except:
+                pass # it gets logged
+
+        for name, timing in sorted(self.service_timings.items(),
+                                   key=lambda x: -sum(x[1].values())):
+            logger.info("%s: import %.3fs, setup %.3fs", name,
+                        timing["import"], timing["setup"])
+
+    def on_loop_thread(self):
+        """
+        Check if we're running on the event loop thread.
+        """
+        return threading.get_ident() == self._loop_thread
+
+    def _run_deferred_call(self, fn, args, kwargs, fut):
+        try:
+            r = fn(*args, **kwargs)
+        except Exception as e:
+            if fut is None:
+                logger.exception("Deferred call error")
             else:
-                if isinstance(r, Future):
-                    try:
-                        r = yield r
-                    except Exception as e:
-                        fut.set_exception(e)
-                    else:
-                        fut.set_result(r)
-                else:
-                    fut.set_result(r)
+                fut.set_exception(e)
+            return
+
+        if fut is None:
+            return
+
+        if isinstance(r, Future):
+            r.add_done_callback(functools.partial(_chain_future, fut))
+        else:
+            fut.set_result(r)
+
+    def _run_deferred(self):
+        with self._deferred_lock:
+            batch = self._deferred
+            self._deferred = collections.deque()
+            self._deferred_scheduled = False
+
+        for fn, args, kwargs, fut in batch:
+            self._run_deferred_call(fn, args, kwargs, fut)
 
-        self.event_loop.schedule(_callback)
+    def _defer(self, fn, args, kwargs, fut):
+        if self.on_loop_thread():
+            self._run_deferred_call(fn, args, kwargs, fut)
+            return
+
+        # only wake the event loop up once for everything queued before it
+        # gets around to running it
+        with self._deferred_lock:
+            self._deferred.append((fn, args, kwargs, fut))
+
+            if self._deferred_scheduled:
+                return
+
+            self._deferred_scheduled = True
+
+        self.event_loop.schedule(self._run_deferred)
+
+    def defer_from_thread(self, fn, *args, **kwargs):
+        """
+        Run a function on the event loop, returning a future for its result.
+
+        If called from the event loop thread, the function is run
+        immediately.
+        """
+        fut = Future()
+        self._defer(fn, args, kwargs, fut)
         return fut
 
+    def call_on_loop(self, fn, *args, **kwargs):
+        """
+        Run a function on the event loop, without waiting for its result.
+        Errors are logged.
+
+        If called from the event loop thread, the function is run
+        immediately.
+        """
+        self._defer(fn, args, kwargs, None)
+
+    def _service_config_loaders(self):
+        loaders = [self.config.services]
+
+        for client_config in self.config.clients.values():
+            loaders.append(client_config.services)
+
+            for channel_config in client_config.channels.values():
+                loaders.append(channel_config.services)
+
+        return [loader for loader in loaders
+                if isinstance(loader, ServiceConfigLoader)]
+
+    def _qualify_service_name(self, name):
+        if name[0] == ".":
+            name = services.__name__ + name
+        return name
+
     def load_service(self, name, reload=False):
         """
         Load a service into the bot.
 
         The service should expose a variable named ``service`` which is an
         instance of ``kochira.service.Service`` and configured appropriately.
-        """
 
-        if name[0] == ".":
-            name = services.__name__ + name
+        Reloading a service which is already loaded also reloads the services
+        which import from it, and hands over the state of those which can
+        export and import it.
+        """
 
-        # ensure that the service's shutdown routine is run
-        if name in self.services:
-            service = self.services[name].service
-            service.run_shutdown(self)
+        name = self._qualify_service_name(name)
 
-        # we create an expando storage first for bots to load any locals they
-        # need
-        service = None
+        if reload and name in self.services:
+            self._reload_services(name)
+            return
 
         try:
+            start = time.monotonic()
             module = importlib.import_module(name)
 
             if reload:
                 module = imp.reload(module)
 
-            if not hasattr(module, "service"):
-                raise RuntimeError("{} is not a valid service".format(name))
+            # if it was imported ahead of time, count that instead
+            import_time = self._import_times.pop(name, None)
+            if import_time is None or reload:
+                import_time = time.monotonic() - start
 
-            service = module.service
-            self.services[service.name] = BoundService(service)
-
-            service.run_setup(self)
+            self._bind_service(module, import_time, self.services.get(name),
+                               reload)
         except:
             logger.exception("Couldn't load service %s", name)
-            if service is not None:
-                del self.services[service.name]
+            self.services.pop(name, None)
             raise
 
-        logger.info("Loaded service %s", name)
+    def _bind_service(self, module, import_time, old=None, reload=False):
+        if not hasattr(module, "service"):
+            raise RuntimeError("{} is not a valid service".format(module.__name__))
+
+        service = module.service
+
+        # build its settings with its own config class, which may have
+        # changed
+        for loader in self._service_config_loaders():
+            loader.rebuild(service.name, service.config_factory)
+
+        self.service_config_cache.clear()
+
+        bound = BoundService(service, make_storage(
+            HookContext(service, self).config.storage, self.ipc, service.name))
+
+        start = time.monotonic()
+
+        if old is not None and old.service.on_export is not None and \
+            service.on_import is not None:
+            state = old.service.run_export(self)
+
+            # what the service needed of us stays as it was
+            bound.contexts = old.contexts
+            self.services[service.name] = bound
+            service.run_import(self, state)
+            how = "handed over state"
+        else:
+            if old is not None:
+                old.service.run_shutdown(self)
+
+            self.services[service.name] = bound
+            service.run_setup(self)
+            how = "set up"
+
+        setup_time = time.monotonic() - start
+
+        if module.__name__ in preload_modules:
+            self.process_executor.preload([module.__name__], reload=reload)
+
+        self.service_timings[service.name] = {"import": import_time,
+                                              "setup": setup_time}
+        SERVICE_LOAD_TIME.labels(service.name, "import").set(import_time)
+        SERVICE_LOAD_TIME.labels(service.name, "setup").set(setup_time)
+
+        logger.info("Loaded service %s in %.3fs (%s)", service.name,
+                    import_time + setup_time, how)
+
+        return service
+
+    def _service_modules(self, name):
+        # a service which is a package is reloaded along with its submodules,
+        # innermost first
+        prefix = name + "."
+        submodules = [module for module in list(sys.modules)
+                      if module.startswith(prefix) and
+                      sys.modules[module] is not None]
+
+        return sorted(submodules, key=lambda m: -m.count(".")) + [name]
+
+    def _service_dependents(self, name):
+        modules = set(self._service_modules(name))
+        dependents = []
+
+        for other in self.services:
+            module = sys.modules.get(other)
+
+            if other in modules or module is None:
+                continue
+
+            for value in list(vars(module).values()):
+                if isinstance(value, types.ModuleType):
+                    origin = value.__name__
+                else:
+                    origin = getattr(value, "__module__", None)
+
+                if origin in modules:
+                    dependents.append(other)
+                    break
+
+        return dependents
+
+    def _reload_services(self, name):
+        names = [name] + self._service_dependents(name)
+
+        if len(names) > 1:
+            logger.info("Reloading %s along with its dependents: %s", name,
+                        ", ".join(names[1:]))
+
+        for name in names:
+            start = time.monotonic()
+
+            # if the new code doesn't load, the old code keeps running
+            try:
+                for module in self._service_modules(name):
+                    imp.reload(sys.modules[module])
+            except:
+                logger.exception("Couldn't reload service %s", name)
+                raise
+
+            import_time = time.monotonic() - start
+            old = self.services[name]
+
+            try:
+                self._bind_service(sys.modules[name], import_time, old, True)
+            except:
+                logger.exception("Couldn't load service %s", name)
+                self.services.pop(name, None)
+                self.service_timings.pop(name, None)
+                raise
 
     def unload_service(self, name):
         """
@@ -277,6 +780,7 @@ class Bot:
             service = self.services[name].service
             service.run_shutdown(self)
             del self.services[name]
+            self.service_timings.pop(name, None)
         except:
             logger.exception("Couldn't unload service %s", name)
             raise
@@ -291,14 +795,16 @@ class Bot:
             for bound in list(self.services.values())
         ]))
 
-    def run_hooks(self, hook, *args, **kwargs):
+    def run_hooks(self, name, *args, **kwargs):
         """
         Attempt to dispatch a command to all command handlers.
         """
 
-        for hook in self.get_hooks(hook):
+        for hook in self.get_hooks(name):
             ctx = HookContext(hook.service, self)
 
+            start = time.monotonic()
+
             try:
                 r = hook(ctx, *args, **kwargs)
 
@@ -306,18 +812,191 @@ class Bot:
                     return Service.EAT
             except BaseException:
                 logger.exception("Hook processing failed")
+            finally:
+                self.watchdog.record_hook(hook, name,
+                                          time.monotonic() - start)
 
     def rehash(self):
         """
-        Reload configuration information.
+        Reload configuration information, and apply whatever changed: connect
+        to or disconnect from networks, join or part channels, and load,
+        unload or reload services.
+
+        Returns the changes, if there was a configuration before.
         """
 
+        start = time.monotonic()
+
         with open(self.config_file, "r") as f:
-            self.config = self.config_class(yaml.load(f))
+            data = yaml.load(f)
+
+        parsed = time.monotonic()
+        old_config = getattr(self, "config", None)
+
+        # check everything up front, so a bad config doesn't replace a good
+        # one
+        new_config = self.config_class(data)
+        new_config.validate()
+
+        self.config = new_config
+
+        self.rehash_timings = {
+            "parse": parsed - start,
+            "construct": time.monotonic() - parsed
+        }
+
+        if old_config is None:
+            self.service_config_cache.clear()
+            return None
+
+        diff = diff_config(old_config, self.config)
+        self._invalidate_service_configs(diff)
+
+        for line in diff.summary():
+            logger.info("Rehash: %s", line)
+
+        self._apply_config_diff(diff)
+        return diff
+
+    def _invalidate_service_configs(self, diff):
+        """
+        Forget the combined settings of services which the configuration
+        changes, and keep the rest.
+        """
+        services = set(self._qualify_service_name(name) for name in
+                       diff.services_added | diff.services_removed |
+                       diff.services_changed)
+        clients = diff.clients_added | diff.clients_removed
+        scopes = set((self._qualify_service_name(service), client, channel)
+                     for service, client, channel in
+                     diff.services_reconfigured)
+
+        for key in list(self.service_config_cache):
+            service, client, channel = key
+
+            if service in services or client in clients or \
+                (service, client, None) in scopes or key in scopes or \
+                channel in diff.channels_removed.get(client, ()):
+                del self.service_config_cache[key]
+
+    def _apply_config_diff(self, diff):
+        for name in diff.clients_removed | diff.clients_reconnected:
+            if name in self.clients:
+                self.disconnect(name)
+
+        for name in diff.clients_added | diff.clients_reconnected:
+            if self.config.clients[name].autoconnect and \
+                self.runs_client(name):
+                try:
+                    self.connect(name)
+                except:
+                    logger.exception("Couldn't connect to %s", name)
+
+        for name, channels in diff.channels_removed.items():
+            client = self.clients.get(name)
+
+            if client is None or not client.connected:
+                continue
+
+            for channel in channels:
+                if client.in_channel(channel):
+                    client.part(channel)
+
+        for name, channels in diff.channels_added.items():
+            client = self.clients.get(name)
+
+            if client is None or not client.connected:
+                continue
+
+            for channel in channels:
+                channel_config = self.config.clients[name].channels[channel]
+
+                if channel_config.autojoin:
+                    client.join(channel, password=channel_config.password)
+
+        for name, channels in diff.channels_changed.items():
+            client = self.clients.get(name)
+
+            if client is None or not client.connected:
+                continue
+
+            for channel in channels:
+                channel_config = self.config.clients[name].channels[channel]
+
+                # e.g. autojoin was turned on, or the password fixed
+                if channel_config.autojoin and not client.in_channel(channel):
+                    client.join(channel, password=channel_config.password)
+
+        for name in diff.services_removed:
+            if self._qualify_service_name(name) in self.services:
+                try:
+                    self.unload_service(name)
+                except:
+                    pass # it gets logged
+
+        for name in diff.services_added | diff.services_changed:
+            qualified_name = self._qualify_service_name(name)
+
+            # reloading reruns the service's setup with its new config
+            if name in diff.services_changed and \
+                qualified_name not in self.services:
+                continue
+
+            if name in diff.services_added and \
+                not self.config.services[name].autoload:
+                continue
+
+            if not self.runs_service(name):
+                continue
+
+            try:
+                self.load_service(name)
+            except:
+                pass # it gets logged
+
+        for client in self.clients.values():
+            client.backlogs.resize()
+
+        for field in sorted(diff.restart_required):
+            logger.warning("Changes to core.%s take effect after a restart", field)
+
+    def startup_report(self):
+        """
+        Format how long each part of startup took, and each service within
+        that, slowest first.
+        """
+        lines = ["Startup:"]
+
+        for phase, duration in self.startup_timings.items():
+            line = "  {:<20} {:8.3f}s".format(phase, duration)
+
+            if phase == "rehash":
+                line += " (parse {parse:.3f}s, construct {construct:.3f}s)" \
+                    .format(**self.rehash_timings)
+
+            lines.append(line)
+
+        lines.append("  {:<20} {:8.3f}s".format(
+            "total", sum(self.startup_timings.values())))
+
+        lines.append("")
+        lines.append("Services:")
+        lines.append("  {:<50} {:>9} {:>9}".format("", "import", "setup"))
+
+        for name, timing in sorted(self.service_timings.items(),
+                                   key=lambda x: -sum(x[1].values())):
+            lines.append("  {:<50} {:8.3f}s {:8.3f}s".format(
+                name, timing["import"], timing["setup"]))
+
+        return "\n".join(lines)
 
     def _handle_sighup(self, signum, frame):
         logger.info("Received SIGHUP; running SIGHUP hooks and rehashing")
 
+        # don't connect, load services and so on from inside a signal handler
+        self.event_loop.schedule(self._rehash_from_signal)
+
+    def _rehash_from_signal(self):
         try:
             self.rehash()
         except Exception as e:
@@ -1,15 +1,52 @@
+import base64
+import collections
+import json
 import logging
-from collections import deque
 import textwrap
+import time
 
 from pydle import Client as _Client
 from pydle.async import Future, coroutine
+from pydle.client import PING_TIMEOUT
+from pydle.connection import Connection
 from pydle.features.rfc1459.protocol import MESSAGE_LENGTH_LIMIT
+from pydle.protocol import identifierify
 
+from . import handoff, metrics
+from .backlog import Backlogs
+from .outbox import Outbox
 from .service import Service, HookContext
+from .util import split_message
 
 logger = logging.getLogger(__name__)
 
+EVENTS = metrics.registry.counter(
+    "kochira_events_total", "Events dispatched to hooks.",
+    ["client", "event"])
+EATEN = metrics.registry.counter(
+    "kochira_hooks_eaten_total", "Hooks that stopped further hooks from running.",
+    ["client", "event", "service"])
+MESSAGES_SENT = metrics.registry.counter(
+    "kochira_messages_sent_total", "Messages sent.",
+    ["client", "command"])
+
+
+def _jsonable_items(d):
+    items = {}
+
+    for k, v in d.items():
+        if isinstance(v, (set, frozenset)):
+            v = sorted(v)
+
+        try:
+            json.dumps(v)
+        except (TypeError, ValueError):
+            continue
+
+        items[k] = v
+
+    return items
+
 
 class Client(_Client):
     RECONNECT_MAX_ATTEMPTS = None
@@ -21,19 +58,22 @@ class Client(_Client):
         self._reconnect_timeout = None
         self._fd = None
 
-        self.backlogs = {}
+        self.backlogs = Backlogs(self)
         self.bot = bot
 
         self.name = name
         self.network = name
 
+        self.outbox = Outbox(self)
+        self._cached_prefix_length = None
+
     @property
     def config(self):
         return self.bot.config.clients[self.name]
 
     @classmethod
-    def from_config(cls, bot, name, config):
-        client = cls(bot, name, config.nickname,
+    def _create(cls, bot, name, config):
+        return cls(bot, name, config.nickname,
             username=config.username,
             realname=config.realname,
             tls_client_cert=config.tls.certificate_file,
@@ -44,6 +84,10 @@ class Client(_Client):
             sasl_password=config.sasl.password
         )
 
+    @classmethod
+    def from_config(cls, bot, name, config):
+        client = cls._create(bot, name, config)
+
         client.connect(
             hostname=config.hostname,
             password=config.password,
@@ -55,6 +99,118 @@ class Client(_Client):
 
         return client
 
+    @classmethod
+    def from_handoff(cls, bot, name, config, state):
+        """
+        Carry on with a connection handed over by the previous process,
+        without reconnecting.
+        """
+        client = cls._create(bot, name, config)
+        client.eventloop = bot.event_loop
+        client.password = config.password
+        client.encoding = state["encoding"]
+
+        connection = Connection(state["hostname"], state["port"],
+                                source_address=(config.source_address, 0),
+                                eventloop=bot.event_loop)
+        connection.socket = handoff.socket_from_state(state["socket"])
+        connection.send_queue = collections.deque(
+            base64.b64decode(data) for data in state["send_queue"])
+        connection.unthrottled_sends = 0
+        connection.last_sent = 0
+        connection.last_sent_pos = 0
+
+        client.connection = connection
+        bot.event_loop.register(connection.socket.fileno())
+        connection.setup_handlers()
+        connection.on("read", client.on_data)
+        connection.on("error", client.on_data_error)
+
+        client._ping_checker_handle = bot.event_loop.schedule_periodically(
+            PING_TIMEOUT / 2, client._check_ping_timeout)
+
+        client._restore_handoff_state(state)
+        logger.info("Resumed connection: %s", name)
+
+        return client
+
+    @property
+    def can_hand_off(self):
+        """
+        Whether the connection can be handed over to another process. TLS
+        connections can't, since their session state can't be.
+        """
+        return self.connected and not self.connection.tls
+
+    def handoff_state(self):
+        """
+        Detach from the connection, and return what another process needs to
+        carry on with it.
+        """
+        connection = self.connection
+
+        connection.remove_handlers()
+        self.eventloop.unregister(connection.socket.fileno())
+        self.eventloop.unschedule(self._ping_checker_handle)
+
+        with connection.send_queue_lock:
+            send_queue = list(connection.send_queue)
+
+            # the first message may have been partly sent already
+            if send_queue and connection.last_sent_pos:
+                send_queue[0] = send_queue[0][connection.last_sent_pos:]
+
+        return {
+            "socket": handoff.socket_state(connection.socket),
+            "hostname": connection.hostname,
+            "port": connection.port,
+            "encoding": self.encoding,
+            "nickname": self.nickname,
+            "isupport": _jsonable_items(self._isupport),
+            "capabilities": _jsonable_items(self._capabilities),
+            "users": {nickname: _jsonable_items(user)
+                      for nickname, user in self.users.items()},
+            "channels": {name: {"users": sorted(channel["users"]),
+                                "topic": channel.get("topic")}
+                         for name, channel in self.channels.items()},
+            "receive_buffer": base64.b64encode(self._receive_buffer).decode("ascii"),
+            "send_queue": [base64.b64encode(data).decode("ascii")
+                           for data in send_queue],
+            "outbox": self.outbox.drain()
+        }
+
+    def _restore_handoff_state(self, state):
+        self.registered = True
+        self.nickname = state["nickname"]
+        self._receive_buffer = base64.b64decode(state["receive_buffer"])
+        self._last_data_received = time.time()
+        self._capabilities.update(state["capabilities"])
+
+        # replay ISUPPORT, so everything derived from it is set up again
+        self._isupport.update(state["isupport"])
+
+        for entry, value in state["isupport"].items():
+            if value is False:
+                continue
+
+            method = "on_isupport_" + identifierify(entry)
+            if hasattr(self, method):
+                getattr(self, method)(None if value is True else value)
+
+        for nickname, user in state["users"].items():
+            self._sync_user(nickname, user)
+
+        for name, channel in state["channels"].items():
+            self._create_channel(name)
+            self.channels[name]["users"] = set(channel["users"])
+            self.channels[name]["topic"] = channel["topic"]
+
+            # modes aren't carried over, so ask for them again
+            self.rawmsg("MODE", name)
+
+        for priority, command, target, message in state["outbox"]:
+            self.outbox.put(command, target, message, priority)
+
     def connect(self, *args, reconnect=False, attempt=0, **kwargs):
         logger.info("Connecting: %s", self.name)
 
@@ -67,17 +223,25 @@ class Client(_Client):
             self.on_disconnect(False)
 
     def on_disconnect(self, expected):
+        self.outbox.clear()
         super().on_disconnect(expected)
         self._run_hooks("disconnect", None, None, [expected])
 
     def _send_message(self, message):
-        self.bot.defer_from_thread(super()._send_message, message)
+        self.bot.call_on_loop(super()._send_message, message)
+
+    def on_data(self, data):
+        if self.bot.journal is not None:
+            self.bot.journal.record(self, data)
+
+        super().on_data(data)
 
     def on_ctcp_version(self, by, what, contents):
         self.ctcp_reply(by, "VERSION", self.bot.config.core.version)
 
     def on_connect(self):
         logger.info("Connected to IRC: %s", self.name)
+        self._cached_prefix_length = None
         super().on_connect()
 
         for name, channel in self.bot.config.clients[self.name].channels.items():
@@ -85,38 +249,49 @@ class Client(_Client):
 
         self._run_hooks("connect", None, None)
 
-    def _autotruncate(self, command, target, message, suffix="..."):
-        hostmask = self._format_user_mask(self.nickname)
-        chunklen = MESSAGE_LENGTH_LIMIT - len("{hostmask} {command} {target} :".format(
-            hostmask=hostmask,
-            command=command,
-            target=target
-        )) - 25
+    def _prefix_length(self):
+        # the server prefixes what we send with our hostmask, which only
+        # changes with our nickname or when we learn our host on joining
+        if self._cached_prefix_length is None:
+            self._cached_prefix_length = len(self._format_user_mask(self.nickname))
+        return self._cached_prefix_length
 
-        if len(message) > chunklen:
-            message = message.encode("utf-8")[:chunklen - len(suffix)] \
-                .decode("utf-8", "ignore") + suffix
+    def _max_message_length(self, command, target):
+        # ":{hostmask} {command} {target} :{message}\r\n", with some leeway
+        return MESSAGE_LENGTH_LIMIT - self._prefix_length() - len(command) - \
+            len(target) - 4 - 25
 
-        return message
+    def _split_message(self, command, target, message):
+        return split_message(message,
+                             self._max_message_length(command, target),
+                             max_lines=self.config.max_lines)
 
-    def message(self, target, message):
-        message = self._autotruncate("PRIVMSG", target, message)
+    def message(self, target, message, priority=Outbox.NORMAL):
+        self.bot.call_on_loop(self._queue_message, "PRIVMSG", target, message,
+                              priority)
 
-        @self.bot.defer_from_thread
-        def _callback():
-            super(Client, self).message(target, message)
-            self._add_to_backlog(target, self.nickname, message)
-            self._run_hooks("own_message", target, self.nickname, [target, message])
+    def notice(self, target, message, priority=Outbox.NORMAL):
+        self.bot.call_on_loop(self._queue_message, "NOTICE", target, message,
+                              priority)
+
+    def _queue_message(self, command, target, message, priority):
+        for line in self._split_message(command, target, message):
+            self.outbox.put(command, target, line, priority)
 
-    def notice(self, target, message):
-        message = self._autotruncate("PRIVMSG", target, message)
+    def _deliver(self, command, target, message):
+        MESSAGES_SENT.labels(self.name, command).inc()
 
-        @self.bot.defer_from_thread
-        def _callback():
-            super(Client, self).notice(target, message)
+        if command == "NOTICE":
+            super().notice(target, message)
             self._run_hooks("own_notice", target, self.nickname, [target, message])
+        else:
+            super().message(target, message)
+            self._add_to_backlog(target, self.nickname, message)
+            self._run_hooks("own_message", target, self.nickname, [target, message])
 
     def _run_hooks(self, name, target, origin, args=None, kwargs=None):
+        EVENTS.labels(self.name, name).inc()
+
         @coroutine
         def _coro():
             nonlocal args, kwargs
@@ -133,13 +308,20 @@ class Client(_Client):
                 if not ctx.config.enabled:
                     continue
 
+                start = time.monotonic()
+
                 try:
-                    r = hook(ctx, *args, **kwargs)
+                    try:
+                        r = hook(ctx, *args, **kwargs)
+                    finally:
+                        self.bot.watchdog.record_hook(hook, name,
+                                                      time.monotonic() - start)
 
                     if isinstance(r, Future):
                         r = yield r
 
                     if r is Service.EAT:
+                        EATEN.labels(self.name, name, hook.service.name).inc()
                         logging.debug("EAT suppressed further hooks.")
                         return Service.EAT
                 except BaseException:
@@ -156,22 +338,22 @@ class Client(_Client):
         return fut
 
     def _add_to_backlog(self, target, by, message):
-        backlog = self.backlogs.setdefault(target, deque([]))
-        backlog.appendleft((by, message))
-
-        while len(backlog) > self.bot.config.core.max_backlog:
-            backlog.pop()
+        self.backlogs.add(target, by, message)
 
     def on_invite(self, channel, by):
         self._run_hooks("invite", by, by, [channel, by])
 
     def on_join(self, channel, user):
+        if self.normalize(user) == self.normalize(self.nickname):
+            self._cached_prefix_length = None
         self._run_hooks("join", channel, user, [channel, user])
 
     def on_kill(self, target, by, reason):
         self._run_hooks("kill", by, by, [target, by, reason])
 
     def on_kick(self, channel, target, by, reason=None):
+        if self.normalize(target) == self.normalize(self.nickname):
+            self.backlogs.discard(channel)
         self._run_hooks("kick", channel, by, [channel, target, by, reason])
 
     def on_mode_change(self, channel, modes, by):
@@ -189,6 +371,8 @@ class Client(_Client):
         self._run_hooks("private_message", by, by, [by, message])
 
     def on_nick_change(self, old, new):
+        if self.normalize(new) == self.normalize(self.nickname):
+            self._cached_prefix_length = None
         self._run_hooks("nick_change", new, new, [old, new])
 
     def on_channel_notice(self, target, by, message):
@@ -198,6 +382,8 @@ class Client(_Client):
         self._run_hooks("private_notice", by, by, [by, message])
 
     def on_part(self, channel, user, message=None):
+        if self.normalize(user) == self.normalize(self.nickname):
+            self.backlogs.discard(channel)
         self._run_hooks("part", channel, user, [channel, user, message])
 
     def on_topic_change(self, channel, message, by):
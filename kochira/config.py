@@ -5,6 +5,53 @@ def _id(x):
     return x
 
 
+class ConfigError(ValueError):
+    """
+    A configuration value is missing or of the wrong type. ``path`` says
+    where, e.g. ``clients.freenode.hostname``.
+    """
+
+    def __init__(self, path, message):
+        self.path = path
+        self.message = message
+
+        super().__init__("{}: {}".format(path, message) if path else message)
+
+    def within(self, key):
+        """
+        The same error, seen from the configuration containing this one.
+        """
+        return ConfigError("{}.{}".format(key, self.path) if self.path
+                           else str(key), self.message)
+
+
+def _unpack(type, key, value):
+    try:
+        return type(value)
+    except ConfigError as e:
+        raise e.within(key)
+    except (TypeError, ValueError, AttributeError) as e:
+        raise ConfigError(str(key), str(e)) from e
+
+
+class FrozenDict(dict):
+    """
+    A dict which can't be changed, so that it can be shared as part of a
+    configuration.
+    """
+
+    __slots__ = ()
+
+    def _read_only(self, *args, **kwargs):
+        raise TypeError("configuration is read-only")
+
+    __setitem__ = __delitem__ = clear = pop = popitem = setdefault = \
+        update = _read_only
+
+    def __reduce__(self):
+        return (self.__class__, (dict(self),))
+
+
 class Field:
     _sentinel = object()
     _total_creation_order = 0
@@ -17,29 +64,33 @@ class Field:
         self.__class__._total_creation_order += 1
 
     def unpack(self, value):
-        return self.type(value)
+        return _unpack(self.type, self.name, value)
 
-    def __get__(self, obj, type=None):
-        if obj is None:
-            return self
+    @property
+    def required(self):
+        return self.default is Field._sentinel and \
+            not hasattr(self.type, "get_default")
 
-        v = obj._fields.get(self.name, self.default)
+    def get_default(self):
+        if self.default is not Field._sentinel:
+            return self.default
 
-        if v is Field._sentinel:
-            if hasattr(self.type, "get_default"):
-                return self.type.get_default()
+        return self.type.get_default()
 
-            raise AttributeError(self.name)
 
-        return v
+class ConfigMeta(abc.ABCMeta):
+    def __new__(cls, name, bases, dct):
+        fields = {k: f for k, f in dct.items() if isinstance(f, Field)}
 
-    def __set__(self, obj, v):
-        obj._fields[self.name] = v
+        # each field gets a slot, which is filled in with its value or
+        # default when the configuration is built, so reading a field is
+        # just reading an attribute
+        for k in fields:
+            del dct[k]
 
+        dct.setdefault("__slots__", tuple(fields))
 
-class ConfigMeta(abc.ABCMeta):
-    def __new__(cls, name, bases, dct):
-        newcls = type.__new__(cls, name, bases, dct)
+        newcls = super().__new__(cls, name, bases, dct)
 
         newcls._field_mappings = {}
 
@@ -47,9 +98,7 @@ class ConfigMeta(abc.ABCMeta):
             if hasattr(base, "_field_mappings"):
                 newcls._field_mappings.update(base._field_mappings)
 
-        for k, f in dct.items():
-            if not isinstance(f, Field):
-                continue
+        for k, f in fields.items():
             f.name = k
             newcls._field_mappings[k] = f
 
@@ -59,18 +108,54 @@ class ConfigMeta(abc.ABCMeta):
         return newcls
 
 
-class Config(collections.MutableMapping, metaclass=ConfigMeta):
+class Config(collections.Mapping, metaclass=ConfigMeta):
+    """
+    A configuration section, built once from the values given and read-only
+    afterwards.
+
+    Values are converted to their fields' types when the configuration is
+    built, raising ``ConfigError`` if they can't be. Values which aren't
+    given are left out of the mapping, but read as their defaults.
+    """
+
+    __slots__ = ("_fields",)
+
     def __init__(self, values=None):
         if values is None:
             values = {}
 
-        self._fields = {}
+        if not isinstance(values, collections.Mapping):
+            raise ConfigError("", "expected a mapping, not {!r}".format(values))
+
+        fields = {}
 
         for k, v in values.items():
             if k in self._field_mappings:
                 v = self._field_mappings[k].unpack(v)
 
-            self._fields[k] = v
+            fields[k] = v
+
+        object.__setattr__(self, "_fields", fields)
+
+        for field in self._field_defs:
+            if field.name in fields:
+                v = fields[field.name]
+            elif field.required:
+                # reading it raises AttributeError
+                continue
+            else:
+                v = field.get_default()
+
+            object.__setattr__(self, field.name, v)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("configuration is read-only")
+
+    def __delattr__(self, name):
+        raise AttributeError("configuration is read-only")
+
+    def __reduce__(self):
+        return (self.__class__, (self._fields,))
 
     def __repr__(self):
         return "{}({})".format(
@@ -78,6 +163,22 @@ class Config(collections.MutableMapping, metaclass=ConfigMeta):
             ", ".join("{}={!r}".format(k, v) for k, v in self._fields.items())
         )
 
+    def validate(self):
+        """
+        Check that every required field is set, here and in the
+        configurations within this one.
+        """
+        for field in self._field_defs:
+            if field.name not in self._fields:
+                if field.required:
+                    raise ConfigError(field.name, "required, but not set")
+                continue
+
+            try:
+                _validate(self._fields[field.name])
+            except ConfigError as e:
+                raise e.within(field.name)
+
     @staticmethod
     def _resolve(mine, other):
         if isinstance(mine, Config):
@@ -85,9 +186,9 @@ class Config(collections.MutableMapping, metaclass=ConfigMeta):
             return mine.combine(other)
         elif isinstance(mine, dict):
             # if they're a dict, then we compose other into mine
-            d = mine.copy()
+            d = dict(mine)
             d.update(other)
-            return d
+            return FrozenDict(d)
         else:
             return other
 
@@ -122,12 +223,6 @@ class Config(collections.MutableMapping, metaclass=ConfigMeta):
     def __getitem__(self, name):
         return self._fields[name]
 
-    def __setitem__(self, name, value):
-        self._fields[name] = value
-
-    def __delitem__(self, name):
-        raise TypeError("does not support item deletion")
-
     def __iter__(self):
         return iter(self._fields)
 
@@ -135,12 +230,30 @@ class Config(collections.MutableMapping, metaclass=ConfigMeta):
         return len(self._fields)
 
 
+def _validate(value):
+    if isinstance(value, dict):
+        for k, v in value.items():
+            try:
+                _validate(v)
+            except ConfigError as e:
+                raise e.within(k)
+    elif hasattr(value, "validate"):
+        # configurations, and mappings of them which build their own
+        value.validate()
+
+
 class Mapping:
     def __init__(self, type):
         self.type = type
 
     def __call__(self, m):
-        return {k: self.type(v) for k, v in m.items()}
+        if m is None:
+            m = {}
+
+        if not isinstance(m, collections.Mapping):
+            raise ConfigError("", "expected a mapping, not {!r}".format(m))
+
+        return FrozenDict((k, _unpack(self.type, k, v)) for k, v in m.items())
 
     def interior_type(self):
         if hasattr(self.type, "interior_type"):
@@ -149,7 +262,7 @@ class Mapping:
         return self.type
 
     def get_default(self):
-        return {}
+        return FrozenDict()
 
 
 class Many:
@@ -158,10 +271,17 @@ class Many:
         self.is_set = is_set
 
     def __call__(self, xs):
-        ys = [self.type(x) for x in xs]
+        if xs is None:
+            xs = []
+
+        if isinstance(xs, (str, bytes, collections.Mapping)):
+            raise ConfigError("", "expected a list, not {!r}".format(xs))
+
+        ys = [_unpack(self.type, i, x) for i, x in enumerate(xs)]
+
         if self.is_set:
-            ys = set(ys)
-        return ys
+            return frozenset(ys)
+        return tuple(ys)
 
     def interior_type(self):
         if hasattr(self.type, "interior_type"):
@@ -170,4 +290,4 @@ class Many:
         return self.type
 
     def get_default(self):
-        return [] if not self.is_set else set([])
+        return () if not self.is_set else frozenset()
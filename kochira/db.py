@@ -1,9 +1,25 @@
 import threading
+import time
 
 from peewee import Proxy, Model, SqliteDatabase
 
+from . import metrics
+
 database = Proxy()
 
+QUERY_TIME = metrics.registry.histogram(
+    "kochira_db_query_seconds", "Time spent executing database queries.")
+
+
+class SqliteDatabase(SqliteDatabase):
+    def execute_sql(self, *args, **kwargs):
+        start = time.monotonic()
+
+        try:
+            return super().execute_sql(*args, **kwargs)
+        finally:
+            QUERY_TIME.labels().observe(time.monotonic() - start)
+
 
 class Model(Model):
     class Meta:
@@ -0,0 +1,284 @@
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, Future, wait
+
+import collections
+import imp
+import importlib
+import logging
+import multiprocessing
+import pickle
+import sys
+import threading
+import traceback
+
+from . import metrics
+from .util import LazyModule
+
+logger = logging.getLogger(__name__)
+
+QUEUE_DEPTH = metrics.registry.gauge(
+    "kochira_executor_queue_depth",
+    "Background work waiting for an executor thread.", ["pool"])
+REJECTED = metrics.registry.counter(
+    "kochira_executor_rejected_total",
+    "Background work rejected or dropped because a queue was full.",
+    ["pool", "reason"])
+
+
+# modules with functions to run in worker processes, to import ahead of time
+preload_modules = set([])
+
+
+class Rejected(Exception):
+    """
+    Raised when work is rejected by, or dropped from, an executor pool.
+    """
+
+
+class RemoteError(Exception):
+    """
+    Raised when work in a worker process fails, with the traceback from the
+    worker as the message.
+    """
+
+
+class BoundedExecutor(ThreadPoolExecutor):
+    """
+    A thread pool with a bounded queue.
+
+    When the queue is full, the ``reject`` policy rejects the new work and the
+    ``drop_oldest`` policy drops the oldest queued work to make room for it.
+    Work can also be keyed, e.g. by the user who asked for it, to limit how
+    much work any one key can have queued or running at once.
+    """
+
+    REJECT = "reject"
+    DROP_OLDEST = "drop_oldest"
+
+    def __init__(self, name, max_workers, max_queue=0, policy=REJECT,
+                 max_per_key=0):
+        if policy not in (self.REJECT, self.DROP_OLDEST):
+            raise ValueError("unknown policy: {}".format(policy))
+
+        super().__init__(max_workers)
+
+        self.name = name
+        self.max_queue = max_queue
+        self.policy = policy
+        self.max_per_key = max_per_key
+
+        self._queued = collections.deque()
+        self._per_key = collections.Counter()
+        # cancelling work runs its callbacks, which take the lock again
+        self._lock = threading.RLock()
+
+        QUEUE_DEPTH.labels(name).set_function(self._work_queue.qsize)
+
+    def shutdown(self, wait=True):
+        QUEUE_DEPTH.remove(self.name)
+        super().shutdown(wait)
+
+    def _reject(self, reason, message):
+        REJECTED.labels(self.name, reason).inc()
+        raise Rejected("{} pool: {}".format(self.name, message))
+
+    def submit(self, fn, *args, **kwargs):
+        return self.submit_keyed(None, fn, *args, **kwargs)
+
+    def submit_keyed(self, key, fn, *args, **kwargs):
+        """
+        Submit work on behalf of ``key``.
+
+        The returned future fails with ``Rejected`` if the work is dropped
+        before it gets to run.
+        """
+        with self._lock:
+            # work is started in order, so anything running or finished is at
+            # the front
+            while self._queued and (self._queued[0].running() or
+                                    self._queued[0].done()):
+                self._queued.popleft()
+
+            if key is not None and self.max_per_key and \
+                self._per_key[key] >= self.max_per_key:
+                self._reject("per_key", "too much work for {!r}".format(key))
+
+            if self.max_queue and len(self._queued) >= self.max_queue:
+                if self.policy == self.DROP_OLDEST:
+                    REJECTED.labels(self.name, "dropped").inc()
+                    self._queued.popleft().cancel()
+                else:
+                    self._reject("queue_full", "queue full")
+
+            inner = super().submit(fn, *args, **kwargs)
+            self._queued.append(inner)
+
+            if key is not None:
+                self._per_key[key] += 1
+
+        outer = Future()
+
+        def _done(inner):
+            if key is not None:
+                with self._lock:
+                    self._per_key[key] -= 1
+                    if not self._per_key[key]:
+                        del self._per_key[key]
+
+            if inner.cancelled():
+                outer.set_exception(Rejected("{} pool: dropped".format(self.name)))
+            elif inner.exception() is not None:
+                outer.set_exception(inner.exception())
+            else:
+                outer.set_result(inner.result())
+
+        inner.add_done_callback(_done)
+        return outer
+
+
+# in a worker process, the generation of each module it last imported, so it
+# can tell when the bot has reloaded one since
+_module_generations = {}
+
+
+def _import_module(name, generation):
+    if name in sys.modules and \
+        _module_generations.get(name, 0) != generation:
+        module = imp.reload(sys.modules[name])
+    else:
+        module = importlib.import_module(name)
+
+    _module_generations[name] = generation
+    return module
+
+
+def _import_modules(generations):
+    for name, generation in generations.items():
+        module = _import_module(name, generation)
+
+        # anything imported lazily is wanted here, so import it now
+        for value in list(vars(module).values()):
+            if isinstance(value, LazyModule):
+                value._load()
+
+
+def _call_in_process(fn, args, kwargs, generation=0):
+    # if the bot has reloaded fn's module since this worker last imported it,
+    # reload it here too and find fn again in it; a worker which has never
+    # seen the newest generation can't tell whether unpickling fn imported
+    # the module before or after the reload, so it reloads it to be sure
+    if _module_generations.get(fn.__module__, 0) != generation:
+        fn = getattr(_import_module(fn.__module__, generation), fn.__name__)
+
+    # a decorated function is pickled by name, which finds the wrapper again
+    fn = getattr(fn, "__wrapped__", fn)
+
+    try:
+        return pickle.dumps(fn(*args, **kwargs), pickle.HIGHEST_PROTOCOL)
+    except Exception:
+        # the original exception may not pickle, so send back its traceback
+        raise RemoteError(traceback.format_exc())
+
+
+def _mp_context():
+    # forking while other threads are running can deadlock the child, if one
+    # of them held a lock (logging, sqlite, the import lock) at the time, so
+    # start workers from a clean process instead
+    if "forkserver" in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context("forkserver")
+    return multiprocessing.get_context("spawn")
+
+
+class ProcessExecutor(ProcessPoolExecutor):
+    """
+    A pool of worker processes, for CPU-bound work that would otherwise hold
+    the GIL.
+
+    Functions, arguments and results are pickled on the way in and out, so
+    functions must be importable by name, e.g. defined at module level.
+    Results are unpickled off the event loop, in the executor's management
+    thread.
+    """
+
+    def __init__(self, max_workers):
+        if sys.version_info >= (3, 7):
+            super().__init__(max_workers, mp_context=_mp_context())
+        else:
+            # workers can only be forked here, so fork them all now: this
+            # must be created before any other threads are started
+            super().__init__(max_workers)
+            wait([super(ProcessExecutor, self).submit(int)
+                  for _ in range(max_workers)])
+
+        self.max_workers = max_workers
+        self._pending = 0
+        self._lock = threading.Lock()
+
+        # how many times each module has been reloaded, so workers know to
+        # reload it too
+        self._generations = collections.Counter()
+
+        QUEUE_DEPTH.labels("process").set_function(lambda: self._pending)
+
+    def shutdown(self, wait=True):
+        QUEUE_DEPTH.remove("process")
+        super().shutdown(wait)
+
+    def preload(self, names, reload=False):
+        """
+        Import modules in the worker processes ahead of time, so the first
+        work to use them doesn't pay for the import. ``reload`` says the
+        modules have been reloaded here.
+
+        One job is sent per worker, which is best effort: an idle worker may
+        take more than one, and another none. Workers check that they have
+        the newest version of a function's module before every call anyway,
+        so one that missed a reload reloads the module then.
+        """
+        if reload:
+            for name in names:
+                self._generations[name] += 1
+
+        generations = {name: self._generations[name] for name in names}
+
+        for _ in range(self.max_workers):
+            super().submit(_import_modules, generations) \
+                .add_done_callback(self._preload_done)
+
+    def _preload_done(self, fut):
+        exc = fut.exception()
+        if exc is not None:
+            logger.error("Couldn't preload modules in worker process",
+                         exc_info=(exc.__class__, exc, exc.__traceback__))
+
+    def submit(self, fn, *args, **kwargs):
+        inner = super().submit(_call_in_process, fn, args, kwargs,
+                               self._generations[fn.__module__])
+
+        with self._lock:
+            self._pending += 1
+
+        outer = Future()
+
+        def _done(inner):
+            with self._lock:
+                self._pending -= 1
+
+            if inner.cancelled():
+                outer.cancel()
+                return
+
+            exc = inner.exception()
+
+            if exc is not None:
+                outer.set_exception(exc)
+                return
+
+            try:
+                result = pickle.loads(inner.result())
+            except Exception as e:
+                outer.set_exception(e)
+            else:
+                outer.set_result(result)
+
+        inner.add_done_callback(_done)
+        return outer
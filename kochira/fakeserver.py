@@ -0,0 +1,970 @@
+import collections
+import inspect
+import logging
+import random
+import threading
+import time
+
+from tornado.ioloop import IOLoop, PeriodicCallback
+from tornado.iostream import StreamClosedError
+from tornado.netutil import bind_sockets
+from tornado.tcpserver import TCPServer
+
+from .util import percentile
+
+logger = logging.getLogger(__name__)
+
+# the channel modes understood, by how they take parameters
+LIST_MODES = "b"
+PARAMETER_MODES = "k"
+SET_PARAMETER_MODES = "l"
+FLAG_MODES = "imnst"
+PREFIX_MODES = collections.OrderedDict([("o", "@"), ("v", "+")])
+
+CAPABILITIES = {"multi-prefix"}
+
+_RFC1459_LOWER = str.maketrans("ABCDEFGHIJKLMNOPQRSTUVWXYZ[]\\~",
+                               "abcdefghijklmnopqrstuvwxyz{}|^")
+
+
+def normalize(name):
+    """
+    Normalize a nickname or channel name, with RFC1459 case mapping.
+    """
+    return name.translate(_RFC1459_LOWER)
+
+
+def parse_line(line):
+    """
+    Parse a line from a client into ``(command, params)``. Tags and the
+    source, if any, are dropped.
+    """
+    if line.startswith("@"):
+        line = line.partition(" ")[2]
+
+    if line.startswith(":"):
+        line = line.partition(" ")[2]
+
+    line, separator, trailing = line.partition(" :")
+    params = line.split()
+
+    if not params:
+        return None, []
+
+    if separator:
+        params.append(trailing)
+
+    return params[0].upper(), params[1:]
+
+
+def format_line(source, command, *params):
+    """
+    Format a line to send to a client.
+    """
+    params = [str(param) for param in params]
+
+    if params and (not params[-1] or " " in params[-1] or
+                   params[-1].startswith(":")):
+        params[-1] = ":" + params[-1]
+
+    return " ".join(([":" + source] if source else []) + [command] + params)
+
+
+class User:
+    """
+    A user on the fake server: either a client connected to it, or a user
+    simulated by the server itself, which has no connection.
+    """
+
+    def __init__(self, nickname, username="user", hostname="localhost",
+                 realname="", session=None):
+        self.nickname = nickname
+        self.username = username
+        self.hostname = hostname
+        self.realname = realname
+        self.session = session
+        self.channels = set()
+
+    @property
+    def key(self):
+        return normalize(self.nickname)
+
+    @property
+    def mask(self):
+        return "{}!{}@{}".format(self.nickname, self.username, self.hostname)
+
+    @property
+    def simulated(self):
+        return self.session is None
+
+    def send(self, line):
+        if self.session is not None:
+            self.session.send(line)
+
+
+class Channel:
+    """
+    A channel on the fake server.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.created = int(time.time())
+        self.topic = None
+        self.topic_by = None
+        self.topic_at = None
+        self.modes = {"n": None, "t": None}
+        self.bans = []
+
+        # keys of members, to the prefix modes they have
+        self.members = collections.OrderedDict()
+
+    @property
+    def key(self):
+        return normalize(self.name)
+
+    def prefixes(self, user, multi_prefix=False):
+        modes = self.members.get(user.key, set())
+        prefixes = "".join(prefix for mode, prefix in PREFIX_MODES.items()
+                           if mode in modes)
+        return prefixes if multi_prefix else prefixes[:1]
+
+    def mode_string(self):
+        flags = "".join(sorted(self.modes))
+        params = [self.modes[mode] for mode in sorted(self.modes)
+                  if self.modes[mode] is not None]
+        return ["+" + flags] + params
+
+
+class Session:
+    """
+    A connection to the fake server, speaking just enough of RFC1459 and
+    IRCv3 capability negotiation for a client to register, join channels,
+    talk and look people up.
+    """
+
+    # commands allowed before registering
+    PRE_REGISTRATION = {"CAP", "PASS", "NICK", "USER", "PING", "PONG", "QUIT"}
+
+    def __init__(self, server, stream, address):
+        self.server = server
+        self.stream = stream
+        self.address = address
+
+        self.user = None
+        self.nickname = None
+        self.username = None
+        self.realname = None
+        self.capabilities = set()
+        self.negotiating = False
+
+    @property
+    def registered(self):
+        return self.user is not None
+
+    @property
+    def target(self):
+        if self.user is not None:
+            return self.user.nickname
+
+        return self.nickname or "*"
+
+    def start(self):
+        self._read()
+
+    def send(self, line):
+        if self.stream.closed():
+            return
+
+        self.server.sent_lines += 1
+
+        try:
+            self.stream.write(line.encode("utf-8") + b"\r\n")
+        except StreamClosedError:
+            pass
+
+    def reply(self, numeric, *params):
+        self.send(format_line(self.server.hostname, numeric, self.target,
+                              *params))
+
+    def close(self):
+        self.stream.close()
+
+    def _read(self):
+        try:
+            self.stream.read_until(b"\n", self._on_data)
+        except StreamClosedError:
+            pass
+
+    def _on_data(self, data):
+        line = data.decode("utf-8", "replace").rstrip("\r\n")
+
+        if line:
+            self.server.received_lines += 1
+            command, params = parse_line(line)
+
+            if command is not None:
+                self._dispatch(command, params)
+
+        if not self.stream.closed():
+            self._read()
+
+    def _dispatch(self, command, params):
+        if not self.registered and command not in self.PRE_REGISTRATION:
+            self.reply("451", "You have not registered")
+            return
+
+        handler = getattr(self, "on_" + command.lower(), None)
+
+        if handler is None:
+            self.reply("421", command, "Unknown command")
+            return
+
+        try:
+            inspect.signature(handler).bind(*params)
+        except TypeError:
+            self.reply("461", command, "Not enough parameters")
+            return
+
+        try:
+            handler(*params)
+        except Exception:
+            logger.exception("Handling %s failed", command)
+            return
+
+        if self.registered:
+            for observer in self.server.observers:
+                observer(self.user, command, params)
+
+    def closed(self):
+        if self.user is not None:
+            self.server.quit(self.user, "Connection closed")
+            self.user = None
+
+    def _try_register(self):
+        if self.registered or self.negotiating or self.nickname is None or \
+           self.username is None:
+            return
+
+        self.user = User(self.nickname, self.username, self.address[0],
+                         self.realname, session=self)
+        self.server.add_user(self.user)
+        self.server.welcome(self)
+
+    def on_cap(self, subcommand, *args):
+        subcommand = subcommand.upper()
+
+        if subcommand == "LS":
+            if not self.registered:
+                self.negotiating = True
+            self.send(format_line(self.server.hostname, "CAP", self.target,
+                                  "LS", " ".join(sorted(CAPABILITIES))))
+        elif subcommand == "LIST":
+            self.send(format_line(self.server.hostname, "CAP", self.target,
+                                  "LIST", " ".join(sorted(self.capabilities))))
+        elif subcommand == "REQ":
+            requested = args[0].split()
+
+            if all(capability.lstrip("-") in CAPABILITIES
+                   for capability in requested):
+                for capability in requested:
+                    if capability.startswith("-"):
+                        self.capabilities.discard(capability[1:])
+                    else:
+                        self.capabilities.add(capability)
+                reply = "ACK"
+            else:
+                reply = "NAK"
+
+            self.send(format_line(self.server.hostname, "CAP", self.target,
+                                  reply, args[0]))
+        elif subcommand == "END":
+            self.negotiating = False
+            self._try_register()
+        else:
+            self.reply("410", subcommand, "Invalid CAP command")
+
+    def on_pass(self, password):
+        pass
+
+    def on_nick(self, nickname):
+        other = self.server.users.get(normalize(nickname))
+
+        if other is not None and other is not self.user:
+            self.reply("433", nickname, "Nickname is already in use")
+            return
+
+        if self.registered:
+            self.server.change_nickname(self.user, nickname)
+        else:
+            self.nickname = nickname
+            self._try_register()
+
+    def on_user(self, username, mode, unused, realname):
+        if self.registered:
+            self.reply("462", "You may not reregister")
+            return
+
+        self.username = username
+        self.realname = realname
+        self._try_register()
+
+    def on_ping(self, token, *args):
+        self.send(format_line(self.server.hostname, "PONG",
+                              self.server.hostname, token))
+
+    def on_pong(self, *args):
+        pass
+
+    def on_quit(self, reason="Quit"):
+        if self.user is not None:
+            self.server.quit(self.user, "Quit: " + reason)
+            self.user = None
+
+        self.close()
+
+    def on_join(self, names, keys=""):
+        keys = keys.split(",")
+
+        for i, name in enumerate(names.split(",")):
+            if not name.startswith("#"):
+                self.reply("403", name, "No such channel")
+                continue
+
+            channel = self.server.channels.get(normalize(name))
+
+            if channel is not None:
+                key = keys[i] if i < len(keys) else None
+
+                if channel.modes.get("k") not in (None, key):
+                    self.reply("475", channel.name,
+                               "Cannot join channel (+k)")
+                    continue
+
+                if "l" in channel.modes and \
+                   len(channel.members) >= int(channel.modes["l"]):
+                    self.reply("471", channel.name,
+                               "Cannot join channel (+l)")
+                    continue
+
+            self.server.join(self.user, name)
+
+    def on_part(self, names, reason=""):
+        for name in names.split(","):
+            channel = self.server.channels.get(normalize(name))
+
+            if channel is None:
+                self.reply("403", name, "No such channel")
+            elif self.user.key not in channel.members:
+                self.reply("442", channel.name, "You're not on that channel")
+            else:
+                self.server.part(self.user, name, reason)
+
+    def _message(self, command, target, text):
+        if target.startswith("#"):
+            channel = self.server.channels.get(normalize(target))
+
+            if channel is None:
+                self.reply("403", target, "No such channel")
+                return
+
+            if "n" in channel.modes and self.user.key not in channel.members:
+                self.reply("404", channel.name, "Cannot send to channel")
+                return
+        elif normalize(target) not in self.server.users:
+            self.reply("401", target, "No such nick/channel")
+            return
+
+        self.server.message(self.user, command, target, text)
+
+    def on_privmsg(self, target, text):
+        self._message("PRIVMSG", target, text)
+
+    def on_notice(self, target, text):
+        self._message("NOTICE", target, text)
+
+    def on_topic(self, name, *args):
+        channel = self.server.channels.get(normalize(name))
+
+        if channel is None:
+            self.reply("403", name, "No such channel")
+        elif args:
+            if "t" in channel.modes and \
+               "o" not in channel.members.get(self.user.key, ()):
+                self.reply("482", channel.name, "You're not channel operator")
+            else:
+                self.server.set_topic(self.user, name, args[0])
+        elif channel.topic is None:
+            self.reply("331", channel.name, "No topic is set")
+        else:
+            self.reply("332", channel.name, channel.topic)
+            self.reply("333", channel.name, channel.topic_by,
+                       channel.topic_at)
+
+    def on_names(self, names=None):
+        if names is None:
+            self.reply("366", "*", "End of /NAMES list")
+            return
+
+        for name in names.split(","):
+            self.server.send_names(self, name)
+
+    def on_who(self, mask, *args):
+        channel = self.server.channels.get(normalize(mask))
+
+        if channel is not None:
+            users = [self.server.users[key] for key in channel.members]
+        else:
+            user = self.server.users.get(normalize(mask))
+            users = [user] if user is not None else []
+
+        for user in users:
+            flags = "H" + (channel.prefixes(user, True)
+                           if channel is not None else "")
+            self.reply("352", channel.name if channel is not None else "*",
+                       user.username, user.hostname, self.server.hostname,
+                       user.nickname, flags, "0 " + user.realname)
+
+        self.reply("315", mask, "End of /WHO list")
+
+    def on_whois(self, *args):
+        for nickname in args[-1].split(","):
+            user = self.server.users.get(normalize(nickname))
+
+            if user is None:
+                self.reply("401", nickname, "No such nick/channel")
+            else:
+                self.reply("311", user.nickname, user.username, user.hostname,
+                           "*", user.realname)
+
+                channels = [self.server.channels[key] for key in user.channels]
+
+                if channels:
+                    self.reply("319", user.nickname, " ".join(
+                        channel.prefixes(user) + channel.name
+                        for channel in channels))
+
+                self.reply("312", user.nickname, self.server.hostname,
+                           self.server.network)
+
+            self.reply("318", nickname, "End of /WHOIS list")
+
+    def on_mode(self, target, *args):
+        if not target.startswith("#"):
+            if normalize(target) != self.user.key:
+                self.reply("502", "Cannot change mode for other users")
+            elif not args:
+                self.reply("221", "+i")
+            return
+
+        channel = self.server.channels.get(normalize(target))
+
+        if channel is None:
+            self.reply("403", target, "No such channel")
+            return
+
+        if not args:
+            self.reply("324", channel.name, *channel.mode_string())
+            self.reply("329", channel.name, channel.created)
+            return
+
+        if args == ("+b",) or args == ("b",):
+            for mask in channel.bans:
+                self.reply("367", channel.name, mask)
+            self.reply("368", channel.name, "End of channel ban list")
+            return
+
+        if "o" not in channel.members.get(self.user.key, ()):
+            self.reply("482", channel.name, "You're not channel operator")
+            return
+
+        self.server.set_modes(self.user, target, args[0], list(args[1:]))
+
+
+class FakeServer(TCPServer):
+    """
+    An IRC server for the bot to connect to in tests and benchmarks, with no
+    network needed.
+
+    It keeps everything in memory, has no services, and trusts everyone: it
+    only does as much as a client needs to run against it. Users can also be
+    simulated by the server itself, with ``add_user`` and the methods which
+    take a user, e.g. to generate load with ``LoadGenerator``.
+    """
+
+    def __init__(self, hostname="irc.kochira.test", network="KochiraTest",
+                 io_loop=None):
+        super().__init__(io_loop=io_loop)
+
+        self.hostname = hostname
+        self.network = network
+        self.created = time.strftime("%Y-%m-%d")
+
+        self.users = {}
+        self.channels = {}
+        self.sessions = set()
+
+        # called with (user, command, params) for every command a connected
+        # client sends after registering
+        self.observers = []
+
+        self.received_lines = 0
+        self.sent_lines = 0
+
+        self._thread = None
+
+    def serve(self, port=0, address="127.0.0.1"):
+        """
+        Start listening, on the current loop. Returns the port listened on,
+        which is picked by the OS if it's 0.
+        """
+        sockets = bind_sockets(port, address)
+        self.add_sockets(sockets)
+        return sockets[0].getsockname()[1]
+
+    def serve_in_thread(self, port=0, address="127.0.0.1"):
+        """
+        Start listening, on a loop of its own in a background thread, so the
+        server doesn't take time from the bot's loop. Returns the port
+        listened on.
+        """
+        self.io_loop = IOLoop()
+        port = self.serve(port, address)
+
+        self._thread = threading.Thread(target=self.io_loop.start,
+                                        name="fakeserver", daemon=True)
+        self._thread.start()
+
+        return port
+
+    def call_on_loop(self, f, *args, **kwargs):
+        """
+        Call a function on the server's loop, from any thread.
+        """
+        self.io_loop.add_callback(f, *args, **kwargs)
+
+    def shutdown(self):
+        """
+        Disconnect everyone and stop listening. Safe to call from any thread.
+        """
+        done = threading.Event()
+
+        def _shutdown():
+            self.stop()
+
+            for session in list(self.sessions):
+                session.close()
+
+            if self._thread is not None:
+                self.io_loop.stop()
+
+            done.set()
+
+        self.call_on_loop(_shutdown)
+
+        if self._thread is not None and \
+           self._thread.ident != threading.get_ident():
+            done.wait()
+            self._thread.join()
+
+    def handle_stream(self, stream, address):
+        session = Session(self, stream, address)
+        self.sessions.add(session)
+
+        stream.set_close_callback(lambda: self._session_closed(session))
+        session.start()
+
+    def _session_closed(self, session):
+        self.sessions.discard(session)
+        session.closed()
+
+    def welcome(self, session):
+        session.reply("001", "Welcome to the {} IRC network {}".format(
+            self.network, session.user.mask))
+        session.reply("002", "Your host is {}".format(self.hostname))
+        session.reply("003", "This server was created {}".format(self.created))
+        session.reply("004", self.hostname, "kochira-fakeserver", "i",
+                      LIST_MODES + PARAMETER_MODES + SET_PARAMETER_MODES +
+                      FLAG_MODES + "".join(PREFIX_MODES))
+        session.reply("005",
+                      "NETWORK=" + self.network,
+                      "CASEMAPPING=rfc1459",
+                      "CHANTYPES=#",
+                      "CHANMODES={},{},{},{}".format(
+                          LIST_MODES, PARAMETER_MODES, SET_PARAMETER_MODES,
+                          FLAG_MODES),
+                      "PREFIX=({}){}".format("".join(PREFIX_MODES),
+                                             "".join(PREFIX_MODES.values())),
+                      "NICKLEN=30",
+                      "are supported by this server")
+        session.reply("422", "MOTD File is missing")
+
+    def _broadcast(self, user, line, channels, include_self=True):
+        # everyone sharing any of the channels, once each
+        keys = set()
+
+        for channel in channels:
+            keys.update(channel.members)
+
+        if not include_self:
+            keys.discard(user.key)
+        elif user.key not in keys:
+            user.send(line)
+
+        for key in keys:
+            self.users[key].send(line)
+
+    def add_user(self, user):
+        """
+        Add a user, connected or simulated.
+        """
+        self.users[user.key] = user
+        return user
+
+    def change_nickname(self, user, nickname):
+        line = format_line(user.mask, "NICK", nickname)
+        old_key = user.key
+
+        del self.users[old_key]
+        user.nickname = nickname
+        self.users[user.key] = user
+
+        for key in user.channels:
+            channel = self.channels[key]
+            channel.members = collections.OrderedDict(
+                (user.key if k == old_key else k, modes)
+                for k, modes in channel.members.items())
+
+        self._broadcast(user, line,
+                        [self.channels[key] for key in user.channels])
+
+    def quit(self, user, reason):
+        channels = [self.channels[key] for key in user.channels]
+
+        for channel in channels:
+            del channel.members[user.key]
+
+        self._broadcast(user, format_line(user.mask, "QUIT", reason),
+                        channels, include_self=False)
+
+        for channel in channels:
+            if not channel.members:
+                del self.channels[channel.key]
+
+        user.channels.clear()
+        self.users.pop(user.key, None)
+
+    def join(self, user, name):
+        """
+        Join a user to a channel, creating it, with them as operator, if it
+        doesn't exist.
+        """
+        channel = self.channels.get(normalize(name))
+
+        if channel is None:
+            channel = Channel(name)
+            self.channels[channel.key] = channel
+            modes = {"o"}
+        else:
+            modes = set()
+
+        if user.key in channel.members:
+            return channel
+
+        channel.members[user.key] = modes
+        user.channels.add(channel.key)
+
+        self._broadcast(user, format_line(user.mask, "JOIN", channel.name),
+                        [channel])
+
+        if user.session is not None:
+            if channel.topic is not None:
+                user.session.reply("332", channel.name, channel.topic)
+                user.session.reply("333", channel.name, channel.topic_by,
+                                   channel.topic_at)
+
+            self.send_names(user.session, channel.name)
+
+        return channel
+
+    def part(self, user, name, reason=""):
+        channel = self.channels[normalize(name)]
+
+        self._broadcast(user, format_line(user.mask, "PART", channel.name,
+                                          *([reason] if reason else [])),
+                        [channel])
+
+        del channel.members[user.key]
+        user.channels.discard(channel.key)
+
+        if not channel.members:
+            del self.channels[channel.key]
+
+    def message(self, user, command, target, text):
+        """
+        Send a PRIVMSG or NOTICE from a user to a channel or another user.
+        """
+        line = format_line(user.mask, command, target, text)
+
+        if target.startswith("#"):
+            self._broadcast(user, line, [self.channels[normalize(target)]],
+                            include_self=False)
+        else:
+            self.users[normalize(target)].send(line)
+
+    def set_topic(self, user, name, topic):
+        channel = self.channels[normalize(name)]
+        channel.topic = topic
+        channel.topic_by = user.mask
+        channel.topic_at = int(time.time())
+
+        self._broadcast(user, format_line(user.mask, "TOPIC", channel.name,
+                                          topic), [channel])
+
+    def set_modes(self, user, name, modes, args):
+        """
+        Change a channel's modes, as a user.
+        """
+        channel = self.channels[normalize(name)]
+        adding = True
+        applied = []
+        applied_args = []
+
+        for mode in modes:
+            if mode in "+-":
+                adding = mode == "+"
+                continue
+
+            arg = None
+
+            if mode in PREFIX_MODES or mode in LIST_MODES or \
+               mode in PARAMETER_MODES or (mode in SET_PARAMETER_MODES and
+                                           adding):
+                if not args:
+                    continue
+                arg = args.pop(0)
+
+            if mode in PREFIX_MODES:
+                key = normalize(arg)
+
+                if key not in channel.members:
+                    continue
+
+                if adding:
+                    channel.members[key].add(mode)
+                else:
+                    channel.members[key].discard(mode)
+            elif mode in LIST_MODES:
+                if adding and arg not in channel.bans:
+                    channel.bans.append(arg)
+                elif not adding and arg in channel.bans:
+                    channel.bans.remove(arg)
+            elif mode in PARAMETER_MODES + SET_PARAMETER_MODES + FLAG_MODES:
+                if adding:
+                    channel.modes[mode] = arg
+                else:
+                    channel.modes.pop(mode, None)
+            else:
+                if user.session is not None:
+                    user.session.reply("472", mode, "is unknown mode char to me")
+                continue
+
+            applied.append(("+" if adding else "-") + mode)
+
+            if arg is not None:
+                applied_args.append(arg)
+
+        if applied:
+            self._broadcast(user, format_line(user.mask, "MODE", channel.name,
+                                              "".join(applied),
+                                              *applied_args), [channel])
+
+    def send_names(self, session, name):
+        channel = self.channels.get(normalize(name))
+
+        if channel is not None:
+            multi_prefix = "multi-prefix" in session.capabilities
+            names = [channel.prefixes(self.users[key], multi_prefix) +
+                     self.users[key].nickname for key in channel.members]
+
+            # keep lines well under 512 bytes
+            for i in range(0, len(names), 20):
+                session.reply("353", "=", channel.name,
+                              " ".join(names[i:i + 20]))
+
+        session.reply("366", name, "End of /NAMES list")
+
+
+DEFAULT_MESSAGES = [
+    "hello everyone",
+    "has anyone seen the latest release?",
+    "brb",
+    "that's not how any of this works",
+    "lol",
+    "http://example.com/some/page is worth a read",
+    "I think the build is broken again",
+    "back",
+]
+
+
+class LoadGenerator:
+    """
+    Simulates busy channels on a fake server: ``channels`` channels of
+    ``users`` users each, saying ``rate`` messages a second between them.
+
+    While it runs, it pings every connected client once a ``ping_interval``
+    and measures how long they take to answer, which is how far behind the
+    traffic they are.
+
+    Everything it does happens on the server's loop.
+    """
+
+    def __init__(self, server, channels=10, users=10, rate=100.0,
+                 messages=None, ping_interval=1.0, seed=None):
+        self.server = server
+        self.rate = rate
+        self.messages = messages or DEFAULT_MESSAGES
+        self.ping_interval = ping_interval
+        self.random = random.Random(seed)
+
+        self.channel_names = ["#load{}".format(i) for i in range(channels)]
+        self.users = {name: [User("load{}u{}".format(i, j),
+                                  "load", "load.kochira.test",
+                                  "Simulated user")
+                             for j in range(users)]
+                      for i, name in enumerate(self.channel_names)}
+
+        self.sent = 0
+        self.replies = 0
+        self.lags = []
+        self.started = None
+        self.finished = None
+
+        self._pings = {}
+        self._ping_ids = 0
+        self._last_ping = None
+        self._duration = None
+        self._callback = None
+        self._clients = 1
+        self._timer = None
+
+        server.observers.append(self._observe)
+
+    def setup(self):
+        """
+        Add the simulated users, and join them to their channels.
+        """
+        for name, users in self.users.items():
+            for user in users:
+                self.server.add_user(user)
+                self.server.join(user, name)
+
+    def start(self, duration=None, callback=None, clients=1):
+        """
+        Start talking once ``clients`` connected clients have joined every
+        channel, and stop after ``duration`` seconds, if given, then call
+        ``callback``.
+        """
+        self._duration = duration
+        self._callback = callback
+        self._clients = clients
+
+        self._timer = PeriodicCallback(self._tick, 10,
+                                       io_loop=self.server.io_loop)
+        self._timer.start()
+
+    def stop(self):
+        if self._timer is not None:
+            self._timer.stop()
+            self._timer = None
+
+        if self.finished is None:
+            self.finished = time.monotonic()
+
+        callback, self._callback = self._callback, None
+
+        if callback is not None:
+            callback()
+
+    def _ready(self):
+        for name in self.channel_names:
+            channel = self.server.channels.get(normalize(name))
+
+            if channel is None or sum(
+                    1 for key in channel.members
+                    if not self.server.users[key].simulated) < self._clients:
+                return False
+
+        return True
+
+    def _tick(self):
+        now = time.monotonic()
+
+        if self.started is None:
+            if not self._ready():
+                return
+
+            logger.info("Clients have joined, generating load")
+            self.started = now
+
+        if self._duration is not None and now - self.started >= self._duration:
+            self.stop()
+            return
+
+        # catch up with the rate, however late this tick is
+        due = int((now - self.started) * self.rate) - self.sent
+
+        for _ in range(due):
+            name = self.random.choice(self.channel_names)
+            user = self.random.choice(self.users[name])
+
+            self.server.message(user, "PRIVMSG", name,
+                                self.random.choice(self.messages))
+            self.sent += 1
+
+        if self._last_ping is None or now - self._last_ping >= self.ping_interval:
+            self._ping(now)
+
+    def _ping(self, now):
+        self._last_ping = now
+
+        for user in list(self.server.users.values()):
+            if user.simulated:
+                continue
+
+            self._ping_ids += 1
+            token = "load-{}".format(self._ping_ids)
+            self._pings[token] = now
+            user.send(format_line(None, "PING", token))
+
+    def _observe(self, user, command, params):
+        if command == "PONG":
+            sent_at = self._pings.pop(params[-1] if params else None, None)
+
+            if sent_at is not None:
+                self.lags.append(time.monotonic() - sent_at)
+        elif command in ("PRIVMSG", "NOTICE"):
+            self.replies += 1
+
+    def report(self):
+        """
+        Describe how the load test went, one line at a time.
+        """
+        if self.started is None:
+            return ["No clients joined every channel; no load was generated."]
+
+        elapsed = max((self.finished or time.monotonic()) - self.started,
+                      1e-9)
+        lags = sorted(self.lags)
+
+        return [
+            "Sent {} messages to {} channels of {} users in {:.2f}s ({:.0f}/s, target {:.0f}/s)".format(
+                self.sent, len(self.channel_names),
+                len(next(iter(self.users.values()), [])), elapsed,
+                self.sent / elapsed, self.rate),
+            "Clients sent {} messages back".format(self.replies),
+            "Lag: p50 {:.2f}ms, p90 {:.2f}ms, p99 {:.2f}ms, max {:.2f}ms over {} pings".format(
+                *[percentile(lags, p) * 1000 for p in (50, 90, 99, 100)] +
+                [len(lags)]),
+            "Unanswered pings: {}".format(len(self._pings))
+        ]
@@ -0,0 +1,85 @@
+import json
+import logging
+import os
+import socket
+import tempfile
+
+logger = logging.getLogger(__name__)
+
+# where the new process finds the state the old one left it
+ENV_VAR = "KOCHIRA_HANDOFF"
+
+
+def _make_inheritable(fd):
+    # file descriptors aren't inherited across exec by default since 3.4
+    if hasattr(os, "set_inheritable"):
+        os.set_inheritable(fd, True)
+
+
+def socket_state(sock):
+    """
+    Prepare a socket to be inherited by the next process, returning what it
+    needs to pick it up again.
+    """
+    fd = sock.fileno()
+    _make_inheritable(fd)
+
+    return {
+        "fd": fd,
+        "family": int(sock.family),
+        "type": int(sock.type)
+    }
+
+
+def socket_from_state(state):
+    """
+    Pick up a socket inherited from the previous process.
+    """
+    sock = socket.fromfd(state["fd"], state["family"], state["type"])
+
+    # fromfd duplicates the file descriptor, so close the original
+    os.close(state["fd"])
+    sock.setblocking(False)
+
+    return sock
+
+
+def save(state):
+    """
+    Save the state for the next process, which finds it through the
+    environment it inherits.
+    """
+    fd, path = tempfile.mkstemp(prefix="kochira-handoff-", suffix=".json")
+
+    with os.fdopen(fd, "w") as f:
+        json.dump(state, f)
+
+    os.environ[ENV_VAR] = path
+    return path
+
+
+def load():
+    """
+    Load the state left by the previous process, if it handed off to us.
+    """
+    path = os.environ.pop(ENV_VAR, None)
+
+    if path is None:
+        return None
+
+    try:
+        with open(path, "r") as f:
+            state = json.load(f)
+    except (IOError, ValueError):
+        logger.exception("Couldn't load handoff state from %s", path)
+        return None
+    finally:
+        try:
+            os.unlink(path)
+        except OSError:
+            pass
+
+    logger.info("Resuming from handoff: %d client(s), %d socket group(s)",
+                len(state.get("clients", {})), len(state.get("sockets", {})))
+
+    return state
@@ -0,0 +1,106 @@
+import json
+from urllib.parse import urlencode
+
+from pydle.async import coroutine
+
+from tornado.httpclient import AsyncHTTPClient, HTTPRequest, HTTPError
+
+
+class Response:
+    """
+    A response from the asynchronous HTTP client, with an interface similar
+    to that of ``requests.Response``.
+    """
+
+    def __init__(self, response):
+        self._response = response
+
+    @property
+    def url(self):
+        return self._response.effective_url
+
+    @property
+    def status_code(self):
+        return self._response.code
+
+    @property
+    def headers(self):
+        return self._response.headers
+
+    @property
+    def content(self):
+        return self._response.body or b""
+
+    @property
+    def text(self):
+        return self.content.decode("utf-8", "replace")
+
+    def json(self):
+        return json.loads(self.text)
+
+    def raise_for_status(self):
+        if self._response.error is not None:
+            raise self._response.error
+
+    def __repr__(self):
+        return "<{__name__} [{code}]>".format(
+            __name__=self.__class__.__name__,
+            code=self.status_code
+        )
+
+
+def configure(max_clients):
+    """
+    Configure the asynchronous HTTP client.
+    """
+    AsyncHTTPClient.configure(None, max_clients=max_clients)
+
+
+@coroutine
+def request(method, url, params=None, data=None, headers=None, **kwargs):
+    """
+    Perform an HTTP request on the event loop.
+
+    This must be called from the event loop thread, i.e. not from a
+    ``@background`` function. Non-2xx responses are returned rather than
+    raised, as with ``requests``; use ``raise_for_status`` to raise them.
+    """
+
+    if params:
+        url += ("&" if "?" in url else "?") + urlencode(params)
+
+    if isinstance(data, dict):
+        data = urlencode(data)
+
+        headers = dict(headers or {})
+        headers.setdefault("Content-Type", "application/x-www-form-urlencoded")
+
+    if data is None and method in ("POST", "PUT", "PATCH"):
+        data = ""
+
+    req = HTTPRequest(url, method=method, headers=headers, body=data,
+                      **kwargs)
+
+    try:
+        resp = yield AsyncHTTPClient().fetch(req)
+    except HTTPError as e:
+        # connection errors and timeouts don't have a response to return
+        if e.response is None:
+            raise
+        resp = e.response
+
+    return Response(resp)
+
+
+def get(url, **kwargs):
+    """
+    Perform an HTTP GET request on the event loop.
+    """
+    return request("GET", url, **kwargs)
+
+
+def post(url, **kwargs):
+    """
+    Perform an HTTP POST request on the event loop.
+    """
+    return request("POST", url, **kwargs)
@@ -0,0 +1,264 @@
+import binascii
+import itertools
+import logging
+import os
+import threading
+from concurrent.futures import Future
+from multiprocessing.connection import Client as _connect, Listener
+
+from .storage import AtomicMapping
+
+logger = logging.getLogger(__name__)
+
+# how workers learn the key to talk to the supervisor with
+AUTHKEY_ENV_VAR = "KOCHIRA_IPC_KEY"
+
+
+class IPCError(Exception):
+    """
+    A call to the supervisor failed, or couldn't be made.
+    """
+
+
+def make_authkey():
+    """
+    Make a new key for workers to authenticate with, and put it in the
+    environment for them to inherit.
+    """
+    authkey = os.urandom(32)
+    os.environ[AUTHKEY_ENV_VAR] = binascii.hexlify(authkey).decode("ascii")
+    return authkey
+
+
+def inherited_authkey():
+    """
+    Get the key the supervisor left in the environment.
+    """
+    try:
+        return binascii.unhexlify(os.environ[AUTHKEY_ENV_VAR])
+    except KeyError:
+        raise IPCError("not started by a supervisor")
+
+
+class Hub:
+    """
+    The supervisor's end of the channel to its workers.
+
+    Workers call functions registered with ``register``, and publish events
+    to each other through it. A key-value store is built in, for state which
+    has to be shared between networks in different workers.
+    """
+
+    def __init__(self, address, authkey):
+        self.address = address
+
+        # a socket left over from a supervisor that didn't exit cleanly
+        if os.path.exists(address):
+            os.unlink(address)
+
+        self.listener = Listener(address, "AF_UNIX", authkey=authkey)
+        self.handlers = {}
+
+        self._connections = {}
+        self._lock = threading.Lock()
+
+        self.store = AtomicMapping()
+
+        for operation in AtomicMapping.OPERATIONS:
+            self.register("kv." + operation, getattr(self.store, operation))
+
+    def register(self, name, f):
+        """
+        Register a function for workers to call.
+        """
+        self.handlers[name] = f
+
+    def serve_forever(self):
+        """
+        Accept connections from workers until the hub is closed.
+        """
+        while True:
+            try:
+                connection = self.listener.accept()
+            except OSError:
+                # the listener was closed
+                return
+            except Exception:
+                logger.exception("Couldn't accept a worker's connection")
+                continue
+
+            threading.Thread(target=self._serve, args=(connection,),
+                             name="ipc-hub", daemon=True).start()
+
+    def _send(self, connection, message):
+        with self._lock:
+            lock = self._connections.get(connection)
+
+        if lock is None:
+            return
+
+        try:
+            with lock:
+                connection.send(message)
+        except (OSError, EOFError):
+            pass
+
+    def _serve(self, connection):
+        with self._lock:
+            self._connections[connection] = threading.Lock()
+
+        try:
+            while True:
+                try:
+                    message = connection.recv()
+                except (OSError, EOFError):
+                    break
+
+                kind = message[0]
+
+                if kind == "call":
+                    _, call_id, name, args = message
+
+                    try:
+                        result = ("result", call_id, True,
+                                  self.handlers[name](*args))
+                    except Exception as e:
+                        logger.exception("IPC call to %s failed", name)
+                        result = ("result", call_id, False,
+                                  "{}: {}".format(e.__class__.__name__, e))
+
+                    self._send(connection, result)
+                elif kind == "publish":
+                    _, topic, payload = message
+
+                    with self._lock:
+                        others = [other for other in self._connections
+                                  if other is not connection]
+
+                    for other in others:
+                        self._send(other, ("event", topic, payload))
+        finally:
+            with self._lock:
+                del self._connections[connection]
+
+            connection.close()
+
+    def close(self):
+        self.listener.close()
+
+        try:
+            os.unlink(self.address)
+        except OSError:
+            pass
+
+
+class Channel:
+    """
+    A worker's end of the channel to the supervisor.
+
+    ``call`` returns futures which are resolved on the thread receiving from
+    the supervisor, so they can be waited on with ``result()`` but not
+    yielded from coroutines, which would then carry on on that thread.
+    Coroutines use ``call_async``, whose futures are resolved on the event
+    loop. Events published by other workers are passed to the ``ipc_event``
+    hooks.
+    """
+
+    def __init__(self, bot, address, authkey):
+        self.bot = bot
+        self.connection = _connect(address, "AF_UNIX", authkey=authkey)
+
+        self._calls = {}
+        self._ids = itertools.count()
+        self._lock = threading.Lock()
+
+        self._thread = threading.Thread(target=self._receive, name="ipc",
+                                        daemon=True)
+        self._thread.start()
+
+    def call(self, name, *args):
+        """
+        Call a function in the supervisor, returning a future for its result.
+        """
+        future = Future()
+
+        with self._lock:
+            call_id = next(self._ids)
+            self._calls[call_id] = future
+
+            try:
+                self.connection.send(("call", call_id, name, args))
+            except (OSError, EOFError) as e:
+                del self._calls[call_id]
+                future.set_exception(IPCError(str(e)))
+
+        return future
+
+    def call_async(self, name, *args):
+        """
+        Call a function in the supervisor, returning a future for its result
+        which is resolved on the event loop, for yielding from coroutines.
+        """
+        future = Future()
+
+        def _resolve(inner):
+            exc = inner.exception()
+
+            if exc is not None:
+                future.set_exception(exc)
+            else:
+                future.set_result(inner.result())
+
+        self.call(name, *args).add_done_callback(
+            lambda inner: self.bot.call_on_loop(_resolve, inner))
+
+        return future
+
+    def publish(self, topic, payload=None):
+        """
+        Send an event to every other worker.
+        """
+        with self._lock:
+            try:
+                self.connection.send(("publish", topic, payload))
+            except (OSError, EOFError) as e:
+                raise IPCError(str(e))
+
+    def _receive(self):
+        while True:
+            try:
+                message = self.connection.recv()
+            except (OSError, EOFError):
+                if not self.bot.stopping:
+                    logger.error("Lost the connection to the supervisor")
+                break
+
+            kind = message[0]
+
+            if kind == "result":
+                _, call_id, ok, value = message
+
+                with self._lock:
+                    future = self._calls.pop(call_id, None)
+
+                if future is None:
+                    continue
+
+                if ok:
+                    future.set_result(value)
+                else:
+                    future.set_exception(IPCError(value))
+            elif kind == "event":
+                _, topic, payload = message
+                self.bot.call_on_loop(self.bot.run_hooks, "ipc_event", topic,
+                                      payload)
+
+        with self._lock:
+            calls = list(self._calls.values())
+            self._calls.clear()
+
+        for future in calls:
+            future.set_exception(IPCError("lost the connection to the supervisor"))
+
+    def close(self):
+        self.connection.close()
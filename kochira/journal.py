@@ -0,0 +1,177 @@
+import collections
+import gzip
+import json
+import logging
+import os
+import struct
+import time
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"KOCHIRA-JOURNAL 1\n"
+
+# a client seen for the first time: its index, then its details as JSON
+_CLIENT = 0
+# data received: when, from which client, then the data itself
+_DATA = 1
+
+_KIND = struct.Struct("<B")
+_CLIENT_HEADER = struct.Struct("<HI")
+_DATA_HEADER = struct.Struct("<dHI")
+
+Event = collections.namedtuple("Event", ["ts", "client", "data"])
+
+
+def _open(path, mode):
+    # compress journals named as such
+    if path.endswith(".gz"):
+        return gzip.open(path, mode)
+
+    return open(path, mode)
+
+
+def _split_ext(path):
+    # keep .gz at the end, so renamed journals are still compressed
+    if path.endswith(".gz"):
+        return path[:-3], ".gz"
+
+    return path, ""
+
+
+def _rotate(path):
+    """
+    Move an existing journal out of the way, to a name with when it was last
+    written to, so that starting again doesn't overwrite it.
+    """
+    if not os.path.exists(path) or os.path.getsize(path) == 0:
+        return None
+
+    root, ext = _split_ext(path)
+    stamp = time.strftime("%Y%m%d-%H%M%S",
+                          time.localtime(os.path.getmtime(path)))
+
+    rotated = "{}.{}{}".format(root, stamp, ext)
+    n = 1
+
+    while os.path.exists(rotated):
+        rotated = "{}.{}-{}{}".format(root, stamp, n, ext)
+        n += 1
+
+    os.rename(path, rotated)
+    return rotated
+
+
+class JournalWriter:
+    """
+    Records the data each client receives, with when it was received, so that
+    it can be replayed later.
+
+    Records are written as they come in, each with a small binary header, and
+    the file is flushed at most once every ``flush_interval`` seconds. A
+    journal already at the path, e.g. from before a restart, is kept under a
+    name with when it was last written to.
+    """
+
+    def __init__(self, path, flush_interval=1.0):
+        self.path = path
+        self.flush_interval = flush_interval
+
+        rotated = _rotate(path)
+
+        if rotated is not None:
+            logger.info("Moved the previous journal to %s", rotated)
+
+        self._file = _open(path, "wb")
+        self._file.write(MAGIC)
+
+        self._clients = {}
+        self._last_flush = time.monotonic()
+
+        logger.info("Recording incoming traffic to %s", path)
+
+    def _client_index(self, client):
+        index = self._clients.get(client.name)
+
+        if index is None:
+            index = len(self._clients)
+            self._clients[client.name] = index
+
+            details = json.dumps({
+                "name": client.name,
+                "nickname": client.nickname,
+                "hostname": client.config.hostname
+            }).encode("utf-8")
+
+            self._file.write(_KIND.pack(_CLIENT) +
+                             _CLIENT_HEADER.pack(index, len(details)) +
+                             details)
+
+        return index
+
+    def record(self, client, data):
+        """
+        Record data received by a client.
+        """
+        index = self._client_index(client)
+
+        self._file.write(_KIND.pack(_DATA) +
+                         _DATA_HEADER.pack(time.time(), index, len(data)) +
+                         data)
+
+        now = time.monotonic()
+
+        if now - self._last_flush >= self.flush_interval:
+            self._file.flush()
+            self._last_flush = now
+
+    def close(self):
+        self._file.close()
+
+
+def _read_exactly(f, n):
+    data = f.read(n)
+
+    if len(data) < n:
+        raise EOFError
+
+    return data
+
+
+def read_journal(path):
+    """
+    Read a journal, yielding ``(clients, event)`` for each event recorded,
+    where ``clients`` maps the names of the clients seen so far to their
+    details.
+
+    A journal cut short, e.g. because the bot was killed while recording, is
+    read up to the last complete event.
+    """
+    clients = {}
+    names = {}
+
+    with _open(path, "rb") as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError("{} is not a journal".format(path))
+
+        while True:
+            try:
+                kind, = _KIND.unpack(_read_exactly(f, _KIND.size))
+
+                if kind == _CLIENT:
+                    index, length = _CLIENT_HEADER.unpack(
+                        _read_exactly(f, _CLIENT_HEADER.size))
+                    details = json.loads(
+                        _read_exactly(f, length).decode("utf-8"))
+
+                    names[index] = details["name"]
+                    clients[details["name"]] = details
+                elif kind == _DATA:
+                    ts, index, length = _DATA_HEADER.unpack(
+                        _read_exactly(f, _DATA_HEADER.size))
+
+                    yield clients, Event(ts, names[index],
+                                         _read_exactly(f, length))
+                else:
+                    raise ValueError("unknown record in journal: {}".format(kind))
+            except EOFError:
+                return
@@ -0,0 +1,275 @@
+import bisect
+import collections
+import functools
+import threading
+
+
+class Counter:
+    """
+    A value that only goes up.
+
+    Values are updated from executor threads as well as the event loop, so
+    every update takes the metric's lock.
+    """
+
+    def __init__(self):
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+
+class Gauge:
+    """
+    A value that can go up and down, or be computed when it is read.
+    """
+
+    def __init__(self):
+        self._value = 0
+        self._function = None
+        self._lock = threading.Lock()
+
+    def set(self, value):
+        with self._lock:
+            self._value = value
+
+    def inc(self, amount=1):
+        with self._lock:
+            self._value += amount
+
+    def dec(self, amount=1):
+        with self._lock:
+            self._value -= amount
+
+    def set_function(self, function):
+        """
+        Compute the value with a function when it's read. The function is
+        kept until the value is removed from its metric, so remove it once
+        whatever the function reads is gone.
+        """
+        self._function = function
+
+    @property
+    def value(self):
+        if self._function is not None:
+            return self._function()
+        return self._value
+
+
+class Histogram:
+    """
+    A histogram with fixed bucket boundaries.
+
+    Observing a value is a bisection and a couple of additions under a lock,
+    so this is cheap enough to use on every event.
+    """
+
+    # seconds, from 100 µs up to 10 s
+    DEFAULT_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01,
+                       0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0
+        self.max = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        i = bisect.bisect_left(self.buckets, value)
+
+        with self._lock:
+            self.counts[i] += 1
+            self.count += 1
+            self.sum += value
+
+            if value > self.max:
+                self.max = value
+
+    def snapshot(self):
+        """
+        Get the bucket counts, count and sum as of one moment.
+        """
+        with self._lock:
+            return list(self.counts), self.count, self.sum
+
+    @property
+    def mean(self):
+        if not self.count:
+            return 0
+        return self.sum / self.count
+
+    def percentile(self, q):
+        """
+        Estimate a percentile (between 0 and 1) as the upper bound of the
+        bucket it falls in.
+        """
+        counts, total, _ = self.snapshot()
+
+        if not total:
+            return 0
+
+        rank = q * total
+        seen = 0
+
+        for bound, count in zip(self.buckets, counts):
+            seen += count
+            if seen >= rank:
+                return min(bound, self.max)
+
+        return self.max
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+
+    return "{" + ",".join(
+        '{}="{}"'.format(k, str(v).replace("\\", "\\\\")
+                                  .replace("\n", "\\n")
+                                  .replace('"', '\\"'))
+        for k, v in labels
+    ) + "}"
+
+
+class Metric:
+    """
+    A named family of values, one per combination of label values.
+    """
+
+    def __init__(self, type, name, doc, labels, factory):
+        self.type = type
+        self.name = name
+        self.doc = doc
+        self.label_names = tuple(labels)
+        self.factory = factory
+        self._children = {}
+        self._lock = threading.Lock()
+
+    def labels(self, *values):
+        """
+        Get the value for the given label values, creating it if needed.
+        """
+        child = self._children.get(values)
+
+        if child is None:
+            if len(values) != len(self.label_names):
+                raise ValueError("expected labels {}, got {!r}".format(
+                    self.label_names, values))
+
+            with self._lock:
+                child = self._children.setdefault(values, self.factory())
+
+        return child
+
+    def remove(self, *values):
+        """
+        Forget the value for the given label values, e.g. for a client which
+        is gone.
+        """
+        with self._lock:
+            self._children.pop(values, None)
+
+    def children(self):
+        return list(self._children.items())
+
+    def _samples(self):
+        for values, child in sorted(self.children(), key=lambda x: x[0]):
+            labels = list(zip(self.label_names, values))
+
+            if self.type == "histogram":
+                counts, count, sum_ = child.snapshot()
+                cumulative = 0
+
+                for bound, bucket_count in zip(child.buckets + (float("inf"),),
+                                               counts):
+                    cumulative += bucket_count
+                    yield "_bucket", labels + [("le", _format_value(bound))], cumulative
+
+                yield "_sum", labels, sum_
+                yield "_count", labels, count
+            else:
+                yield "", labels, child.value
+
+    def expose(self):
+        lines = [
+            "# HELP {} {}".format(self.name, self.doc.replace("\\", "\\\\")
+                                                     .replace("\n", "\\n")),
+            "# TYPE {} {}".format(self.name, self.type)
+        ]
+
+        for suffix, labels, value in self._samples():
+            lines.append("{}{}{} {}".format(self.name, suffix,
+                                            _format_labels(labels),
+                                            _format_value(value)))
+
+        return "\n".join(lines)
+
+
+class Registry:
+    """
+    A collection of metrics, which can be exposed in the Prometheus text
+    format.
+
+    Metrics are created on first use and shared thereafter, so services can
+    safely look them up again when they are reloaded.
+    """
+
+    def __init__(self):
+        self.metrics = collections.OrderedDict()
+        self.collectors = []
+        self._lock = threading.Lock()
+
+    def _get_or_create(self, type, name, doc, labels, factory):
+        with self._lock:
+            metric = self.metrics.get(name)
+
+            if metric is None:
+                metric = Metric(type, name, doc, labels, factory)
+                self.metrics[name] = metric
+            elif metric.type != type or metric.label_names != tuple(labels):
+                raise ValueError("{} is already registered differently".format(name))
+
+        return metric
+
+    def counter(self, name, doc, labels=()):
+        return self._get_or_create("counter", name, doc, labels, Counter)
+
+    def gauge(self, name, doc, labels=()):
+        return self._get_or_create("gauge", name, doc, labels, Gauge)
+
+    def histogram(self, name, doc, labels=(), buckets=Histogram.DEFAULT_BUCKETS):
+        return self._get_or_create("histogram", name, doc, labels,
+                                   functools.partial(Histogram, buckets))
+
+    def add_collector(self, collector):
+        """
+        Register a function that returns extra metrics at exposition time,
+        for values which are cheaper to gather when asked for.
+        """
+        self.collectors.append(collector)
+        return collector
+
+    def remove_collector(self, collector):
+        if collector in self.collectors:
+            self.collectors.remove(collector)
+
+    def expose(self):
+        metrics = list(self.metrics.values())
+
+        for collector in list(self.collectors):
+            metrics.extend(collector())
+
+        return "\n".join(metric.expose() for metric in metrics) + "\n"
+
+
+registry = Registry()
@@ -0,0 +1,190 @@
+import collections
+import logging
+import time
+from datetime import timedelta
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+QUEUED = metrics.registry.gauge(
+    "kochira_outbox_queued_lines",
+    "Lines waiting to be sent because of flood control.", ["client"])
+DELAY = metrics.registry.histogram(
+    "kochira_outbox_delay_seconds",
+    "How long lines waited in the outbox before being sent.", ["client"])
+COALESCED = metrics.registry.counter(
+    "kochira_outbox_coalesced_total",
+    "Lines joined onto another line to the same target.", ["client"])
+
+
+class Outbox:
+    """
+    Outbound messages for a client, sent at a rate the server won't kill us
+    for.
+
+    Sending is limited by a token bucket, which holds up to ``burst`` lines
+    and refills at ``rate`` lines per second. Replies are sent before
+    anything else queued, and within a priority, targets take turns so one
+    busy channel can't hold up the rest. When more lines are queued than can
+    be sent right away, consecutive lines to the same channel are joined into
+    one, as long as they fit.
+    """
+
+    REPLY = 0
+    NORMAL = 1
+
+    SEPARATOR = " | "
+
+    def __init__(self, client):
+        self.client = client
+
+        self._queues = (collections.OrderedDict(), collections.OrderedDict())
+        self._size = 0
+        self._tokens = None
+        self._last_refill = time.monotonic()
+        self._timeout = None
+
+        self.delay = DELAY.labels(client.name)
+        self.coalesced = COALESCED.labels(client.name)
+        QUEUED.labels(client.name).set_function(lambda: len(self))
+
+    def __len__(self):
+        return self._size
+
+    @property
+    def settings(self):
+        return self.client.config.flood
+
+    def put(self, command, target, message, priority=NORMAL):
+        """
+        Queue a message to be sent. Must be called on the event loop.
+        """
+        queue = self._queues[priority].setdefault(target, collections.deque())
+        queue.append((command, message, time.monotonic()))
+        self._size += 1
+
+        self._flush()
+
+    def drain(self):
+        """
+        Remove and return everything queued, as ``(priority, command, target,
+        message)`` lists, e.g. to hand over to another process.
+        """
+        lines = [[priority, command, target, message]
+                 for priority, queues in enumerate(self._queues)
+                 for target, queue in queues.items()
+                 for command, message, _ in queue]
+        self.clear()
+        return lines
+
+    def clear(self):
+        """
+        Drop everything queued, e.g. on disconnect.
+        """
+        for queues in self._queues:
+            queues.clear()
+
+        self._size = 0
+
+        if self._timeout is not None:
+            self.client.bot.event_loop.unschedule(self._timeout)
+            self._timeout = None
+
+    def close(self):
+        """
+        Stop reporting metrics for the client, once it's gone. Anything still
+        queued is sent.
+        """
+        QUEUED.remove(self.client.name)
+
+    def _refill(self):
+        settings = self.settings
+        now = time.monotonic()
+
+        if self._tokens is None:
+            self._tokens = settings.burst
+        else:
+            self._tokens = min(settings.burst,
+                               self._tokens + (now - self._last_refill) * settings.rate)
+
+        self._last_refill = now
+
+    def _can_coalesce(self, command, message, next_command, next_message,
+                      max_length):
+        if command != next_command:
+            return False
+
+        # don't mangle CTCPs or lines that will be split anyway
+        for m in (message, next_message):
+            if "\x01" in m or "\n" in m:
+                return False
+
+        return len((message + self.SEPARATOR + next_message).encode("utf-8")) \
+            <= max_length
+
+    def _pop(self, coalesce):
+        for queues in self._queues:
+            if not queues:
+                continue
+
+            target, queue = queues.popitem(last=False)
+            command, message, queued = queue.popleft()
+            self._size -= 1
+
+            # only channels, since services like ChanServ take one command
+            # per line
+            if coalesce and queue and self.client.is_channel(target):
+                max_length = self.client._max_message_length(command, target)
+
+                while queue and self._can_coalesce(command, message,
+                                                   queue[0][0], queue[0][1],
+                                                   max_length):
+                    _, next_message, _ = queue.popleft()
+                    message += self.SEPARATOR + next_message
+                    self._size -= 1
+                    self.coalesced.inc()
+
+            # put the target at the back, so the others get a turn
+            if queue:
+                queues[target] = queue
+
+            return command, target, message, queued
+
+        return None
+
+    def _flush(self):
+        # if we're waiting on a token, there aren't any to send with
+        if self._timeout is not None:
+            return
+
+        settings = self.settings
+        limited = settings.rate > 0
+
+        if limited:
+            self._refill()
+
+        while self._size and (not limited or self._tokens >= 1):
+            coalesce = settings.coalesce and limited and \
+                self._size > self._tokens
+
+            command, target, message, queued = self._pop(coalesce)
+
+            if limited:
+                self._tokens -= 1
+
+            self.delay.observe(time.monotonic() - queued)
+
+            try:
+                self.client._deliver(command, target, message)
+            except Exception:
+                logger.exception("Couldn't send message to %s", target)
+
+        if self._size:
+            self._timeout = self.client.bot.event_loop.schedule_in(
+                timedelta(seconds=(1 - self._tokens) / settings.rate),
+                self._on_timeout)
+
+    def _on_timeout(self):
+        self._timeout = None
+        self._flush()
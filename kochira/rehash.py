@@ -0,0 +1,158 @@
+import collections
+
+# changing any of these means reconnecting to the network
+CONNECTION_FIELDS = frozenset([
+    "nickname", "username", "realname", "hostname", "port", "password",
+    "source_address", "tls", "sasl", "shard"
+])
+
+# the core settings which are read as they're needed, rather than once at
+# startup
+LIVE_CORE_FIELDS = frozenset([
+    "max_backlog", "max_private_backlogs", "private_backlog_ttl",
+    "backlog_timestamps", "version", "locale", "locale_path"
+])
+
+
+def _diff_keys(old, new):
+    old_keys = set(old)
+    new_keys = set(new)
+
+    return (new_keys - old_keys, old_keys - new_keys,
+            set(k for k in old_keys & new_keys if old[k] != new[k]))
+
+
+class ConfigDiff:
+    """
+    The differences between two configurations, as the changes the bot
+    needs to make to go from one to the other.
+    """
+
+    def __init__(self):
+        self.clients_added = set([])
+        self.clients_removed = set([])
+        self.clients_reconnected = set([])
+        self.channels_added = collections.defaultdict(set)
+        self.channels_removed = collections.defaultdict(set)
+        self.channels_changed = collections.defaultdict(set)
+        self.services_added = set([])
+        self.services_removed = set([])
+        self.services_changed = set([])
+        # (service, network, channel) whose per-network or, if channel isn't
+        # None, per-channel settings changed
+        self.services_reconfigured = set([])
+        self.core_changed = set([])
+
+    def __bool__(self):
+        return any([self.clients_added, self.clients_removed,
+                    self.clients_reconnected, self.channels_added,
+                    self.channels_removed, self.channels_changed,
+                    self.services_added, self.services_removed,
+                    self.services_changed, self.services_reconfigured,
+                    self.core_changed])
+
+    @property
+    def restart_required(self):
+        """
+        Core settings that changed but only take effect after a restart.
+        """
+        return self.core_changed - LIVE_CORE_FIELDS
+
+    def summary(self):
+        """
+        Describe the changes, one per line.
+        """
+        lines = []
+
+        def _add(what, names):
+            if names:
+                lines.append("{}: {}".format(what, ", ".join(sorted(names))))
+
+        _add("Connecting", self.clients_added)
+        _add("Disconnecting", self.clients_removed)
+        _add("Reconnecting", self.clients_reconnected)
+
+        for client, channels in sorted(self.channels_added.items()):
+            _add("Joining on " + client, channels)
+
+        for client, channels in sorted(self.channels_removed.items()):
+            _add("Parting on " + client, channels)
+
+        for client, channels in sorted(self.channels_changed.items()):
+            _add("Updating on " + client, channels)
+
+        _add("Loading", self.services_added)
+        _add("Unloading", self.services_removed)
+        _add("Reloading", self.services_changed)
+        _add("Reconfiguring", set(
+            "{} on {}".format(service, client if channel is None
+                              else client + "/" + channel)
+            for service, client, channel in self.services_reconfigured))
+        _add("Needs a restart", set("core." + k for k in self.restart_required))
+
+        return lines
+
+
+def _service_configs(config):
+    # a missing services section is just an empty dict
+    services = config.get("services", {})
+    return getattr(services, "configs", services)
+
+
+def _changed_services(old, new):
+    added, removed, changed = _diff_keys(_service_configs(old),
+                                         _service_configs(new))
+    return added | removed | changed
+
+
+def diff_config(old, new):
+    """
+    Work out what has to change to go from the old configuration to the new
+    one.
+    """
+    diff = ConfigDiff()
+
+    diff.clients_added, diff.clients_removed, changed = \
+        _diff_keys(old.clients, new.clients)
+
+    for name in changed:
+        old_client = old.clients[name]
+        new_client = new.clients[name]
+
+        diff.services_reconfigured.update(
+            (service, name, None)
+            for service in _changed_services(old_client, new_client))
+
+        old_channels = old_client.get("channels", {})
+        new_channels = new_client.get("channels", {})
+
+        added, removed, channels_changed = _diff_keys(old_channels,
+                                                      new_channels)
+
+        for channel in channels_changed:
+            diff.services_reconfigured.update(
+                (service, name, channel)
+                for service in _changed_services(old_channels[channel],
+                                                 new_channels[channel]))
+
+        if any(old_client.get(field) != new_client.get(field)
+               for field in CONNECTION_FIELDS):
+            diff.clients_reconnected.add(name)
+            continue
+
+        if added:
+            diff.channels_added[name] = added
+
+        if removed:
+            diff.channels_removed[name] = removed
+
+        if channels_changed:
+            diff.channels_changed[name] = channels_changed
+
+    # compare what was written in the file, rather than the parsed configs
+    diff.services_added, diff.services_removed, diff.services_changed = \
+        _diff_keys(_service_configs(old), _service_configs(new))
+
+    _, _, diff.core_changed = _diff_keys(old.core, new.core)
+
+    return diff
@@ -0,0 +1,269 @@
+import collections
+import logging
+import os
+import shutil
+import tempfile
+import time
+from datetime import timedelta
+
+from .bot import Bot
+from .client import Client
+from .journal import read_journal
+from .util import percentile
+
+logger = logging.getLogger(__name__)
+
+
+class ReplayConnection:
+    """
+    Stands in for the connection to the IRC server. What the bot sends is
+    counted, then dropped.
+    """
+
+    tls = False
+
+    def __init__(self, hostname, port):
+        self.hostname = hostname
+        self.port = port
+        self.connected = True
+
+        self.sent_bytes = 0
+        self.sent_lines = 0
+
+    def send(self, data):
+        self.sent_bytes += len(data)
+        self.sent_lines += data.count(b"\n")
+
+    def on(self, *args):
+        pass
+
+    off = on
+
+    def setup_handlers(self):
+        pass
+
+    remove_handlers = setup_handlers
+
+    def disconnect(self):
+        self.connected = False
+
+
+class ReplayClient(Client):
+    """
+    A client fed from a journal rather than a server.
+    """
+
+    @classmethod
+    def for_replay(cls, bot, name, config, details, replay):
+        client = cls._create(bot, name, config)
+        client.replay = replay
+        client.eventloop = bot.event_loop
+        client.connection = ReplayConnection(details["hostname"], config.port)
+        client.nickname = details["nickname"]
+        return client
+
+    def _run_hooks(self, name, target, origin, args=None, kwargs=None):
+        fed_at = self.replay.hook_started()
+        fut = super()._run_hooks(name, target, origin, args, kwargs)
+        fut.add_done_callback(lambda _: self.replay.hook_done(name, fed_at))
+        return fut
+
+
+class Replay:
+    """
+    Feeds the events in a journal to the bot's clients, at the speed they
+    were recorded, some multiple of it, or as fast as the bot keeps up, and
+    measures how long hooks take to finish after the data that triggered
+    them is received.
+    """
+
+    def __init__(self, bot, path, speed=1.0, drain_timeout=10.0):
+        self.bot = bot
+        self.path = path
+        self.speed = speed
+        self.drain_timeout = drain_timeout
+
+        self._events = read_journal(path)
+
+        self.events = 0
+        self.lines = 0
+        self.bytes = 0
+        self.skipped = collections.Counter()
+        self.latencies = collections.defaultdict(list)
+
+        self.outstanding = 0
+        self.fed_at = None
+        self.started = None
+        self.finished = None
+        self.feeding_done = False
+
+        self._first_ts = None
+
+    def start(self):
+        self.started = time.monotonic()
+        self._next()
+
+    def _client_for(self, clients, name):
+        client = self.bot.clients.get(name)
+
+        if client is None:
+            if name not in self.bot.config.clients:
+                return None
+
+            client = ReplayClient.for_replay(self.bot, name,
+                                             self.bot.config.clients[name],
+                                             clients[name], self)
+            self.bot.clients[name] = client
+
+        return client
+
+    def _next(self):
+        try:
+            clients, event = next(self._events)
+        except StopIteration:
+            self._finish_feeding()
+            return
+
+        client = self._client_for(clients, event.client)
+
+        if client is None:
+            self.skipped[event.client] += 1
+            self.bot.event_loop.schedule(self._next)
+            return
+
+        if self._first_ts is None:
+            self._first_ts = event.ts
+
+        delay = 0
+
+        if self.speed:
+            delay = self.started + (event.ts - self._first_ts) / self.speed - \
+                time.monotonic()
+
+        if delay > 0:
+            self.bot.event_loop.schedule_in(timedelta(seconds=delay),
+                                            self._feed, client, event)
+        else:
+            self.bot.event_loop.schedule(self._feed, client, event)
+
+    def _feed(self, client, event):
+        self.fed_at = time.monotonic()
+
+        self.events += 1
+        self.lines += event.data.count(b"\n")
+        self.bytes += len(event.data)
+
+        try:
+            client.on_data(event.data)
+        except Exception:
+            logger.exception("Replaying an event for %s failed", client.name)
+
+        # the handlers for this data were scheduled first, so they run, and
+        # any hooks they run start, before the next event is fed
+        self.bot.event_loop.schedule(self._next)
+
+    def hook_started(self):
+        self.outstanding += 1
+        return self.fed_at if self.fed_at is not None else time.monotonic()
+
+    def hook_done(self, name, fed_at):
+        self.outstanding -= 1
+        self.latencies[name].append(time.monotonic() - fed_at)
+
+        if self.feeding_done and self.outstanding == 0:
+            self._stop()
+
+    def _finish_feeding(self):
+        self.feeding_done = True
+
+        if self.outstanding == 0:
+            self._stop()
+        else:
+            # hooks still waiting on e.g. HTTP requests get a little longer
+            self.bot.event_loop.schedule_in(
+                timedelta(seconds=self.drain_timeout), self._stop)
+
+    def _stop(self):
+        if self.finished is not None:
+            return
+
+        self.finished = time.monotonic()
+        self.bot.stop()
+
+    def report(self):
+        """
+        Describe how the replay went, one line at a time.
+        """
+        elapsed = max((self.finished or time.monotonic()) - self.started,
+                      1e-9)
+        latencies = sorted(l for ls in self.latencies.values() for l in ls)
+
+        report = [
+            "Replayed {} events ({} lines, {} bytes) from {} network(s) in {:.2f}s".format(
+                self.events, self.lines, self.bytes, len(self.bot.clients),
+                elapsed),
+            "Throughput: {:.0f} lines/s, {:.0f} hook runs/s".format(
+                self.lines / elapsed, len(latencies) / elapsed),
+            "Hook latency: p50 {:.2f}ms, p90 {:.2f}ms, p99 {:.2f}ms, max {:.2f}ms".format(
+                *(percentile(latencies, p) * 1000 for p in (50, 90, 99, 100))),
+            "Sent: {} lines".format(sum(client.connection.sent_lines
+                                        for client in self.bot.clients.values()))
+        ]
+
+        if self.outstanding:
+            report.append("Unfinished: {} hook runs".format(self.outstanding))
+
+        for name, count in sorted(self.skipped.items()):
+            report.append("Skipped: {} events for {}, which isn't configured".format(
+                count, name))
+
+        report.append("{:<24} {:>8} {:>10} {:>10}".format("event", "runs",
+                                                        "p50 ms", "p99 ms"))
+
+        for name, ls in sorted(self.latencies.items(),
+                               key=lambda x: -percentile(sorted(x[1]), 99)):
+            ls = sorted(ls)
+            report.append("{:<24} {:>8} {:>10.2f} {:>10.2f}".format(
+                name, len(ls), percentile(ls, 50) * 1000,
+                percentile(ls, 99) * 1000))
+
+        return report
+
+
+class ReplayBot(Bot):
+    """
+    A bot whose clients are fed from a journal instead of connecting.
+
+    It uses a copy of the given database, or an empty one, so that replaying
+    doesn't change the real one.
+    """
+
+    def __init__(self, config_file, journal, speed=1.0, drain_timeout=10.0,
+                 database=None):
+        fd, self.replay_database = tempfile.mkstemp(prefix="kochira-replay-",
+                                                    suffix=".db")
+        os.close(fd)
+
+        if database is not None:
+            shutil.copyfile(database, self.replay_database)
+
+        super().__init__(config_file)
+        self.replay = Replay(self, journal, speed, drain_timeout)
+
+    def _connect_to_db(self, db_name=None):
+        super()._connect_to_db(self.replay_database)
+
+    def _open_journal(self):
+        # replaying isn't recorded again
+        pass
+
+    def _connect_to_irc(self):
+        self.event_loop.schedule(self.replay.start)
+
+    def stop(self):
+        super().stop()
+
+        try:
+            os.unlink(self.replay_database)
+        except OSError:
+            pass
@@ -1,96 +1,423 @@
-import threading
+import functools
+import heapq
+import itertools
 import logging
+import random
+import time
+from datetime import datetime, timedelta
+
+import peewee
 from pydle.async import Future
 
+from .db import Model
+from . import metrics
 from .service import HookContext
+from .userdata import JSONField
 
 
 logger = logging.getLogger(__name__)
 
+TASK_RUNS = metrics.registry.counter(
+    "kochira_scheduler_runs_total", "Scheduled task runs.", ["service", "task"])
+TASK_FAILURES = metrics.registry.counter(
+    "kochira_scheduler_failures_total", "Scheduled task failures.",
+    ["service", "task"])
+TASK_MISFIRES = metrics.registry.counter(
+    "kochira_scheduler_misfires_total",
+    "Scheduled task runs skipped for starting too late.", ["service", "task"])
+TASK_LAG = metrics.registry.histogram(
+    "kochira_scheduler_lag_seconds",
+    "How late scheduled tasks started compared to when they were due.",
+    ["service", "task"])
+TASK_DURATION = metrics.registry.histogram(
+    "kochira_scheduler_duration_seconds",
+    "Time scheduled tasks spent running on the event loop.",
+    ["service", "task"])
+
+
+class ScheduledJob(Model):
+    """
+    A persisted job, to be restored when its service is next loaded.
+    """
+
+    service = peewee.CharField(255)
+    task = peewee.CharField(255)
+    args = JSONField()
+    kwargs = JSONField()
+    ts = peewee.DateTimeField()
+    interval = peewee.FloatField(null=True)
+
+    class Meta:
+        indexes = (
+            (("service",), False),
+        )
+
+
+def _seconds(t):
+    if isinstance(t, timedelta):
+        return t.total_seconds()
+    return t
+
+
+class Job:
+    """
+    A task scheduled to run at some point, and optionally periodically
+    thereafter.
+    """
+
+    def __init__(self, scheduler, due, task, args, kwargs, interval=None,
+                 jitter=0, misfire_grace=None, record=None):
+        self.scheduler = scheduler
+        self.due = due
+        self.when = due
+        self.task = task
+        self.args = args
+        self.kwargs = kwargs
+        self.interval = interval
+        self.jitter = jitter
+        self.misfire_grace = misfire_grace
+        self.record = record
+        self.cancelled = False
+
+        self.ctx = HookContext(task.service, scheduler.bot)
+
+    @property
+    def service_name(self):
+        return self.task.service.name
+
+    def cancel(self):
+        self.scheduler.unschedule(self)
+
+    def __repr__(self):
+        return "<{__name__} {service}.{task} due={due}{interval}>".format(
+            __name__=self.__class__.__name__,
+            service=self.service_name,
+            task=self.task.__name__,
+            due=self.due,
+            interval=" every={}".format(self.interval)
+                     if self.interval is not None else ""
+        )
+
+
+class TaskStats:
+    """
+    Run statistics for a scheduled task.
+
+    ``lag`` is how late each run started compared to when it was due, and
+    ``duration`` how long it ran on the event loop, both in seconds.
+    """
+
+    def __init__(self, service_name, task_name):
+        self.runs = TASK_RUNS.labels(service_name, task_name)
+        self.failures = TASK_FAILURES.labels(service_name, task_name)
+        self.misfires = TASK_MISFIRES.labels(service_name, task_name)
+        self.lag = TASK_LAG.labels(service_name, task_name)
+        self.duration = TASK_DURATION.labels(service_name, task_name)
+
 
 class Scheduler:
+    # rebuild the heap once more than this fraction of it is cancelled jobs
+    COMPACT_RATIO = 0.5
+
     def __init__(self, bot):
         self.bot = bot
 
-        self.timeouts = {}
-        self.periods = {}
+        self.jobs = {}
+        self.stats = {}
+
+        self._heap = []
+        self._seq = itertools.count()
+        self._num_cancelled = 0
+
+        self._timeout = None
+        self._timeout_when = None
 
-        self._next_period_id = 0
+        metrics.registry.add_collector(self._collect_metrics)
 
-    def _error_handler(self, future):
+    def _collect_metrics(self):
+        pending = metrics.Metric("gauge", "kochira_scheduler_pending_jobs",
+                                 "Scheduled jobs waiting to run.",
+                                 ["service"], metrics.Gauge)
+
+        for service_name, jobs in self.jobs.items():
+            pending.labels(service_name).set(len(jobs))
+
+        return [pending]
+
+    def close(self):
+        """
+        Stop running jobs and reporting metrics, when the bot stops.
+        """
+        metrics.registry.remove_collector(self._collect_metrics)
+
+        if self._timeout is not None:
+            self.bot.event_loop.unschedule(self._timeout)
+            self._timeout = None
+
+    def _error_handler(self, stats, future):
         exc = future.exception()
         if exc is not None:
+            stats.failures.inc()
             logging.error("Background task error",
                           exc_info=(exc.__class__, exc, exc.__traceback__))
 
-    def schedule_after(self, _time, _task, *_args, **_kwargs):
+    def _push(self, job):
+        job.when = job.due + (random.uniform(0, job.jitter) if job.jitter else 0)
+        heapq.heappush(self._heap, (job.when, next(self._seq), job))
+
+    def _add(self, job):
+        self.jobs.setdefault(job.service_name, set([])).add(job)
+        self._push(job)
+        self._arm()
+
+    def _remove(self, job):
+        jobs = self.jobs.get(job.service_name)
+
+        if jobs is not None:
+            jobs.discard(job)
+            if not jobs:
+                del self.jobs[job.service_name]
+
+    def _arm(self):
         """
-        Schedule a task to run after a given amount of time.
+        Make sure there's an event loop timeout for the earliest job.
         """
-        logger.info("Scheduling %s.%s in %s", _task.service.name, _task.__name__, _time)
+        while self._heap and self._heap[0][2].cancelled:
+            heapq.heappop(self._heap)
+            self._num_cancelled -= 1
+
+        if not self._heap:
+            when = None
+        else:
+            when, _, _ = self._heap[0]
+
+        if when == self._timeout_when:
+            return
+
+        if self._timeout is not None:
+            self.bot.event_loop.unschedule(self._timeout)
+            self._timeout = None
 
-        timeout = None
-        ctx = HookContext(_task.service, self.bot)
+        self._timeout_when = when
 
-        def _handler():
-            # ghetto-ass code for removing the timeout on completion
-            nonlocal timeout
+        if when is not None:
+            self._timeout = self.bot.event_loop.schedule_in(
+                timedelta(seconds=max(0, when - time.monotonic())),
+                self._run_due)
 
-            r = _task(ctx, *_args, **_kwargs)
+    def _compact(self):
+        if self._num_cancelled <= len(self._heap) * self.COMPACT_RATIO:
+            return
 
-            if isinstance(r, Future):
-                r.add_done_callback(self._error_handler)
+        self._heap = [entry for entry in self._heap if not entry[2].cancelled]
+        heapq.heapify(self._heap)
+        self._num_cancelled = 0
 
-            self.timeouts[_task.service.name].remove(timeout)
+    def _run_due(self):
+        self._timeout = None
+        self._timeout_when = None
 
-        timeout = self.bot.event_loop.schedule_in(_time, _handler)
+        now = time.monotonic()
 
-        self.timeouts.setdefault(_task.service.name, set([])).add(timeout)
-        return (_task.service.name, timeout)
+        while self._heap and self._heap[0][0] <= now:
+            _, _, job = heapq.heappop(self._heap)
 
-    def schedule_every(self, _interval, _task, *_args, **_kwargs):
+            if job.cancelled:
+                self._num_cancelled -= 1
+                continue
+
+            self._fire(job, now)
+
+        self._arm()
+
+    def stats_for(self, service_name, task_name):
+        """
+        Get the run statistics for a task.
+        """
+        key = (service_name, task_name)
+
+        if key not in self.stats:
+            self.stats[key] = TaskStats(service_name, task_name)
+
+        return self.stats[key]
+
+    def _fire(self, job, now):
+        lateness = max(0, time.monotonic() - job.when)
+
+        if job.interval is not None:
+            # fixed rate, but coalesce any runs we've missed into one
+            job.due += job.interval
+            if job.due <= now:
+                job.due = now + job.interval
+
+            self._push(job)
+
+            if job.record is not None:
+                job.record.ts = datetime.utcnow() + timedelta(seconds=job.due - now)
+                job.record.save()
+        else:
+            # a finished job can't be unscheduled any more
+            job.cancelled = True
+            self._remove(job)
+
+            if job.record is not None:
+                job.record.delete_instance()
+
+        stats = self.stats_for(job.service_name, job.task.__name__)
+        stats.lag.observe(lateness)
+
+        if job.misfire_grace is not None and lateness > job.misfire_grace:
+            stats.misfires.inc()
+            logger.warning("Skipping %s.%s, which misfired by %.3fs",
+                           job.service_name, job.task.__name__, lateness)
+            return
+
+        stats.runs.inc()
+        start = time.monotonic()
+
+        try:
+            r = job.task(job.ctx, *job.args, **job.kwargs)
+        except Exception:
+            stats.failures.inc()
+            logger.exception("Scheduled task error")
+            return
+        finally:
+            stats.duration.observe(time.monotonic() - start)
+
+        if isinstance(r, Future):
+            r.add_done_callback(functools.partial(self._error_handler, stats))
+
+    def _schedule(self, delay, task, args, kwargs, interval=None, jitter=0,
+                  misfire_grace=None, persist=False):
+        delay = _seconds(delay)
+        jitter = _seconds(jitter)
+        misfire_grace = _seconds(misfire_grace)
+
+        if interval is not None and interval <= 0:
+            # the job would be due again as soon as it ran, forever
+            raise ValueError("interval must be positive, not {}".format(interval))
+
+        record = None
+
+        if persist:
+            record = ScheduledJob.create(
+                service=task.service.name,
+                task=task.__name__,
+                args=list(args),
+                kwargs=kwargs,
+                ts=datetime.utcnow() + timedelta(seconds=delay),
+                interval=interval
+            )
+
+        job = Job(self, time.monotonic() + delay, task, args, kwargs,
+                  interval=interval, jitter=jitter,
+                  misfire_grace=misfire_grace, record=record)
+        self._add(job)
+        return job
+
+    def schedule_after(self, _time, _task, *_args, _jitter=0,
+                       _misfire_grace=None, _persist=False, **_kwargs):
+        """
+        Schedule a task to run after a given amount of time.
+
+        ``_jitter`` adds a random delay of up to the given amount.
+        ``_misfire_grace`` skips the run if it would start later than the
+        given amount after it was due. ``_persist`` stores the job in the
+        database so it is restored when the service is next loaded, in which
+        case its arguments must be JSON serializable.
+        """
+        logger.info("Scheduling %s.%s in %s", _task.service.name, _task.__name__, _time)
+
+        return self._schedule(_time, _task, _args, _kwargs, jitter=_jitter,
+                              misfire_grace=_misfire_grace, persist=_persist)
+
+    def schedule_every(self, _interval, _task, *_args, _jitter=0,
+                       _misfire_grace=None, _persist=False, **_kwargs):
         """
         Schedule a task to run at every given interval.
+
+        Runs missed because the event loop was busy are coalesced into one.
+        The interval must be positive. The remaining options are the same as
+        ``schedule_after``.
         """
         logger.info("Scheduling %s.%s every %s", _task.service.name, _task.__name__, _interval)
 
-        period_id = self._next_period_id
-        self._next_period_id += 1
-
-        ctx = HookContext(_task.service, self.bot)
+        interval = _seconds(_interval)
 
-        def _handler():
-            if period_id not in self.periods.get(_task.service.name, set([])):
-                return False
+        return self._schedule(interval, _task, _args, _kwargs,
+                              interval=interval, jitter=_jitter,
+                              misfire_grace=_misfire_grace, persist=_persist)
 
-            r = _task(ctx, *_args, **_kwargs)
+    def unschedule(self, job, forget=True):
+        """
+        Unschedule a job.
 
-            if isinstance(r, Future):
-                r.add_done_callback(self._error_handler)
+        Unless ``forget`` is false, a persisted job is also removed from the
+        database.
+        """
+        if job.cancelled:
+            return
 
-            return True
+        job.cancelled = True
+        self._num_cancelled += 1
+        self._remove(job)
 
-        self.bot.event_loop.schedule_periodically(_interval, _handler)
-        self.periods.setdefault(_task.service.name, set([])).add(period_id)
-        return (_task.service.name, period_id)
+        if forget and job.record is not None:
+            job.record.delete_instance()
 
-    def unschedule_timeout(self, timeout):
-        service_name, timeout = timeout
-        self.bot.event_loop.unschedule(timeout)
-        self.timeouts[service_name].remove(timeout)
+        self._compact()
+        self._arm()
 
-    def unschedule_period(self, period):
-        service_name, period_id = period
-        self.periods[service_name].remove(period_id)
+    unschedule_timeout = unschedule
+    unschedule_period = unschedule
 
     def unschedule_service(self, service):
+        """
+        Unschedule all of a service's jobs. Persisted jobs are kept in the
+        database so that they can be restored later.
+        """
         logger.info("Unscheduling all tasks for service %s", service.name)
 
-        if service.name in self.timeouts:
-            for timeout in list(self.timeouts[service.name]):
-                self.unschedule_timeout((service.name, timeout))
+        for job in list(self.jobs.get(service.name, [])):
+            self.unschedule(job, forget=False)
 
-            del self.timeouts[service.name]
+    def restore_service(self, service):
+        """
+        Restore a service's persisted jobs.
+        """
+        tasks = {task.__name__: task for task in service.tasks}
+        now = datetime.utcnow()
+
+        # jobs persisted during setup are already scheduled
+        scheduled = set(job.record.id for job in self.jobs.get(service.name, [])
+                        if job.record is not None)
+
+        for record in ScheduledJob.select() \
+            .where(ScheduledJob.service == service.name):
+            if record.id in scheduled:
+                continue
+
+            if record.task not in tasks:
+                logger.warning("Dropping persisted job for unknown task %s.%s",
+                               service.name, record.task)
+                record.delete_instance()
+                continue
+
+            delay = max(0, (record.ts - now).total_seconds())
+
+            logger.info("Restoring %s.%s in %s", service.name, record.task,
+                        timedelta(seconds=delay))
+
+            job = Job(self, time.monotonic() + delay, tasks[record.task],
+                      record.args, record.kwargs, interval=record.interval,
+                      record=record)
+            self._add(job)
+
+    def pending(self, service=None):
+        """
+        Get the number of pending jobs, either in total or for a service.
+        """
+        if service is None:
+            return sum(len(jobs) for jobs in self.jobs.values())
 
-        if service.name in self.periods:
-            del self.periods[service.name]
+        return len(self.jobs.get(service.name, []))
@@ -9,23 +9,29 @@ import os
 from pydle.async import coroutine, Future
 
 from .auth import has_permission, requires_permission
+from .executor import Rejected, preload_modules
+from .outbox import Outbox
+from .storage import LocalStorage
 from .userdata import UserData
-from . import config
+from . import config, metrics
 
-from .util import Expando
 
 logger = logging.getLogger(__name__)
 
+COMMANDS = metrics.registry.counter(
+    "kochira_commands_total", "Commands matched.", ["service", "command"])
+
 
 class Config(config.Config):
     autoload = config.Field(doc="Autoload this service?", default=True)
     enabled = config.Field(doc="Enable this service?", default=True)
+    storage = config.Field(doc="Where to keep the service's storage: \"local\" to this process, or \"shared\" between the workers of a supervisor.", default="local")
 
 
 class BoundService:
-    def __init__(self, service):
+    def __init__(self, service, storage=None):
         self.service = service
-        self.storage = Expando()
+        self.storage = storage if storage is not None else LocalStorage()
         self.contexts = {}
 
 
@@ -41,24 +47,44 @@ class HookContext:
 
     @property
     def config(self):
-        config = self.bot.config.services.get(self.service.name, self.service.config_factory())
+        client_config = None
+        channel = None
 
         if self.client is not None:
             client_config = self.bot.config.clients[self.client.name]
-            config = config.combine(client_config.services.get(self.service.name, self.service.config_factory()))
 
             if self.target is not None and self.target in client_config.channels:
-                channel_config = client_config.channels[self.target]
+                channel = self.target
+
+        # configs are read-only, so the combined config can be shared until
+        # the next rehash
+        key = (self.service.name,
+               self.client.name if self.client is not None else None,
+               channel)
+
+        try:
+            return self.bot.service_config_cache[key]
+        except KeyError:
+            pass
+
+        config = self.bot.config.services.get(self.service.name, self.service.config_factory())
+
+        if client_config is not None:
+            config = config.combine(client_config.services.get(self.service.name, self.service.config_factory()))
+
+            if channel is not None:
+                channel_config = client_config.channels[channel]
                 config = config.combine(channel_config.services.get(self.service.name, self.service.config_factory()))
 
+        self.bot.service_config_cache[key] = config
         return config
 
     @property
     def storage(self):
         return self.service.binding_for(self.bot).storage
 
-    def message(self, message):
-        self.client.message(self.target, message)
+    def message(self, message, priority=Outbox.NORMAL):
+        self.client.message(self.target, message, priority)
 
     def respond(self, message):
         @coroutine
@@ -66,10 +92,11 @@ class HookContext:
             if (yield self.client._run_hooks(
                 "respond", self.target, self.origin,
                 [self.target, self.origin, message])) is not Service.EAT:
+                # replies go ahead of everything else queued to send
                 self.message(self.client.config.response_format.format(
                     origin=self.origin,
                     message=message
-                ))
+                ), priority=Outbox.REPLY)
 
         return _coro()
 
@@ -141,6 +168,8 @@ class Service:
         self.config_factory = Config
         self.on_setup = None
         self.on_shutdown = None
+        self.on_export = None
+        self.on_import = None
         self.providers = {}
         self.logger = logging.getLogger(self.name)
 
@@ -222,6 +251,8 @@ class Service:
                 if match is None:
                     return
 
+                COMMANDS.labels(self.name, f.__name__).inc()
+
                 kwargs = match.groupdict()
 
                 for k, v in kwargs.items():
@@ -284,6 +315,23 @@ class Service:
         self.on_shutdown = f
         return f
 
+    def export_state(self, f):
+        """
+        Register a function to export the service's state when it's reloaded,
+        instead of shutting down. Whatever it returns is passed to the new
+        version's ``import_state`` function.
+        """
+        self.on_export = f
+        return f
+
+    def import_state(self, f):
+        """
+        Register a function to take over the state exported by the previous
+        version of the service when it's reloaded, instead of setting up.
+        """
+        self.on_import = f
+        return f
+
     def provides(self, name):
         """
         Register a provider function to expose to other services.
@@ -308,6 +356,9 @@ class Service:
         if self.on_setup is not None:
             self.on_setup(ctx)
 
+        # bring back any jobs persisted from a previous run
+        bot.scheduler.restore_service(self)
+
     def run_shutdown(self, bot):
         """
         Run all shutdown functions for the service.
@@ -320,6 +371,27 @@ class Service:
         if self.on_shutdown is not None:
             self.on_shutdown(ctx)
 
+    def run_export(self, bot):
+        """
+        Export the service's state ahead of a reload.
+        """
+        # unschedule remaining work; the new version restores it
+        bot.scheduler.unschedule_service(self)
+
+        ctx = HookContext(self, bot)
+        return self.on_export(ctx)
+
+    def run_import(self, bot, state):
+        """
+        Take over state exported by the previous version of the service.
+        """
+        self._autocreate_models()
+
+        ctx = HookContext(self, bot)
+        self.on_import(ctx, state)
+
+        bot.scheduler.restore_service(self)
+
     def binding_for(self, bot):
         """
         Get the service binding.
@@ -344,30 +416,80 @@ class Service:
         self.binding_for(client.bot).contexts[client.name][target].remove(context)
 
 
-def background(f):
+def background(f=None, pool="io"):
     """
-    Defer a command to run in the background.
+    Defer a command to run in the background, on the named executor pool:
+    ``io`` for blocking calls, ``cpu`` for computation and ``subprocess`` for
+    running external programs.
+
+    Can be used either as ``@background`` or ``@background(pool="cpu")``.
+    Work the pool rejects, e.g. because its queue is full or the origin
+    already has too much queued, is logged and dropped.
     """
 
+    if f is None:
+        return functools.partial(background, pool=pool)
+
     f.background = True
 
     @functools.wraps(f)
     @coroutine
     def _inner(ctx, *args, **kwargs):
-        result = yield ctx.bot.executor.submit(f, ctx, *args, **kwargs)
-
-        @coroutine
-        def _cont():
-            nonlocal result
+        # rate limit per origin, but not things like scheduled tasks
+        if ctx.origin is not None:
+            key = (ctx.client.name, ctx.origin)
+        else:
+            key = None
 
-            if isinstance(result, Future):
-                result = yield result
-            return result
+        try:
+            result = yield ctx.bot.executors[pool].submit_keyed(
+                key, f, ctx, *args, **kwargs)
+        except Rejected as e:
+            logger.warning("Dropped %s.%s: %s", ctx.service.name, f.__name__, e)
+            return
 
         # If we yielded the future from another thread (i.e. an executor
         # thread), we do this song and dance to force it back into the main
-        # thread.
-        return (yield ctx.bot.defer_from_thread(_cont))
+        # thread. If the result is itself a future, it's waited on there.
+        return (yield ctx.bot.defer_from_thread(lambda: result))
+
+    return _inner
+
+
+def in_process(f):
+    """
+    Run a CPU-bound function in the bot's worker processes, where it can use
+    another core instead of holding the GIL.
+
+    The function must be defined at module level and take and return
+    picklable values, so it can't be given the context. Instead, it is
+    called as ``yield f(ctx, *args)`` from the event loop, or
+    ``f(ctx, *args).result()`` from a ``@background`` function, and ``ctx``
+    is not passed on. Its module is imported in the workers ahead of time,
+    so any heavy modules it imports are already loaded when it first runs.
+    """
+
+    preload_modules.add(f.__module__)
+
+    @functools.wraps(f)
+    def _inner(ctx, *args, **kwargs):
+        fut = Future()
+
+        def _resolve(inner):
+            exc = inner.exception()
+
+            if exc is not None:
+                fut.set_exception(exc)
+            else:
+                fut.set_result(inner.result())
+
+        # the process pool finishes work on its own thread, so bring the
+        # result back onto the event loop
+        ctx.bot.process_executor.submit(_inner, *args, **kwargs) \
+            .add_done_callback(lambda inner: ctx.bot.call_on_loop(
+                _resolve, inner))
+
+        return fut
 
     return _inner
 
@@ -4,6 +4,8 @@ Account management.
 Allows users to manage their account information.
 """
 
+from datetime import timedelta
+
 from pydle.async import Future
 
 from kochira.service import Service, coroutine
@@ -11,19 +13,92 @@ from kochira.userdata import UserData
 
 service = Service(__name__, __doc__)
 
+# how long a link request waits to be confirmed
+CONFIRMATION_TIMEOUT = timedelta(minutes=10)
+
 
 @service.setup
 def init_confirmations(ctx):
     ctx.storage.confirmations = {}
+    ctx.storage.expiries = {}
+
+
+def wait_for_confirmation(ctx, account, network, alt_account, alt_network):
+    """
+    Wait for a link to be confirmed, with the other account's account and
+    network, None if it isn't confirmed in time, or False if it's asked for
+    again.
+    """
+    key = (account, network, alt_account, alt_network)
 
+    # asking again replaces the earlier request
+    previous = pop_confirmation(ctx, key)
+    if previous is not None:
+        previous.set_result(False)
 
-def wait_for_confirmation(storage, account, network, alt_account, alt_network):
     confirmation = Future()
-    storage.confirmations[account, network,
-                          alt_account, alt_network] = confirmation
+    ctx.storage.confirmations[key] = confirmation
+    ctx.storage.expiries[key] = ctx.bot.scheduler.schedule_after(
+        CONFIRMATION_TIMEOUT, expire_confirmation, key)
+
+    # the other network may be run by another worker, which can only find
+    # out about this through the supervisor
+    if ctx.bot.ipc is not None:
+        ctx.bot.ipc.call("kv.set", ("account.confirmations",) + key, True)
+
     return confirmation
 
 
+def pop_confirmation(ctx, key):
+    """
+    Stop waiting for a link to be confirmed, returning the future waiting on
+    it, if any.
+    """
+    expiry = ctx.storage.expiries.pop(key, None)
+    if expiry is not None:
+        expiry.cancel()
+
+    return ctx.storage.confirmations.pop(key, None)
+
+
+@service.task
+def expire_confirmation(ctx, key):
+    fut = pop_confirmation(ctx, key)
+
+    if fut is None:
+        return
+
+    if ctx.bot.ipc is not None:
+        ctx.bot.ipc.call("kv.pop", ("account.confirmations",) + key)
+
+    fut.set_result(None)
+
+
+@service.hook("ipc_event")
+def on_ipc_event(ctx, topic, payload):
+    if topic != "account.confirmed":
+        return
+
+    key, alt_account = payload
+    fut = pop_confirmation(ctx, tuple(key))
+
+    if fut is not None:
+        fut.set_result(tuple(alt_account))
+
+
+def _check_link(ctx, user_data, alt_user_data):
+    if user_data.account == alt_user_data.account and \
+       user_data.network == alt_user_data.network:
+        ctx.respond(ctx._("You can't link your account to itself."))
+        return False
+
+    if "_alias" in alt_user_data:
+        ctx.respond(ctx._("You can't link your account to an alias."))
+        return False
+
+    return True
+
+
 @service.command(r"!link (?P<account>\S+) (?P<network>\S+)")
 @coroutine
 def link(ctx, account, network):
@@ -41,31 +116,54 @@ def link(ctx, account, network):
         ctx.respond(ctx._("Please log in to NickServ before linking an account."))
         return
 
+    if network not in ctx.bot.config.clients:
+        ctx.respond(ctx._("I can't find that network."))
+        return
+
     try:
         alt_client, *_ = [client for client in ctx.bot.clients.values()
                           if client.network == network]
     except ValueError:
-        ctx.respond(ctx._("I can't find that network."))
-        return
+        # another worker might be connected to it, in which case we find out
+        # who the account is when it's confirmed
+        if ctx.bot.ipc is None:
+            ctx.respond(ctx._("I can't find that network."))
+            return
 
-    alt_user_data = yield UserData.lookup_default(alt_client, account)
+        alt_user_data = None
+    else:
+        alt_user_data = yield UserData.lookup_default(alt_client, account)
 
-    if user_data.account == alt_user_data.account and \
-       user_data.network == alt_user_data.network:
-        ctx.respond(ctx._("You can't link your account to itself."))
-        return
-
-    if "_alias" in alt_user_data:
-        ctx.respond(ctx._("You can't link your account to an alias."))
-        return
+        if not _check_link(ctx, user_data, alt_user_data):
+            return
 
     ctx.respond(ctx._("Okay, please message me \"!confirmlink {account} {network}\" on that network.").format(
         account=ctx.origin,
         network=ctx.client.network
     ))
 
-    yield wait_for_confirmation(ctx.storage, ctx.origin, ctx.client.network,
-                                account, network)
+    confirmation = yield wait_for_confirmation(ctx, ctx.origin,
+                                               ctx.client.network,
+                                               account, network)
+
+    if confirmation is False:
+        # asked for again, and the newer request carries on
+        return
+
+    if confirmation is None:
+        ctx.respond(ctx._("The link to {account} on {network} wasn't confirmed in time.").format(
+            account=account,
+            network=network
+        ))
+        return
+
+    alt_account, alt_network = confirmation
+
+    if alt_user_data is None:
+        alt_user_data = UserData(ctx.bot, alt_network, alt_account)
+
+        if not _check_link(ctx, user_data, alt_user_data):
+            return
 
     data = dict(alt_user_data)
     data.update(user_data)
@@ -101,13 +199,25 @@ def confirm_link(ctx, account, network):
         ctx.respond(ctx._("Please log in to NickServ before confirming linkage."))
         return
 
-    fut = ctx.storage.confirmations \
-        .get((account, network, ctx.origin, ctx.client.network))
+    key = (account, network, ctx.origin, ctx.client.network)
+    fut = pop_confirmation(ctx, key)
 
-    if fut is None:
+    if ctx.bot.ipc is not None:
+        requested = yield ctx.bot.ipc.call_async("kv.pop",
+                                                 ("account.confirmations",) + key)
+    else:
+        requested = None
+
+    if fut is None and requested is None:
         ctx.respond(ctx._("That account hasn't requested linkage."))
         return
 
     ctx.respond(ctx._("Link confirmed."))
 
-    fut.set_result(None)
+    alt_account = (user_data.account, user_data.network)
+
+    if fut is not None:
+        fut.set_result(alt_account)
+    else:
+        # the link was requested on a network another worker runs
+        ctx.bot.ipc.publish("account.confirmed", (key, alt_account))
@@ -22,7 +22,8 @@ def load_service(ctx, r, service_name):
     Load service.
 
     Load or reload a service with the given name. Reloading will force all code to
-    be reloaded.
+    be reloaded, including services which import from it. Services which can hand
+    their state over keep it across the reload.
     """
 
     try:
@@ -113,7 +114,7 @@ def rehash(ctx):
     """
 
     try:
-        ctx.bot.rehash()
+        diff = ctx.bot.rehash()
     except BaseException as e:
         ctx.respond(ctx._("Sorry, couldn't rehash."))
         ctx.respond("↳ {name}: {info}".format(
@@ -124,19 +125,27 @@ def rehash(ctx):
 
     ctx.respond(ctx._("Configuration rehashed."))
 
+    for line in diff.summary():
+        ctx.respond("↳ " + line)
 
-@service.command(r"re(?:start|boot)$", mention=True, priority=3000)
+
+@service.command(r"re(?:start|boot)(?: (?P<cold>cold))?$", mention=True, priority=3000)
 @requires_permission("admin")
-def restart(ctx):
+def restart(ctx, cold=None):
     """
     Restart.
 
     Restart the bot. Will ``exec`` a new process into the currently running process
-    space.
+    space. Connections to networks and the web server are handed over to the new
+    process, so it picks up where this one left off without reconnecting, except
+    for TLS connections. Say ``restart cold`` to disconnect everything instead.
     """
 
-    for ctx.client in list(ctx.bot.clients.values()):
-        ctx.client.quit(ctx._("Restarting..."))
+    if cold is not None or sys.platform == 'win32':
+        for ctx.client in list(ctx.bot.clients.values()):
+            ctx.client.quit(ctx._("Restarting..."))
+    else:
+        ctx.bot.prepare_handoff(ctx._("Restarting..."))
 
     @ctx.bot.event_loop.schedule
     def _restart():
@@ -9,14 +9,16 @@ import re
 
 from kochira import config
 from kochira.service import Service, Config
-from docutils.core import publish_parts
+from kochira.util import lazy_import
 from tornado.web import RequestHandler, Application, HTTPError, UIModule
 
 service = Service(__name__, __doc__)
 
+docutils_core = lazy_import("docutils.core")
+
 
 def rst(s, **kw):
-    return publish_parts(s, writer_name="html", **kw)["fragment"]
+    return docutils_core.publish_parts(s, writer_name="html", **kw)["fragment"]
 
 
 def trim_docstring(docstring):
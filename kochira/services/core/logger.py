@@ -109,6 +109,24 @@ def shutdown_logger(ctx):
     close_all_handles(ctx.storage)
 
 
+@service.export_state
+def export_handles(ctx):
+    return ctx.storage
+
+
+@service.import_state
+def import_handles(ctx, storage):
+    # keep the logs open, unless they're meant to be somewhere else now
+    if storage.path != Path(ctx.config.log_dir):
+        close_all_handles(storage)
+        setup_logger(ctx)
+        return
+
+    ctx.storage.handles = storage.handles
+    ctx.storage.path = storage.path
+    ctx.storage.lock = storage.lock
+
+
 @service.hook("sighup")
 def flush_log_handles(ctx):
     close_all_handles(ctx.storage)
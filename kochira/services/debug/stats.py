@@ -0,0 +1,88 @@
+"""
+Run-time statistics.
+
+Shows statistics about the bot's internals, such as event loop latency, hook,
+scheduled task and service load timings, on the web server.
+"""
+
+from tornado.web import RequestHandler, Application
+
+from kochira.service import Service
+
+service = Service(__name__, __doc__)
+
+
+def get_task_stats(bot):
+    """
+    Get a summary of scheduled task statistics, one row per task.
+    """
+    scheduler = bot.scheduler
+
+    for (service_name, task_name), stats in sorted(scheduler.stats.items()):
+        yield {
+            "service": service_name,
+            "task": task_name,
+            "pending": len([job for job in scheduler.jobs.get(service_name, [])
+                            if job.task.__name__ == task_name]),
+            "runs": stats.runs.value,
+            "failures": stats.failures.value,
+            "misfires": stats.misfires.value,
+            "lag_mean": stats.lag.mean,
+            "lag_max": stats.lag.max,
+            "duration_p50": stats.duration.percentile(0.5),
+            "duration_p99": stats.duration.percentile(0.99),
+            "duration_max": stats.duration.max
+        }
+
+
+def get_hook_stats(bot):
+    """
+    Get a summary of hook timings, one row per hook, slowest first.
+    """
+    rows = []
+
+    for (service_name, hook_name, fn_name), duration in bot.watchdog.hook_stats.items():
+        rows.append({
+            "service": service_name,
+            "hook": hook_name,
+            "function": fn_name,
+            "runs": duration.count,
+            "duration_total": duration.sum,
+            "duration_p50": duration.percentile(0.5),
+            "duration_p90": duration.percentile(0.9),
+            "duration_p99": duration.percentile(0.99),
+            "duration_max": duration.max
+        })
+
+    rows.sort(key=lambda row: -row["duration_total"])
+    return rows
+
+
+class IndexHandler(RequestHandler):
+    def get(self):
+        bot = self.application.ctx.bot
+
+        self.render("stats/index.html",
+                    pending=sorted((name, len(jobs))
+                                   for name, jobs in bot.scheduler.jobs.items()),
+                    tasks=list(get_task_stats(bot)),
+                    latency=bot.watchdog.latency,
+                    stalls=bot.watchdog.stalls.value,
+                    hooks=get_hook_stats(bot),
+                    service_timings=sorted(bot.service_timings.items(),
+                                           key=lambda x: -sum(x[1].values())))
+
+
+def make_application(settings):
+    return Application([
+        (r"/", IndexHandler)
+    ], **settings)
+
+
+@service.hook("services.net.webserver")
+def webserver_config(ctx):
+    return {
+        "name": "stats",
+        "title": "Statistics",
+        "application_factory": make_application
+    }
@@ -8,7 +8,7 @@ without using five common additional words.
 from collections import OrderedDict
 
 from kochira.auth import requires_permission
-from kochira.service import Service, requires_context
+from kochira.service import Service, HookContext, requires_context
 from kochira.db import Model
 
 import peewee
@@ -21,6 +21,24 @@ def setup_contexts(ctx):
     ctx.storage.games = {}
 
 
+@service.export_state
+def export_games(ctx):
+    return ctx.storage.games
+
+
+@service.import_state
+def import_games(ctx, games):
+    # games in progress carry on with the new code
+    for (client_name, target), game in games.items():
+        game.__class__ = Game
+
+        # turn timers were unscheduled with the old code
+        if game.started and game.period is not None:
+            schedule_turns(ctx, game, client_name, target)
+
+    ctx.storage.games = games
+
+
 @service.model
 class Taboo(Model):
     title = peewee.CharField(255)
@@ -323,11 +341,23 @@ def start_taboo(ctx):
     send_summary(ctx)
     do_draw(ctx)
 
-    game.period = client.bot.scheduler.schedule_every(Game.TURN_DURATION, do_advance, ctx, game)
+    schedule_turns(ctx, game, ctx.client.name, ctx.target)
+
+
+def schedule_turns(ctx, game, client_name, target):
+    game.period = ctx.bot.scheduler.schedule_every(Game.TURN_DURATION,
+                                                   do_advance, client_name,
+                                                   target)
 
 
 @service.task
-def do_advance(ctx, game):
+def do_advance(ctx, client_name, target):
+    if client_name not in ctx.bot.clients:
+        return
+
+    ctx = HookContext(service, ctx.bot, ctx.bot.clients[client_name], target)
+    game = ctx.storage.games[client_name, target]
+
     ctx.message(ctx._("{turn}: Time is up! The word was \"{word}\".").format(
         turn=game.turn,
         word=game.card.title
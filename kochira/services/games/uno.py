@@ -18,6 +18,20 @@ def setup_contexts(ctx):
     ctx.storage.games = {}
 
 
+@service.export_state
+def export_games(ctx):
+    return ctx.storage.games
+
+
+@service.import_state
+def import_games(ctx, games):
+    # games in progress carry on with the new code
+    for game in games.values():
+        game.__class__ = Game
+
+    ctx.storage.games = games
+
+
 class UnoStateError(Exception):
     def __init__(self, code):
         self.code = code
@@ -12,7 +12,7 @@ import subprocess
 
 from kochira import config
 from kochira.auth import requires_permission
-from kochira.service import Service, Config, HookContext
+from kochira.service import Service, Config, HookContext, background
 
 from tornado.web import Application, RequestHandler, asynchronous, HTTPError
 
@@ -72,6 +72,7 @@ def do_update(remote, branch):
 
 @service.command(r"(?:windows )?update(?:s)?!?$", mention=True, allow_private=True)
 @requires_permission("admin")
+@background(pool="subprocess")
 def update(ctx):
     """
     Update.
@@ -125,10 +126,11 @@ class PostReceiveHandler(RequestHandler):
 
         head = rev_parse("HEAD")
 
-        self.application.ctx.bot.executor.submit(do_update,
-                                                 self.application.ctx.config.remote,
-                                                 self.application.ctx.config.branch) \
-            .add_done_callback(_callback)
+        self.application.ctx.bot.executors["subprocess"].submit(
+            do_update,
+            self.application.ctx.config.remote,
+            self.application.ctx.config.branch
+        ).add_done_callback(_callback)
 
 
 def make_application(settings):
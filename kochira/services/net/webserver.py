@@ -5,10 +5,9 @@ This service starts a web server to allow services to run things on a web
 server.
 """
 
-from docutils.core import publish_parts
-
-from kochira import config
+from kochira import config, metrics
 from kochira.service import Service, Config, HookContext
+from kochira.util import lazy_import
 
 import copy
 import os
@@ -16,11 +15,14 @@ import subprocess
 
 from tornado.web import RequestHandler, Application, UIModule, HTTPError
 from tornado.httpserver import HTTPServer, HTTPRequest
+from tornado.netutil import bind_sockets
 
 from urllib.parse import urlparse
 
 service = Service(__name__, __doc__)
 
+docutils_core = lazy_import("docutils.core")
+
 
 @service.config
 class Config(Config):
@@ -81,12 +83,18 @@ class MainHandler(RequestHandler):
 class IndexHandler(RequestHandler):
     def get(self):
         self.render("index.html",
-                    motd=publish_parts(self.application._ctx.config.motd,
+                    motd=docutils_core.publish_parts(self.application._ctx.config.motd,
                                        writer_name="html",
                                        settings_overrides={"initial_header_level": 2})["fragment"],
                     clients=sorted(self.application._ctx.bot.clients.items()))
 
 
+class MetricsHandler(RequestHandler):
+    def get(self):
+        self.set_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.write(metrics.registry.expose())
+
+
 class NotFoundHandler(RequestHandler):
     def get(self):
         self.set_status(404)
@@ -155,6 +163,7 @@ base_path = os.path.join(os.path.dirname(__file__), "webserver")
 def setup_webserver(ctx):
     ctx.storage.application = Application([
         (r"/", IndexHandler),
+        (r"/metrics", MetricsHandler),
         (r"/(\S+)/.*", MainHandler),
         (r".*", NotFoundHandler)
     ],
@@ -175,7 +184,16 @@ def setup_webserver(ctx):
     def _callback():
         ctx.storage.http_server = HTTPServer(ctx.storage.application,
                                              io_loop=ctx.bot.event_loop.io_loop)
-        ctx.storage.http_server.listen(ctx.config.port, ctx.config.address)
+
+        # keep listening on the sockets from before a restart, if any, so
+        # no connections are refused in between
+        sockets = ctx.bot.take_inherited_sockets(service.name)
+
+        if not sockets:
+            sockets = bind_sockets(ctx.config.port, ctx.config.address)
+
+        ctx.storage.http_server.add_sockets(sockets)
+        ctx.bot.handoff_sockets[service.name] = sockets
         service.logger.info("web server ready")
 
 
@@ -184,6 +202,7 @@ def shutdown_webserver(ctx):
     # we have to do this because the service will be unloaded on the next
     # scheduler tick
     storage = ctx.storage
+    ctx.bot.handoff_sockets.pop(service.name, None)
 
     @ctx.bot.event_loop.schedule
     def _callback():
@@ -20,7 +20,18 @@ class Config(Config):
 
 @service.setup
 def initialize(ctx):
-    ctx.storage.granters = {}
+    # other workers may already be sharing this
+    ctx.storage.setdefault("granters", {})
+
+
+@service.export_state
+def export_granters(ctx):
+    return ctx.storage.granters
+
+
+@service.import_state
+def import_granters(ctx, granters):
+    ctx.storage.granters = granters
 
 
 @service.command(r"(?P<who>\S+)\+\+")
@@ -38,16 +49,21 @@ def add_karma(ctx, who):
         ctx.respond(ctx._("You can't give yourself karma."))
         return
 
-    last_grant = ctx.storage.granters.get((ctx.origin, ctx.client.network),
-                                          datetime.fromtimestamp(0))
+    granter = (ctx.origin, ctx.client.network)
 
-    if now - last_grant <= timedelta(seconds=ctx.config.timeout):
+    # check and record the grant in one go, so that the same user can't grant
+    # twice at once, e.g. on networks run by different workers
+    if not ctx.storage.set_item_if_older(
+        "granters", granter, now,
+        now - timedelta(seconds=ctx.config.timeout)):
         ctx.respond(ctx._("Please wait a while before granting someone karma."))
         return
 
     try:
         user_data = yield UserData.lookup(ctx.client, who)
     except UserData.DoesNotExist:
+        # nothing was granted, so they can try again straight away
+        ctx.storage.pop_item("granters", granter)
         ctx.respond(ctx._("{who}'s account is not registered.").format(
             who=who
         ))
@@ -57,8 +73,6 @@ def add_karma(ctx, who):
     user_data["karma"] += 1
     user_data.save()
 
-    ctx.storage.granters[ctx.origin, ctx.client.network] = now
-
     ctx.respond(ctx._("{who} now has {n} karma.").format(
         who=who,
         n=user_data["karma"]
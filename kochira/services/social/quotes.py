@@ -73,6 +73,25 @@ def initialize_model(ctx):
         ctx.storage.index = whoosh.index.open_dir(ctx.config.index_path)
 
     ctx.storage.quote_qp = QueryParser("quote", schema=WHOOSH_SCHEMA)
+    ctx.storage.index_path = ctx.config.index_path
+
+
+@service.export_state
+def export_index(ctx):
+    return ctx.storage
+
+
+@service.import_state
+def import_index(ctx, storage):
+    # keep the index open, unless it's meant to be somewhere else now
+    if storage.index_path != ctx.config.index_path:
+        storage.index.close()
+        initialize_model(ctx)
+        return
+
+    ctx.storage.index = storage.index
+    ctx.storage.quote_qp = storage.quote_qp
+    ctx.storage.index_path = storage.index_path
 
 
 def _add_quote(storage, network, channel, origin, quote):
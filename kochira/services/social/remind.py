@@ -14,6 +14,7 @@ from peewee import TextField, CharField, DateTimeField, IntegerField
 import math
 
 from kochira.db import Model
+from kochira.scheduler import ScheduledJob
 
 from kochira.service import Service
 
@@ -48,20 +49,35 @@ class Reminder(Model):
 
 
 @service.setup
-def reschedule_reminders(ctx):
+def schedule_unscheduled_reminders(ctx):
+    # timed reminders stored before they were scheduled persistently have no
+    # job of their own yet
+    scheduled = set(record.args[0] for record in ScheduledJob.select().where(
+        ScheduledJob.service == service.name,
+        ScheduledJob.task == play_timed_reminder.__name__))
+
     for reminder in Reminder.select() \
         .where(~(Reminder.duration >> None)):
+        if reminder.id in scheduled:
+            continue
+
         dt = (reminder.ts + timedelta(seconds=reminder.duration)) - datetime.utcnow()
 
         if dt < timedelta(0):
             reminder.delete_instance()
             continue
 
-        ctx.bot.scheduler.schedule_after(dt, play_timed_reminder, reminder)
+        ctx.bot.scheduler.schedule_after(dt, play_timed_reminder, reminder.id,
+                                         _persist=True)
 
 
 @service.task
-def play_timed_reminder(ctx, reminder):
+def play_timed_reminder(ctx, reminder_id):
+    try:
+        reminder = Reminder.get(Reminder.id == reminder_id)
+    except Reminder.DoesNotExist:
+        return
+
     needs_archive = False
 
     if reminder.client_name in ctx.bot.clients:
@@ -122,8 +138,9 @@ def add_timed_reminder(ctx, who, duration, message):
         dt=humanize.naturaltime(-dt)
     ))
 
-    # ... but also schedule it
-    ctx.bot.scheduler.schedule_after(dt, play_timed_reminder, reminder)
+    # ... but also schedule it, persistently so that it survives restarts
+    ctx.bot.scheduler.schedule_after(dt, play_timed_reminder, reminder.id,
+                                     _persist=True)
 
 
 @service.command(r"(?:remind|tell) (?P<who>\S+)(?: about| to| that)? (?P<message>.+)$", mention=True)
@@ -5,14 +5,16 @@ Ensures that users are using Freedom English. Could be configured for other
 languages, I guess...
 """
 
-import enchant
 import re
 
-from textblob import TextBlob
-from nltk.corpus import wordnet
-
 from kochira import config
-from kochira.service import Service, background, Config
+from kochira.service import Service, background, in_process, Config
+from kochira.util import lazy_import
+
+# these are only needed by the worker processes
+enchant = lazy_import("enchant")
+textblob = lazy_import("textblob")
+corpus = lazy_import("nltk.corpus")
 
 service = Service(__name__, __doc__)
 
@@ -25,8 +27,8 @@ class Config(Config):
 
 
 def dissimilarity(from_word, to_word):
-    from_syn = set(wordnet.synsets(from_word))
-    to_syn = set(wordnet.synsets(to_word))
+    from_syn = set(corpus.wordnet.synsets(from_word))
+    to_syn = set(corpus.wordnet.synsets(to_word))
 
     both = from_syn & to_syn
 
@@ -43,11 +45,12 @@ def process_words(words):
         yield from str(word).split("-")
 
 
+@in_process
 def compute_replacements(from_lang, to_lang, message):
     from_dic = enchant.Dict(from_lang)
     to_dic = enchant.Dict(to_lang)
 
-    blob = TextBlob(message)
+    blob = textblob.TextBlob(message)
     replacements = {}
 
     for word in process_words(blob.words):
@@ -64,11 +67,12 @@ def compute_replacements(from_lang, to_lang, message):
 
 
 @service.hook("channel_message")
-@background
+@background(pool="cpu")
 def murrika(ctx, target, origin, message):
-    replacements = compute_replacements(ctx.config.from_lang,
+    # the cpu pool only waits here, but it still bounds how much is queued
+    replacements = compute_replacements(ctx, ctx.config.from_lang,
                                         ctx.config.to_lang,
-                                        message)
+                                        message).result()
 
     if not replacements:
         return
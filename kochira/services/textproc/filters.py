@@ -100,7 +100,7 @@ def run_filter(f, ctx, text=None):
         if len(ctx.client.backlogs[ctx.target]) < 2:
             return
 
-        _, text = ctx.client.backlogs[ctx.target][1]
+        text = ctx.client.backlogs[ctx.target][1].message
 
     text = f(text)
 
@@ -37,7 +37,7 @@ def sed(ctx, pattern, replacement, who=None, flags=None):
         ctx.respond(ctx._("Couldn't parse that pattern."))
         return
 
-    for other, message in list(ctx.client.backlogs.get(ctx.target, []))[1:]:
+    for other, message, _, _ in list(ctx.client.backlogs.get(ctx.target, []))[1:]:
         if who is None or other == who:
             match = expr.search(message)
 
@@ -8,9 +8,8 @@ brain.
 import random
 import re
 
-from kochira import config
-from kochira.service import Service, background, Config
-import requests
+from kochira import config, http
+from kochira.service import Service, Config, coroutine
 
 service = Service(__name__, __doc__)
 
@@ -24,23 +23,25 @@ class Config(Config):
     random_replyness = config.Field(doc="Probability the brain will generate a reply for all messages.", default=0.0)
 
 
+@coroutine
 def reply_and_learn(url, username, password, what):
-    r = requests.post(url,
-                      params={"q": what},
-                      headers={"X-Cobed-Auth": username + ":" + password})
+    r = yield http.post(url,
+                        params={"q": what},
+                        headers={"X-Cobed-Auth": username + ":" + password})
     r.raise_for_status()
     return r.text
 
 
+@coroutine
 def learn(url, username, password, what):
-    requests.post(url,
-                  params={"q": what, "n": 1},
-                  headers={"X-Cobed-Auth": username + ":" + password}) \
+    (yield http.post(url,
+                     params={"q": what, "n": 1},
+                     headers={"X-Cobed-Auth": username + ":" + password})) \
         .raise_for_status()
 
 
 @service.hook("channel_message", priority=-9999)
-@background
+@coroutine
 def do_reply(ctx, target, origin, message):
     front, _, rest = message.partition(" ")
 
@@ -63,7 +64,7 @@ def do_reply(ctx, target, origin, message):
         reply = True
 
     if reply and ctx.config.reply:
-        reply_message = reply_and_learn(ctx.config.url,
+        reply_message = yield reply_and_learn(ctx.config.url,
                                         ctx.config.username,
                                         ctx.config.password,
                                         message)
@@ -73,5 +74,5 @@ def do_reply(ctx, target, origin, message):
         else:
             ctx.message(reply_message)
     elif message:
-        learn(ctx.config.url, ctx.config.username, ctx.config.password, message)
+        yield learn(ctx.config.url, ctx.config.username, ctx.config.password, message)
 
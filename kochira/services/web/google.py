@@ -4,10 +4,8 @@ Google web search.
 Run queries on Google and return results.
 """
 
-import requests
-
-from kochira import config
-from kochira.service import Service, background, Config, coroutine
+from kochira import config, http
+from kochira.service import Service, Config, coroutine
 from kochira.userdata import UserData
 
 service = Service(__name__, __doc__)
@@ -21,7 +19,7 @@ class Config(Config):
 
 @service.command(r"!g (?P<term>.+?)$")
 @service.command(r"(?:search for|google) (?P<term>.+?)\??$", mention=True)
-@background
+@coroutine
 def search(ctx, term):
     """
     Google.
@@ -29,14 +27,14 @@ def search(ctx, term):
     Search for the given terms on Google.
     """
 
-    r = requests.get(
+    r = (yield http.get(
         "https://www.googleapis.com/customsearch/v1",
         params={
             "key": ctx.config.api_key,
             "cx": ctx.config.cx,
             "q": term
         }
-    ).json()
+    )).json()
 
     results = r.get("items", [])
 
@@ -55,7 +53,7 @@ def search(ctx, term):
 
 @service.command(r"!image (?P<term>.+?)$")
 @service.command(r"image(?: for)? (?P<term>.+?)\??$", mention=True)
-@background
+@coroutine
 def image(ctx, term):
     """
     Image search.
@@ -63,7 +61,7 @@ def image(ctx, term):
     Search for the given terms on Google.
     """
 
-    r = requests.get(
+    r = (yield http.get(
         "https://www.googleapis.com/customsearch/v1",
         params={
             "key": ctx.config.api_key,
@@ -71,7 +69,7 @@ def image(ctx, term):
             "searchType": "image",
             "q": term
         }
-    ).json()
+    )).json()
 
     results = r.get("items", [])
 
@@ -5,11 +5,14 @@ Look up and reverse look up addresses.
 """
 
 import math
-import requests
 
-from kochira import config
-from kochira.service import Service, background, Config, coroutine
-from kochira.userdata import UserData
+from datetime import datetime, timedelta
+from peewee import TextField, DateTimeField, IntegrityError
+
+from kochira import config, http
+from kochira.db import Model
+from kochira.service import Service, Config, HookContext, coroutine
+from kochira.userdata import UserData, JSONField
 
 service = Service(__name__, __doc__)
 
@@ -17,6 +20,30 @@ service = Service(__name__, __doc__)
 @service.config
 class Config(Config):
     api_key = config.Field(doc="Google API key.")
+    cache_ttl = config.Field(doc="How long to cache geocoding results, in seconds.", default=30 * 24 * 60 * 60)
+
+
+@service.model
+class CachedGeocode(Model):
+    key = TextField(unique=True)
+    results = JSONField()
+    ts = DateTimeField()
+
+
+def _cache_cutoff(ctx):
+    # the geocode provider is called with its caller's context, so find our
+    # own settings for the same network and channel
+    if ctx.service is not service:
+        ctx = HookContext(service, ctx.bot, ctx.client, ctx.target, ctx.origin)
+
+    return datetime.utcnow() - timedelta(seconds=ctx.config.cache_ttl)
+
+
+@service.setup
+def purge_expired_cache(ctx):
+    CachedGeocode.delete() \
+        .where(CachedGeocode.ts < _cache_cutoff(ctx)) \
+        .execute()
 
 
 @service.provides("GeocodingError")
@@ -26,14 +53,15 @@ class GeocodingError(Exception):
     """
 
 
+@coroutine
 def _geocode(where):
-    resp = requests.get(
+    resp = (yield http.get(
         "https://maps.googleapis.com/maps/api/geocode/json",
         params={
             "address": where,
             "sensor": "false"
         }
-    ).json()
+    )).json()
 
     if resp["status"] == "ZERO_RESULTS":
         return []
@@ -44,11 +72,57 @@ def _geocode(where):
     return resp["results"]
 
 
+def _query_cache_key(where):
+    return "q:" + " ".join(where.lower().split())
+
+
+def _coordinates_cache_key(location):
+    # four decimal places is about 11 m at the equator
+    return "ll:{lat:.4f},{lng:.4f}".format(lat=float(location["lat"]),
+                                           lng=float(location["lng"]))
+
+
+@coroutine
+def _cached_geocode(ctx, key, where):
+    try:
+        cached = CachedGeocode.get(CachedGeocode.key == key)
+    except CachedGeocode.DoesNotExist:
+        cached = CachedGeocode(key=key)
+    else:
+        if cached.ts >= _cache_cutoff(ctx):
+            return cached.results
+
+    results = yield _geocode(where)
+
+    # nothing found may only be for now, e.g. for a place that's just been
+    # added, so only cache what was found
+    if not results:
+        return results
+
+    now = datetime.utcnow()
+
+    cached.results = results
+    cached.ts = now
+
+    try:
+        cached.save()
+    except IntegrityError:
+        # another lookup of the same key got there first
+        CachedGeocode.update(results=results, ts=now) \
+            .where(CachedGeocode.key == key) \
+            .execute()
+
+    return results
+
+
 @service.provides("geocode")
 @coroutine
 def geocode(ctx, where):
     """
     Geocode an address.
+
+    Results are cached by normalized query, and stored user locations by
+    their rounded coordinates.
     """
     location = None
 
@@ -58,15 +132,21 @@ def geocode(ctx, where):
     if where is None and location is None:
         return []
     elif location is not None:
-        result = _geocode("{lat},{lng}".format(**location))[0]
+        results = yield _cached_geocode(
+            ctx, _coordinates_cache_key(location),
+            "{lat},{lng}".format(**location))
+
+        if not results:
+            return []
+
+        result = results[0]
         result["formatted_address"] = location["formatted_address"]
         return [result]
     else:
-        return _geocode(where)
+        return (yield _cached_geocode(ctx, _query_cache_key(where), where))
 
 
 @service.command(r"where is (?P<where>.+)\??", mention=True)
-@background
 @coroutine
 def get_location(ctx, where):
     """
@@ -95,7 +175,6 @@ def get_location(ctx, where):
 
 @service.command(r"i live (?:in|at) (?P<where>.+)", mention=True)
 @service.command(r"my location is (?P<where>.+)", mention=True)
-@background
 @coroutine
 def set_location(ctx, where):
     """
@@ -105,7 +184,7 @@ def set_location(ctx, where):
     """
 
     try:
-        user_data = yield ctx.bot.defer_from_thread(UserData.lookup, ctx.client, ctx.origin)
+        user_data = yield UserData.lookup(ctx.client, ctx.origin)
     except UserData.DoesNotExist:
         ctx.respond(ctx._("You need to be logged into NickServ to set your location."))
         return
@@ -128,13 +207,12 @@ def set_location(ctx, where):
 
     user_data["location"] = location
 
-    ctx.bot.defer_from_thread(user_data.save)
+    user_data.save()
     ctx.respond(ctx._("Okay, set your location to {formatted_address} ({lat:.10}, {lng:.10}).").format(**location))
 
 
 @service.command(r"find (?P<what>.+?) (?:near|in) (?:me|(?P<where>.+?))(?: \((?P<num>\d+)\))?", mention=True)
 @service.command(r"find (?P<what>.+?) within (?P<radius>\d+) ?m of (?:me|(?P<where>.+?))(?: \((?P<num>\d+)\))?", mention=True)
-@background
 @coroutine
 def nearby_search(ctx, what, where=None, radius : int=None, num : int=None):
     """
@@ -159,7 +237,7 @@ def nearby_search(ctx, what, where=None, radius : int=None, num : int=None):
 
     location = results[0]["geometry"]["location"]
 
-    resp = requests.get(
+    resp = (yield http.get(
         "https://maps.googleapis.com/maps/api/place/nearbysearch/json",
         params={
             "key": ctx.config.api_key,
@@ -168,7 +246,7 @@ def nearby_search(ctx, what, where=None, radius : int=None, num : int=None):
             "location": "{lat:.10},{lng:.10}".format(**location),
             "keyword": what
         }
-    ).json()
+    )).json()
 
     if resp["status"] == "ZERO_RESULTS":
         ctx.respond(ctx._("Couldn't find anything."))
@@ -212,7 +290,6 @@ EARTH_RADIUS = 6367.5
 
 @service.command(r"distance to (?P<end_loc>.+?) from (?P<start_loc>.+?)", mention=True, priority=1)
 @service.command(r"distance(?: from (?P<start_loc>.+?))? to (?P<end_loc>.+?)", mention=True)
-@background
 @coroutine
 def distance(ctx, end_loc, start_loc=None):
     """
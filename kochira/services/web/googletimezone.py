@@ -4,12 +4,11 @@ Google time zone.
 Get time zone information for places.
 """
 
-import requests
 import time
 from datetime import datetime
 
-from kochira import config
-from kochira.service import Service, background, Config, coroutine
+from kochira import config, http
+from kochira.service import Service, Config, coroutine
 from kochira.userdata import UserData
 
 service = Service(__name__, __doc__)
@@ -18,7 +17,6 @@ service = Service(__name__, __doc__)
 @service.command(r"!time(?: (?P<where>.+))?")
 @service.command(r"time(?: (?:for|in) (?P<where>.+))?", mention=True)
 @service.command(r"when is (?P<where>.+)\??", mention=True)
-@background
 @coroutine
 def timezone(ctx, where=None):
     """
@@ -51,14 +49,14 @@ def timezone(ctx, where=None):
 
     now = time.time()
 
-    resp = requests.get(
+    resp = (yield http.get(
         "https://maps.googleapis.com/maps/api/timezone/json",
         params={
             "sensor": "false",
             "location": "{lat:.10},{lng:.10}".format(**location),
             "timestamp": now
         }
-    ).json()
+    )).json()
 
     if resp["status"] != "OK":
         ctx.respond(ctx._("Received an error code: {status}").format(
@@ -4,25 +4,42 @@ Translation between languages.
 Use Google Translate to perform translations between languages.
 """
 
-import requests
-import pycountry
-
-from kochira.service import Service, background
+from kochira import http
+from kochira.service import Service, coroutine
+from kochira.util import lazy_import
 
 service = Service(__name__, __doc__)
 
-LANGUAGES = {}
+pycountry = lazy_import("pycountry")
 
-for language in pycountry.languages:
-    for name in language.name.split(";"):
-        try:
-            LANGUAGES[name.strip().lower()] = language.alpha2
-        except AttributeError:
-            continue
+_languages = None
+
+
+def get_languages():
+    """
+    Get a mapping of language names to codes, loading pycountry's language
+    database the first time it's needed.
+    """
+    global _languages
+
+    if _languages is None:
+        languages = {}
+
+        for language in pycountry.languages:
+            for name in language.name.split(";"):
+                try:
+                    languages[name.strip().lower()] = language.alpha2
+                except AttributeError:
+                    continue
+
+        _languages = languages
+
+    return _languages
 
 
+@coroutine
 def perform_translation(term, sl, tl):
-    return requests.get(
+    return (yield http.get(
         "http://translate.google.com/translate_a/single",
         params={
             "client": "t",
@@ -35,11 +52,11 @@ def perform_translation(term, sl, tl):
             "oe": "UTF-8"
         },
         headers={"User-Agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_10_2) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/42.0.2311.135 Safari/537.36"}
-    ).json()
+    )).json()
 
 
 @service.command(r"(?:transliterate|romanize) (?P<term>.+?)(?: from (?P<from_lang>.+?))?$", mention=True)
-@background
+@coroutine
 def transliterate(ctx, term, from_lang=None):
     """
     Transliterate.
@@ -52,12 +69,12 @@ def transliterate(ctx, term, from_lang=None):
         sl = None
     else:
         try:
-            sl = LANGUAGES[from_lang.lower()]
+            sl = get_languages()[from_lang.lower()]
         except KeyError:
             ctx.respond(ctx._("Sorry, I don't understand \"{lang}\".").format(lang=from_lang))
             return
 
-    r = perform_translation(term, sl, sl)
+    r = yield perform_translation(term, sl, sl)
 
     tlit = " ".join(x["src_translit"] for x in r["sentences"])
 
@@ -71,7 +88,7 @@ def transliterate(ctx, term, from_lang=None):
 @service.command(r"what is (?P<term>.+) in (?P<to_lang>.+)\??$", mention=True)
 @service.command(r"(?:translate) (?P<term>.+?)(?: from (?P<from_lang>.+?))?(?: to (?P<to_lang>.+))?$", mention=True)
 @service.command(r"!tra(nslate)?(?: (?P<from_lang>.+?)-(?P<to_lang>.+?))? (?P<term>.+)")
-@background
+@coroutine
 def translate(ctx, term, to_lang=None, from_lang=None):
     """
     Translate.
@@ -88,7 +105,7 @@ def translate(ctx, term, to_lang=None, from_lang=None):
             if len(from_lang) == 2:
                 sl = from_lang
             else:
-                sl = LANGUAGES[from_lang.lower()]
+                sl = get_languages()[from_lang.lower()]
         except KeyError:
             ctx.respond(ctx._("Sorry, I don't understand from language: \"{lang}\".").format(lang=from_lang))
             return
@@ -100,12 +117,12 @@ def translate(ctx, term, to_lang=None, from_lang=None):
             if len(to_lang) == 2:
                 tl = to_lang
             else:
-                tl = LANGUAGES[to_lang.lower()]
+                tl = get_languages()[to_lang.lower()]
         except KeyError:
             ctx.respond(ctx._("Sorry, I don't understand to language: \"{lang}\".").format(lang=to_lang))
             return
 
-    r = perform_translation(term, sl, tl)
+    r = yield perform_translation(term, sl, tl)
 
     trans = " ".join(x["trans"] for x in r["sentences"])
 
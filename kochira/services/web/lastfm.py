@@ -5,23 +5,88 @@ Allow users to display their now playing status and compare music tastes using
 Last.fm.
 """
 
-import requests
-import gzip
+import io
 import humanize
+import time
 from datetime import datetime
-from lxml import etree
 
-from kochira import config
+from pydle.async import parallel
+
+from kochira import config, http
 from kochira.userdata import UserData
-from kochira.service import Service, background, Config, coroutine
+from kochira.service import Service, Config, coroutine
+from kochira.util import lazy_import
 
 service = Service(__name__, __doc__)
 
+etree = lazy_import("lxml.etree")
+
 @service.config
 class Config(Config):
     api_key = config.Field(doc="Last.fm API key.")
+    tags_cache_ttl = config.Field(doc="How long to cache track tags, in seconds.", default=24 * 60 * 60)
+    info_cache_ttl = config.Field(doc="How long to cache per-user track info, in seconds.", default=5 * 60)
+    max_cache_size = config.Field(doc="Maximum number of entries in each cache.", default=1000)
+
+
+@service.setup
+def initialize_storage(ctx):
+    ctx.storage.track_tags = {}
+    ctx.storage.track_info = {}
+
+
+def _cache_get(cache, key):
+    entry = cache.get(key)
+
+    if entry is None:
+        return None
+
+    expires, value = entry
+
+    if expires <= time.time():
+        del cache[key]
+        return None
 
+    return value
+
+
+def _cache_put(cache, key, value, ttl, max_size):
+    now = time.time()
+
+    if len(cache) >= max_size:
+        for k in [k for k, (expires, _) in cache.items() if expires <= now]:
+            del cache[k]
+
+        if len(cache) >= max_size:
+            cache.clear()
+
+    cache[key] = (now + ttl, value)
+
+
+def iterparse_lfm(content, tags):
+    """
+    Incrementally parse a Last.fm response, yielding only elements whose tag
+    is in ``tags`` instead of building the whole tree. Nothing is yielded if
+    the response status is not ok.
+    """
 
+    for event, el in etree.iterparse(io.BytesIO(content),
+                                     events=("start", "end")):
+        if event == "start":
+            if el.getparent() is None and el.get("status") != "ok":
+                return
+            continue
+
+        if el.tag in tags:
+            yield el
+
+            # free everything we've already seen
+            el.clear()
+            while el.getprevious() is not None:
+                del el.getparent()[0]
+
+
+@coroutine
 def query_lastfm(api_key, method, arguments):
     params = arguments.copy()
     params.update({
@@ -29,17 +94,13 @@ def query_lastfm(api_key, method, arguments):
         "api_key": api_key
     })
 
-    r = requests.get(
-        "http://ws.audioscrobbler.com/2.0/",
-        params=params,
-        stream=True
-    )
-
-    return etree.parse(gzip.GzipFile(fileobj=r.raw))
+    r = yield http.get("http://ws.audioscrobbler.com/2.0/", params=params)
+    return r.content
 
 
+@coroutine
 def get_compare_users(api_key, user1, user2):
-    res = query_lastfm(
+    res = yield query_lastfm(
         api_key,
         "tasteometer.compare",
         {
@@ -50,63 +111,55 @@ def get_compare_users(api_key, user1, user2):
         }
     )
 
-    comparison = res.xpath("/lfm[@status='ok']/comparison/result")
-
-    if comparison:
-        comparison, = comparison
+    score = None
+    artists = []
 
-        score, = comparison.xpath("score/text()")
-        artists = comparison.xpath("artists/artist/name/text()")
-
-        return {
-            "user1": user1,
-            "user2": user2,
-            "score": float(score),
-            "artists": artists
-        }
-
-    return None
-
-
-def get_user_now_playing(api_key, user):
-    res = query_lastfm(
-        api_key,
-        "user.getRecentTracks",
-        {
-            "user": user,
-            "limit": 1
-        }
-    )
-
-    track = res.xpath("/lfm[@status='ok']/recenttracks/track[@nowplaying='true']")
-
-    now_playing = True
+    for el in iterparse_lfm(res, ("score", "artist")):
+        if el.tag == "score":
+            score = el.text
+        else:
+            artists.append(el.findtext("name"))
 
-    if not track:
-        track = res.xpath("/lfm[@status='ok']/recenttracks/track")
-        now_playing = False
+    if score is None:
+        return None
 
-    if track:
-        track = track[0]
+    return {
+        "user1": user1,
+        "user2": user2,
+        "score": float(score),
+        "artists": artists
+    }
 
-        artist, = track.xpath("artist/text()")
-        name, = track.xpath("name/text()")
-        album, = track.xpath("album/text()") or [None]
-        ts, = track.xpath("date/@uts") or [None]
 
-        ts = int(ts) if ts is not None else None
+@coroutine
+def get_track_tags(api_key, storage, config, artist, name):
+    key = (artist, name)
+    tags = _cache_get(storage.track_tags, key)
 
-        # get track info
-        track_tags_r = query_lastfm(
+    if tags is None:
+        res = yield query_lastfm(
             api_key,
             "track.getTopTags", {
                 "artist": artist,
                 "track": name
             }
         )
-        tags = track_tags_r.xpath("/lfm[@status='ok']/toptags/tag/name/text()")
 
-        track_info_r = query_lastfm(
+        tags = [el.findtext("name") for el in iterparse_lfm(res, ("tag",))]
+        _cache_put(storage.track_tags, key, tags, config.tags_cache_ttl,
+                   config.max_cache_size)
+
+    return tags
+
+
+@coroutine
+def get_track_info(api_key, storage, config, user, artist, name):
+    # play counts are per-user, so this has to be keyed on the user too
+    key = (user, artist, name)
+    info = _cache_get(storage.track_info, key)
+
+    if info is None:
+        res = yield query_lastfm(
             api_key,
             "track.getInfo", {
                 "username": user,
@@ -114,33 +167,70 @@ def get_user_now_playing(api_key, user):
                 "track": name
             }
         )
-        info = track_info_r.xpath("/lfm[@status='ok']/track")
 
-        if info:
-            info, = info
+        info = {
+            "user_playcount": 0,
+            "user_loved": 0
+        }
 
-            user_playcount, = info.xpath("userplaycount/text()") or [0]
-            user_playcount = int(user_playcount)
+        for el in iterparse_lfm(res, ("userplaycount", "userloved")):
+            if el.tag == "userplaycount":
+                info["user_playcount"] = int(el.text or 0)
+            else:
+                info["user_loved"] = int(el.text or 0)
+
+        _cache_put(storage.track_info, key, info, config.info_cache_ttl,
+                   config.max_cache_size)
+
+    return info
 
-            user_loved, = info.xpath("userloved/text()") or [0]
-            user_loved = int(user_loved)
-        else:
-            user_playcount = 0
-            user_loved = 0
 
-        return {
+@coroutine
+def get_user_now_playing(api_key, storage, config, user):
+    res = yield query_lastfm(
+        api_key,
+        "user.getRecentTracks",
+        {
             "user": user,
-            "artist": artist,
-            "name": name,
-            "album": album,
-            "tags": tags,
-            "ts": ts,
-            "user_playcount": user_playcount,
-            "user_loved": user_loved,
-            "now_playing": now_playing
+            "limit": 1
         }
+    )
+
+    track = None
+
+    for el in iterparse_lfm(res, ("track",)):
+        if el.get("nowplaying") == "true" or track is None:
+            date = el.find("date")
+
+            track = {
+                "artist": el.findtext("artist"),
+                "name": el.findtext("name"),
+                "album": el.findtext("album") or None,
+                "ts": date.get("uts") if date is not None else None,
+                "now_playing": el.get("nowplaying") == "true"
+            }
+
+        if track["now_playing"]:
+            break
+
+    if track is None:
+        return None
+
+    track["user"] = user
+    track["ts"] = int(track["ts"]) if track["ts"] is not None else None
+
+    # the tags and info lookups are independent, so run them at the same time
+    tags, info = yield parallel(
+        get_track_tags(api_key, storage, config, track["artist"],
+                       track["name"]),
+        get_track_info(api_key, storage, config, user, track["artist"],
+                       track["name"])
+    )
+
+    track["tags"] = tags
+    track.update(info)
 
-    return None
+    return track
 
 
 @coroutine
@@ -198,7 +288,6 @@ def check_user(ctx):
 @service.command(r"!tasteometer (?P<user2>\S+)$")
 @service.command(r"compare my last\.fm with (?P<user2>\S+)$", mention=True)
 @service.command(r"compare (?P<user1>\S+) and (?P<user2>\S+) on last\.fms$", mention=True)
-@background
 @coroutine
 def compare_users(ctx, user2, user1=None):
     """
@@ -209,10 +298,10 @@ def compare_users(ctx, user2, user1=None):
     if user1 is None:
         user1 = ctx.origin
 
-    lfm1 = yield ctx.bot.defer_from_thread(get_lfm_username, ctx.client, user1)
-    lfm2 = yield ctx.bot.defer_from_thread(get_lfm_username, ctx.client, user2)
+    lfm1, lfm2 = yield parallel(get_lfm_username(ctx.client, user1),
+                                get_lfm_username(ctx.client, user2))
 
-    comparison = get_compare_users(ctx.config.api_key, lfm1, lfm2)
+    comparison = yield get_compare_users(ctx.config.api_key, lfm1, lfm2)
 
     if comparison is None:
         ctx.respond(ctx._("Couldn't compare."))
@@ -232,7 +321,6 @@ def compare_users(ctx, user2, user1=None):
 @service.command(r"!np (?P<who>\S+)$")
 @service.command(r"what am i playing\??$", mention=True)
 @service.command(r"what is (?P<who>\S+) playing\??$", mention=True)
-@background
 @coroutine
 def now_playing(ctx, who=None):
     """
@@ -244,7 +332,8 @@ def now_playing(ctx, who=None):
         who = ctx.origin
 
     lfm = yield get_lfm_username(ctx.client, who)
-    track = get_user_now_playing(ctx.config.api_key, lfm)
+    track = yield get_user_now_playing(ctx.config.api_key, ctx.storage,
+                                       ctx.config, lfm)
 
     if track is None:
         ctx.respond(ctx._("{who} ({lfm}) has never scrobbled anything.").format(
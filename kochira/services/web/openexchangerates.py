@@ -4,13 +4,16 @@ Open Exchange Rates currency conversion.
 Convert between currencies using Open Exchange Rates.
 """
 
-import requests
 import ccy
-import time
+import difflib
 
-from kochira import config
-from kochira.service import Service, background, Config, coroutine
-from kochira.userdata import UserData
+from datetime import datetime, timedelta
+from peewee import CharField, DateTimeField
+
+from kochira import config, http
+from kochira.db import Model
+from kochira.service import Service, Config, coroutine
+from kochira.userdata import UserData, JSONField
 
 service = Service(__name__, __doc__)
 
@@ -18,47 +21,179 @@ service = Service(__name__, __doc__)
 @service.config
 class Config(Config):
     app_id = config.Field(doc="Open Exchange Rates App ID.")
+    update_interval = config.Field(doc="How often to refresh exchange rates, in seconds.", default=60 * 60)
+    retry_interval = config.Field(doc="How long to wait before retrying a failed refresh, in seconds.", default=5 * 60)
+    refresh_margin = config.Field(doc="How long before exchange rates get older than the update interval to refresh them, in seconds.", default=60)
+
+
+@service.model
+class CurrencyData(Model):
+    key = CharField(255, unique=True)
+    value = JSONField()
+    ts = DateTimeField()
+
+
+def _normalize_name(name):
+    return " ".join(name.lower().split())
+
+
+def _build_name_index(names):
+    index = {}
+    words = {}
+
+    for code, name in names.items():
+        name = _normalize_name(name)
+        index[name] = code
+
+        for word in name.split():
+            words.setdefault(word, set([])).add(code)
+
+    # single words are only useful if they're unambiguous, e.g. "yen" but not
+    # "dollar"
+    for word, codes in words.items():
+        if len(codes) == 1 and word not in index:
+            index[word], = codes
+
+    return index
+
+
+def _set_names(storage, names):
+    names = dict(names)
+
+    if "BTC" in names:
+        names["XBT"] = names["BTC"]
+
+    storage.names = names
+    storage.name_index = _build_name_index(names)
+
+
+def _set_rates(storage, rates, ts):
+    rates = dict(rates)
+
+    if "BTC" in rates:
+        rates["XBT"] = rates["BTC"]
+
+    storage.rates = rates
+    storage.last_update = ts
+
+
+def _persist(key, value, ts):
+    try:
+        data = CurrencyData.get(CurrencyData.key == key)
+    except CurrencyData.DoesNotExist:
+        data = CurrencyData(key=key)
+
+    data.value = value
+    data.ts = ts
+    data.save()
 
 
 @service.setup
 def initialize_storage(ctx):
-    ctx.storage.last_update = 0
+    ctx.storage.last_update = None
+    ctx.storage.rates = None
     ctx.storage.names = None
+    ctx.storage.name_index = {}
+    ctx.storage.next_update = None
+
+    # load whatever we had before restarting, even if it's stale
+    for data in CurrencyData.select():
+        if data.key == "names":
+            _set_names(ctx.storage, data.value)
+        elif data.key == "rates":
+            _set_rates(ctx.storage, data.value, data.ts)
+
+    _schedule_update(ctx, _until_stale(ctx))
 
 
-def _update_currencies(app_id, storage):
-    now = time.time()
+def _until_stale(ctx):
+    if ctx.storage.last_update is None:
+        return timedelta(0)
+
+    refresh_after = timedelta(seconds=ctx.config.update_interval -
+                                      ctx.config.refresh_margin)
+
+    return max(timedelta(0),
+               ctx.storage.last_update + refresh_after - datetime.utcnow())
+
+
+def _schedule_update(ctx, delay):
+    # only ever one refresh pending, whether it's a retry or not
+    if ctx.storage.next_update is not None:
+        ctx.storage.next_update.cancel()
+
+    ctx.storage.next_update = ctx.bot.scheduler.schedule_after(
+        delay, update_currencies)
+
+
+@coroutine
+def _fetch_currencies(app_id, storage):
+    now = datetime.utcnow()
 
     if storage.names is None:
-        req = requests.get("http://openexchangerates.org/api/currencies.json")
+        req = yield http.get("http://openexchangerates.org/api/currencies.json")
         req.raise_for_status()
 
-        storage.names = req.json()
+        names = req.json()
+        _persist("names", names, now)
+        _set_names(storage, names)
 
-        if "BTC" in storage.names:
-            storage.names["XBT"] = storage.names["BTC"]
+    req = yield http.get(
+        "https://openexchangerates.org/api/latest.json",
+        params={
+            "app_id": app_id,
+            "base": "USD"
+        }
+    )
+    req.raise_for_status()
 
-    if storage.last_update + 60 * 60 <= now:
-        req = requests.get(
-            "https://openexchangerates.org/api/latest.json",
-            params={
-                "app_id": app_id,
-                "base": "USD"
-            }
-        )
-        req.raise_for_status()
+    rates = req.json()["rates"]
+    _persist("rates", rates, now)
+    _set_rates(storage, rates, now)
+
+
+@service.task
+@coroutine
+def update_currencies(ctx):
+    """
+    Refresh exchange rates in the background, so conversions never have to
+    wait on the network. The next refresh is scheduled for just before the
+    rates get older than the update interval. If refreshing fails, the old
+    rates keep being served and the refresh is retried.
+    """
+
+    try:
+        yield _fetch_currencies(ctx.config.app_id, ctx.storage)
+    except Exception:
+        service.logger.exception("Could not refresh exchange rates; serving rates from %s",
+                                 ctx.storage.last_update)
+        _schedule_update(ctx, timedelta(seconds=ctx.config.retry_interval))
+    else:
+        service.logger.info("Refreshed exchange rates")
+        _schedule_update(ctx, _until_stale(ctx))
+
+
+def _resolve_currency(storage, currency):
+    code = currency.upper()
 
-        storage.rates = req.json()["rates"]
-        storage.last_update = now
+    if code in storage.rates:
+        return code
 
-        if "BTC" in storage.rates:
-            storage.rates["XBT"] = storage.rates["BTC"]
+    name = _normalize_name(currency)
+
+    if name not in storage.name_index:
+        matches = difflib.get_close_matches(name, storage.name_index.keys(),
+                                            n=1, cutoff=0.8)
+        if not matches:
+            return code
+        name, = matches
+
+    return storage.name_index[name]
 
 
 @service.command(r"price of (?P<from_currency>\S+)(?: in (?P<to_currency>\S+))?", mention=True)
 @service.command(r"!convert (?P<amount>\d+(?:\.\d*)?)?(?: ?(?P<from_currency>\S+))?(?: (?P<to_currency>\S+))?")
 @service.command(r"convert (?P<amount>\d+(?:\.\d*)?)?(?: ?(?P<from_currency>\S+))?(?: to (?P<to_currency>\S+))?", mention=True)
-@background
 @coroutine
 def convert(ctx, amount: float=1, from_currency=None, to_currency=None):
     """
@@ -66,7 +201,9 @@ def convert(ctx, amount: float=1, from_currency=None, to_currency=None):
 
     Convert between currencies. Defaults to geolocated currencies.
     """
-    _update_currencies(ctx.config.app_id, ctx.storage)
+    if ctx.storage.rates is None:
+        ctx.respond(ctx._("I don't have any exchange rates yet. Try again in a bit."))
+        return
 
     if amount is None:
         amount = 1
@@ -82,13 +219,19 @@ def convert(ctx, amount: float=1, from_currency=None, to_currency=None):
             ctx.respond(ctx._("Sorry, I don't have a geocode provider loaded, and you haven't specified both currencies."))
             return
 
-        user_data = yield ctx.bot.defer_from_thread(UserData.lookup_default, ctx.client, ctx.origin)
+        user_data = yield UserData.lookup_default(ctx.client, ctx.origin)
 
         if "location" not in user_data:
             ctx.respond(ctx._("You don't have location data set, so I can't guess what currency you want."))
             return
 
-        result = (yield geocode(ctx.origin))[0]
+        results = yield geocode(ctx.origin)
+
+        if not results:
+            ctx.respond(ctx._("I don't know where your location is, so I can't guess what currency you want."))
+            return
+
+        result = results[0]
 
         currency = ccy.countryccy(
             [component["short_name"] for component in result["address_components"]
@@ -105,8 +248,8 @@ def convert(ctx, amount: float=1, from_currency=None, to_currency=None):
         if to_currency is None:
             to_currency = currency
 
-    from_currency = from_currency.upper()
-    to_currency = to_currency.upper()
+    from_currency = _resolve_currency(ctx.storage, from_currency)
+    to_currency = _resolve_currency(ctx.storage, to_currency)
 
     for currency in [from_currency, to_currency]:
         if currency not in ctx.storage.rates:
@@ -67,7 +67,7 @@ def make_snapchat(ctx):
 
 
 @service.task
-@background
+@background(pool="subprocess")
 def poll_for_updates(ctx):
     has_snaps = False
 
@@ -4,15 +4,14 @@ UrbanDictionary lookup.
 Retrieves definitions of terms from UrbanDictionary.
 """
 
-import requests
-
-from kochira.service import Service, background
+from kochira import http
+from kochira.service import Service, coroutine
 
 service = Service(__name__, __doc__)
 
 
 @service.command(r"!ud (?P<term>.+?)(?: (?P<num>\d+))?$")
-@background
+@coroutine
 def define(ctx, term, num: int=None):
     """
     Define.
@@ -20,9 +19,9 @@ def define(ctx, term, num: int=None):
     Look up the given term on UrbanDictionary.
     """
 
-    r = requests.get("https://api.urbandictionary.com/v0/define", params={
+    r = (yield http.get("https://api.urbandictionary.com/v0/define", params={
         "term": term
-    }).json()
+    })).json()
 
     exact_matches = [
         result for result in r["list"]
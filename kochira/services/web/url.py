@@ -5,17 +5,21 @@ Fetches and displays metadata for web pages, images and more.
 """
 
 import humanize
+import io
 import re
 import requests
 import requests.packages.urllib3 as urllib3
 import tempfile
 from datetime import timedelta
-from bs4 import BeautifulSoup
-from pymediainfo import MediaInfo
-from PIL import Image
 
 from kochira import config
-from kochira.service import Service, background, Config
+from kochira.service import Service, background, in_process, Config
+from kochira.util import lazy_import
+
+# these are only needed by the worker processes
+bs4 = lazy_import("bs4")
+pymediainfo = lazy_import("pymediainfo")
+Image = lazy_import("PIL.Image")
 
 service = Service(__name__, __doc__)
 urllib3.disable_warnings()
@@ -30,8 +34,9 @@ HEADERS = {
     'user-agent': 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10.8; rv:23.0) Gecko/20130426 Firefox/23.0'
 }
 
+@in_process
 def handle_html(content):
-    soup = BeautifulSoup(content)
+    soup = bs4.BeautifulSoup(content)
 
     title = None
 
@@ -46,22 +51,115 @@ def handle_html(content):
     )
 
 
-def get_num_image_frames(im):
+def _skip_gif_sub_blocks(content, i):
+    while True:
+        size = content[i]
+        i += 1
+
+        if size == 0:
+            return i
+
+        i += size
+
+
+def scan_gif_frames(content):
+    """
+    Count the frames of a GIF and sum their delays by walking the block
+    structure, without decoding any image data.
+
+    Returns a tuple of ``(frames, duration)``, where duration is in
+    milliseconds.
+    """
+
+    if content[:6] not in (b"GIF87a", b"GIF89a"):
+        return 0, 0
+
+    nframes = 0
+    duration = 0
+
+    try:
+        flags = content[10]
+        i = 13
+
+        # skip the global color table
+        if flags & 0x80:
+            i += 3 << ((flags & 0x07) + 1)
+
+        while True:
+            block = content[i]
+
+            if block == 0x3b:
+                # trailer
+                break
+            elif block == 0x21:
+                label = content[i + 1]
+
+                if label == 0xf9:
+                    # graphic control extension: delay in hundredths of a
+                    # second
+                    duration += int.from_bytes(content[i + 4:i + 6],
+                                               "little") * 10
+
+                i = _skip_gif_sub_blocks(content, i + 2)
+            elif block == 0x2c:
+                nframes += 1
+                flags = content[i + 9]
+                i += 10
+
+                # skip the local color table
+                if flags & 0x80:
+                    i += 3 << ((flags & 0x07) + 1)
+
+                # skip the LZW minimum code size, then the image data
+                i = _skip_gif_sub_blocks(content, i + 1)
+            else:
+                break
+    except IndexError:
+        # truncated file, so report what we've seen so far
+        pass
+
+    return nframes, duration
+
+
+def seek_frames(im):
+    """
+    Count the frames of an animated image and sum their delays by seeking
+    through and decoding them with PIL, for formats other than GIF, e.g.
+    animated PNG and WebP.
+
+    Returns a tuple of ``(frames, duration)``, where duration is in
+    milliseconds.
+    """
+
+    nframes = 0
+    duration = 0
+
     try:
         while True:
-             im.seek(im.tell() + 1)
+            im.seek(nframes)
+            nframes += 1
+
+            # some formats, e.g. WebP, only set the delay once decoded
+            im.load()
+            duration += im.info.get("duration", 0)
     except EOFError:
         pass
 
-    return im.tell()
+    return nframes, duration
 
 
+@in_process
 def handle_image(content):
-    with tempfile.NamedTemporaryFile() as f:
-        f.write(content)
-        im = Image.open(f.name)
+    # PIL only parses the header on open, so this doesn't decode anything
+    # unless it's an animation in a format other than GIF
+    im = Image.open(io.BytesIO(content))
 
-    nframes = get_num_image_frames(im)
+    if im.format == "GIF":
+        nframes, duration = scan_gif_frames(content)
+    elif getattr(im, "is_animated", False):
+        nframes, duration = seek_frames(im)
+    else:
+        nframes, duration = 1, 0
 
     info = "\x02Image Info:\x02 {w} x {h}; {size}".format(
         size=humanize.naturalsize(len(content)),
@@ -72,16 +170,17 @@ def handle_image(content):
     if nframes > 1:
         info += "; animated {t}, {n} frames".format(
             n=nframes,
-            t=timedelta(seconds=nframes * im.info["duration"] // 1000)
+            t=timedelta(seconds=duration // 1000)
         )
 
     return info
 
 
+@in_process
 def handle_media(content):
     with tempfile.NamedTemporaryFile() as f:
         f.write(content)
-        media = MediaInfo.parse(f.name)
+        media = pymediainfo.MediaInfo.parse(f.name)
 
     duration = timedelta(seconds=media.tracks[0].duration // 1000)
     num_tracks = len(media.tracks) - 1
@@ -157,7 +256,8 @@ def detect_urls(ctx, origin, target, message):
                             info = "\x02Content Type:\x02 " + content_type
                             continue
 
-                    info = HANDLERS[content_type](content)
+                    # parsing is CPU-bound, so do it in a worker process
+                    info = HANDLERS[content_type](ctx, content).result()
                 else:
                     info = "\x02Content Type:\x02 " + content_type
             found_info[url] = info
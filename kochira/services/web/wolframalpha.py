@@ -5,15 +5,16 @@ Runs queries on Wolfram|Alpha.
 """
 
 import re
-import requests
-from lxml import etree
 
-from kochira import config
-from kochira.service import Service, background, Config, coroutine
+from kochira import config, http
+from kochira.service import Service, Config, coroutine
 from kochira.userdata import UserData
+from kochira.util import lazy_import
 
 service = Service(__name__, __doc__)
 
+etree = lazy_import("lxml.etree")
+
 @service.config
 class Config(Config):
     appid = config.Field(doc="Wolfram|Alpha application ID.")
@@ -21,7 +22,6 @@ class Config(Config):
 
 @service.command(r"!wa (?P<query>.+)$")
 @service.command(r"(?:compute|calculate|mathify) (?:for (?P<who>\S+))?(?P<query>.+)$", mention=True)
-@background
 @coroutine
 def compute(ctx, query, who=None):
     """
@@ -31,14 +31,14 @@ def compute(ctx, query, who=None):
     """
 
     if who is not None:
-        user_data = yield ctx.bot.defer_from_thread(UserData.lookup_default, ctx.client, who)
+        user_data = yield UserData.lookup_default(ctx.client, who)
 
         if "location" not in user_data:
             ctx.respond(ctx._("I don't have location information for {who}.").format(who=who))
             return
     else:
         try:
-            user_data = yield ctx.bot.defer_from_thread(UserData.lookup, ctx.client, ctx.origin)
+            user_data = yield UserData.lookup(ctx.client, ctx.origin)
         except UserData.DoesNotExist:
             user_data = {}
 
@@ -53,12 +53,11 @@ def compute(ctx, query, who=None):
     if location is not None:
         params["latlong"] = "{lat},{lng}".format(**location)
 
-    resp = requests.get("http://api.wolframalpha.com/v2/query",
-        params=params,
-        stream=True
+    resp = yield http.get("http://api.wolframalpha.com/v2/query",
+        params=params
     )
 
-    tree = etree.parse(resp.raw)
+    tree = etree.fromstring(resp.content).getroottree()
     result_node = tree.xpath("/queryresult[@success='true']")
 
     if not result_node:
@@ -4,10 +4,8 @@ Weather Underground forecast.
 Get weather data from Weather Underground.
 """
 
-import requests
-
-from kochira import config
-from kochira.service import Service, background, Config, coroutine
+from kochira import config, http
+from kochira.service import Service, Config, coroutine
 from kochira.userdata import UserData
 
 service = Service(__name__, __doc__)
@@ -20,7 +18,6 @@ class Config(Config):
 
 @service.command(r"!weather(?: (?P<where>.+))?")
 @service.command(r"weather(?: (?:for|in) (?P<where>.+))?", mention=True)
-@background
 @coroutine
 def weather(ctx, where=None):
     """
@@ -48,10 +45,10 @@ def weather(ctx, where=None):
 
     location = results[0]["geometry"]["location"]
 
-    r = requests.get("http://api.wunderground.com/api/{api_key}/conditions/q/{lat},{lng}.json".format(
+    r = (yield http.get("http://api.wunderground.com/api/{api_key}/conditions/q/{lat},{lng}.json".format(
         api_key=ctx.config.api_key,
         **location
-    )).json()
+    ))).json()
 
     if "error" in r:
         ctx.respond(ctx._("Sorry, there was an error: {type}: {description}").format(
@@ -101,7 +98,6 @@ def weather(ctx, where=None):
 
 @service.command(r"!forecast(?: (?P<where>.+?))?(?: (?P<num>\d+))?")
 @service.command(r"forecast(?: (?:for|in) (?P<where>.+?))?(?: \((?P<num>\d+)\))?\??", mention=True)
-@background
 @coroutine
 def forecast(ctx, where=None, num: int=0):
     """
@@ -129,10 +125,10 @@ def forecast(ctx, where=None, num: int=0):
 
     location = results[0]["geometry"]["location"]
 
-    r = requests.get("http://api.wunderground.com/api/{api_key}/forecast/q/{lat},{lng}.json".format(
+    r = (yield http.get("http://api.wunderground.com/api/{api_key}/forecast/q/{lat},{lng}.json".format(
         api_key=ctx.config.api_key,
         **location
-    )).json()
+    ))).json()
 
     if "error" in r:
         ctx.respond(ctx._("Sorry, there was an error: {type}: {description}").format(
@@ -4,10 +4,8 @@ YouTube search.
 Run queries on YouTube and return results.
 """
 
-import requests
-
-from kochira import config
-from kochira.service import Service, background, Config, coroutine
+from kochira import config, http
+from kochira.service import Service, Config, coroutine
 from kochira.userdata import UserData
 
 service = Service(__name__, __doc__)
@@ -20,7 +18,7 @@ class Config(Config):
 
 @service.command(r"!yt (?P<term>.+?)(?: (?P<num>\d+))?$")
 @service.command(r"youtube search(?: for)? (?P<term>.+?)(?: \((?P<num>\d+)\))?\??$", mention=True)
-@background
+@coroutine
 def search(ctx, term, num: int=None):
     """
     YouTube search.
@@ -29,7 +27,7 @@ def search(ctx, term, num: int=None):
     that result.
     """
 
-    r = requests.get(
+    r = (yield http.get(
         "https://www.googleapis.com/youtube/v3/search",
         params={
             "key": ctx.config.api_key,
@@ -37,7 +35,7 @@ def search(ctx, term, num: int=None):
             "type": "video",
             "q": term
         }
-    ).json()
+    )).json()
 
     results = r.get("items", [])
 
@@ -55,14 +53,14 @@ def search(ctx, term, num: int=None):
         ctx.respond("Couldn't find anything matching \"{term}\".".format(term=term))
         return
 
-    r = requests.get(
+    r = (yield http.get(
         "https://www.googleapis.com/youtube/v3/videos",
         params={
             "key": ctx.config.api_key,
             "part": "statistics",
             "id": results[num]["id"]["videoId"]
         }
-    ).json()
+    )).json()
 
     statistics, = r["items"]
     statistics = statistics["statistics"]
@@ -78,6 +76,7 @@ def search(ctx, term, num: int=None):
     ))
 
 @service.command(r".*(?:youtube\.com/watch.*v=|youtu\.be/)(?P<video_id>[a-zA-Z0-9_-]+).*", priority=1)
+@coroutine
 def lookup(ctx, video_id):
     """
     YouTube video lookup.
@@ -85,7 +84,7 @@ def lookup(ctx, video_id):
     Look up stats for pasted YouTube video URLs.
     """
 
-    r = requests.get(
+    r = (yield http.get(
         "https://www.googleapis.com/youtube/v3/videos",
         params={
             "key": ctx.config.api_key,
@@ -93,7 +92,7 @@ def lookup(ctx, video_id):
             "fields": "items",
             "id": video_id
         }
-    ).json()
+    )).json()
 
     if not r["items"]:
         return
@@ -0,0 +1,231 @@
+import threading
+
+from .util import Expando
+
+
+class AtomicMapping:
+    """
+    A mapping whose compound operations, like incrementing a value or setting
+    an item of a value, happen atomically.
+
+    Backs both local service storage and the store the supervisor shares
+    between workers.
+    """
+
+    OPERATIONS = ["get", "lookup", "set", "pop", "delete", "incr",
+                  "setdefault", "compare_and_set", "get_item", "set_item",
+                  "set_item_if_older", "pop_item"]
+
+    def __init__(self, data=None):
+        self.data = data if data is not None else {}
+        self.lock = threading.RLock()
+
+    def get(self, key, default=None):
+        with self.lock:
+            return self.data.get(key, default)
+
+    def lookup(self, key):
+        """
+        Get a value, as ``(found, value)``.
+        """
+        with self.lock:
+            if key not in self.data:
+                return False, None
+
+            return True, self.data[key]
+
+    def set(self, key, value):
+        with self.lock:
+            self.data[key] = value
+
+    def pop(self, key, default=None):
+        with self.lock:
+            return self.data.pop(key, default)
+
+    def delete(self, key):
+        """
+        Delete a value, returning whether there was one.
+        """
+        with self.lock:
+            if key not in self.data:
+                return False
+
+            del self.data[key]
+            return True
+
+    def incr(self, key, amount=1):
+        """
+        Add to a number, starting from 0, and return the new value.
+        """
+        with self.lock:
+            value = self.data.get(key, 0) + amount
+            self.data[key] = value
+            return value
+
+    def setdefault(self, key, default):
+        with self.lock:
+            return self.data.setdefault(key, default)
+
+    def compare_and_set(self, key, expected, value):
+        """
+        Set a value only if it's currently the expected one, returning whether
+        it was set.
+        """
+        with self.lock:
+            if self.data.get(key) != expected:
+                return False
+
+            self.data[key] = value
+            return True
+
+    def get_item(self, key, item, default=None):
+        with self.lock:
+            return self.data.get(key, {}).get(item, default)
+
+    def set_item(self, key, item, value):
+        with self.lock:
+            self.data.setdefault(key, {})[item] = value
+
+    def set_item_if_older(self, key, item, value, cutoff):
+        """
+        Set an item only if it isn't set, or is set to something less than
+        the cutoff, e.g. a time that long ago, returning whether it was set.
+        """
+        with self.lock:
+            items = self.data.setdefault(key, {})
+
+            if item in items and not items[item] < cutoff:
+                return False
+
+            items[item] = value
+            return True
+
+    def pop_item(self, key, item, default=None):
+        with self.lock:
+            return self.data.get(key, {}).pop(item, default)
+
+
+class LocalStorage(Expando):
+    """
+    Storage for a service in this process only.
+
+    Attributes can be used freely, and changed in place. The atomic
+    operations are safe to use from background threads.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        object.__setattr__(self, "_atomic", AtomicMapping(self.__dict__))
+
+    def __repr__(self):
+        return "{__name__}({items})".format(
+            __name__=self.__class__.__name__,
+            items=", ".join("{}={!r}".format(k, v)
+                            for k, v in self.__dict__.items()
+                            if k != "_atomic")
+        )
+
+    def incr(self, name, amount=1):
+        return self._atomic.incr(name, amount)
+
+    def setdefault(self, name, default):
+        return self._atomic.setdefault(name, default)
+
+    def compare_and_set(self, name, expected, value):
+        return self._atomic.compare_and_set(name, expected, value)
+
+    def get_item(self, name, item, default=None):
+        return self._atomic.get_item(name, item, default)
+
+    def set_item(self, name, item, value):
+        self._atomic.set_item(name, item, value)
+
+    def set_item_if_older(self, name, item, value, cutoff):
+        return self._atomic.set_item_if_older(name, item, value, cutoff)
+
+    def pop_item(self, name, item, default=None):
+        return self._atomic.pop_item(name, item, default)
+
+
+class SharedStorage:
+    """
+    Storage for a service, shared by every worker through the supervisor.
+
+    Values are copied to and from the supervisor, so they have to be
+    picklable, and changing one in place doesn't change it for anyone else:
+    set the attribute again, or use the atomic operations.
+
+    Every attribute access and operation is a round trip to the supervisor,
+    which blocks the calling thread, usually the event loop, until it
+    answers, for up to ``timeout`` seconds. Read values once per hook rather
+    than repeatedly, and prefer one atomic operation to a read followed by a
+    write, which another worker could get between anyway.
+    """
+
+    def __init__(self, ipc, namespace, timeout=5):
+        object.__setattr__(self, "_ipc", ipc)
+        object.__setattr__(self, "_namespace", namespace)
+        object.__setattr__(self, "_timeout", timeout)
+
+    def __repr__(self):
+        return "{}({!r})".format(self.__class__.__name__, self._namespace)
+
+    def _call(self, operation, name, *args):
+        return self._ipc.call("kv." + operation, (self._namespace, name),
+                              *args).result(self._timeout)
+
+    def __getattr__(self, name):
+        # don't make a round trip for copy, pickle and so on looking for
+        # special methods
+        if name.startswith("__"):
+            raise AttributeError(name)
+
+        found, value = self._call("lookup", name)
+
+        if not found:
+            raise AttributeError(name)
+
+        return value
+
+    def __setattr__(self, name, value):
+        self._call("set", name, value)
+
+    def __delattr__(self, name):
+        if not self._call("delete", name):
+            raise AttributeError(name)
+
+    def incr(self, name, amount=1):
+        return self._call("incr", name, amount)
+
+    def setdefault(self, name, default):
+        return self._call("setdefault", name, default)
+
+    def compare_and_set(self, name, expected, value):
+        return self._call("compare_and_set", name, expected, value)
+
+    def get_item(self, name, item, default=None):
+        return self._call("get_item", name, item, default)
+
+    def set_item(self, name, item, value):
+        self._call("set_item", name, item, value)
+
+    def set_item_if_older(self, name, item, value, cutoff):
+        return self._call("set_item_if_older", name, item, value, cutoff)
+
+    def pop_item(self, name, item, default=None):
+        return self._call("pop_item", name, item, default)
+
+
+def make_storage(backend, ipc, namespace):
+    """
+    Make storage for a service with the named backend: ``local`` to this
+    process, or ``shared`` between workers. Storage can only be shared when
+    running under a supervisor; otherwise it's local anyway.
+    """
+    if backend == "shared" and ipc is not None:
+        return SharedStorage(ipc, namespace)
+
+    if backend not in ("local", "shared"):
+        raise ValueError("unknown storage backend: {}".format(backend))
+
+    return LocalStorage()
@@ -0,0 +1,190 @@
+import collections
+import logging
+import signal
+import subprocess
+import sys
+import threading
+import time
+import yaml
+
+from . import config
+from .ipc import Hub, make_authkey
+
+logger = logging.getLogger(__name__)
+
+
+class Settings(config.Config):
+    socket = config.Field(doc="Path of the socket workers talk to the supervisor over.", default="kochira.sock")
+    primary = config.Field(doc="Worker which runs the shared services. Defaults to the first, by name.", default=None)
+    shared_services = config.Field(doc="Services which only run in the primary worker, e.g. because they listen on a port.", type=config.Many(str), default=["kochira.services.net.webserver"])
+    restart_delay = config.Field(doc="Seconds to wait before restarting a worker that exited.", default=5)
+    stop_timeout = config.Field(doc="Seconds to give workers to stop before killing them.", default=10)
+
+
+def shard_of(name, client_config):
+    """
+    Get the worker a network runs in. Networks without a ``shard`` get a
+    worker of their own.
+
+    Shards are always strings, since they're compared with the ``--shard``
+    a worker is started with, but may be written as numbers in the
+    configuration.
+    """
+    shard = client_config.get("shard")
+
+    if shard is None:
+        return name
+
+    return str(shard)
+
+
+def shards(clients):
+    """
+    Group networks by the worker they run in.
+    """
+    groups = collections.defaultdict(list)
+
+    for name, client_config in clients.items():
+        groups[shard_of(name, client_config)].append(name)
+
+    return {shard: sorted(names) for shard, names in groups.items()}
+
+
+def primary_shard(settings, clients):
+    """
+    Get the worker which runs the shared services.
+    """
+    if settings.primary is not None:
+        return str(settings.primary)
+
+    return min(shards(clients), default=None)
+
+
+class Supervisor:
+    """
+    Runs each network, or group of networks, in a worker process of its own,
+    so that a busy network doesn't hold up the rest.
+
+    Workers are restarted if they exit, and are sent SIGHUP to rehash when
+    the supervisor is. Services which can't be run more than once, like the
+    web server, only run in the primary worker. State shared between
+    workers, like pending account links, goes through the supervisor.
+    """
+
+    def __init__(self, config_file="config.yml"):
+        self.config_file = config_file
+        self.workers = {}
+
+        self.stopping = False
+        self._rehash_requested = False
+        self._restart_at = {}
+
+        self.rehash()
+        self.hub = Hub(self.settings.socket, make_authkey())
+
+    def rehash(self):
+        """
+        Reread which workers there should be.
+        """
+        with open(self.config_file, "r") as f:
+            data = yaml.load(f) or {}
+
+        self.settings = Settings((data.get("core") or {}).get("supervisor") or {})
+        self.shards = shards(data.get("clients") or {})
+
+    def _spawn(self, shard):
+        process = subprocess.Popen([sys.executable, "-m", "kochira",
+                                    "--config=" + self.config_file,
+                                    "--shard=" + shard])
+        self.workers[shard] = process
+        self._restart_at.pop(shard, None)
+
+        logger.info("Started worker %s (pid %d): %s", shard, process.pid,
+                    ", ".join(self.shards[shard]))
+
+    def _stop(self, shard):
+        process = self.workers.pop(shard)
+        self._restart_at.pop(shard, None)
+
+        if process.poll() is not None:
+            return
+
+        process.terminate()
+
+        try:
+            process.wait(self.settings.stop_timeout)
+        except subprocess.TimeoutExpired:
+            logger.warning("Worker %s didn't stop; killing it", shard)
+            process.kill()
+            process.wait()
+
+    def _check_workers(self):
+        now = time.monotonic()
+
+        for shard, process in list(self.workers.items()):
+            if process.poll() is None:
+                continue
+
+            if shard not in self._restart_at:
+                logger.error("Worker %s exited with status %d; restarting it in %ss",
+                             shard, process.returncode,
+                             self.settings.restart_delay)
+                self._restart_at[shard] = now + self.settings.restart_delay
+            elif now >= self._restart_at[shard]:
+                self._spawn(shard)
+
+    def _apply_rehash(self):
+        old_shards = self.shards
+
+        try:
+            self.rehash()
+        except Exception:
+            logger.exception("Could not rehash configuration")
+            return
+
+        for shard in set(old_shards) - set(self.shards):
+            logger.info("Stopping worker %s, which has no networks now", shard)
+            self._stop(shard)
+
+        for shard in sorted(set(self.shards) - set(old_shards)):
+            self._spawn(shard)
+
+        # the workers rehash themselves, and connect to or disconnect from
+        # networks that moved between them
+        for shard, process in self.workers.items():
+            if shard in old_shards and process.poll() is None:
+                process.send_signal(signal.SIGHUP)
+
+    def _handle_sighup(self, signum, frame):
+        self._rehash_requested = True
+
+    def _handle_sigterm(self, signum, frame):
+        self.stopping = True
+
+    def run(self):
+        signal.signal(signal.SIGHUP, self._handle_sighup)
+        signal.signal(signal.SIGTERM, self._handle_sigterm)
+        signal.signal(signal.SIGINT, self._handle_sigterm)
+
+        threading.Thread(target=self.hub.serve_forever, name="ipc-hub",
+                         daemon=True).start()
+
+        for shard in sorted(self.shards):
+            self._spawn(shard)
+
+        try:
+            while not self.stopping:
+                time.sleep(1)
+
+                if self._rehash_requested:
+                    self._rehash_requested = False
+                    self._apply_rehash()
+
+                self._check_workers()
+        finally:
+            logger.info("Stopping all workers")
+
+            for shard in list(self.workers):
+                self._stop(shard)
+
+            self.hub.close()
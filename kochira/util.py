@@ -1,3 +1,8 @@
+import importlib
+import re
+import types
+
+
 class Expando(object):
     def __init__(self, *args, **kwargs):
         self.__dict__.update(kwargs)
@@ -8,3 +13,162 @@ class Expando(object):
             items=", ".join("{}={!r}".format(k, v)
                             for k, v in self.__dict__.items())
         )
+
+
+class LazyModule(types.ModuleType):
+    """
+    A stand-in for a module that isn't imported until one of its attributes
+    is first used.
+    """
+
+    def _load(self):
+        module = importlib.import_module(self.__name__)
+        # later lookups find everything here without coming back through
+        # __getattr__
+        self.__dict__.update(module.__dict__)
+        return module
+
+    def __getattr__(self, name):
+        return getattr(self._load(), name)
+
+
+def lazy_import(name):
+    """
+    Import a module the first time it's used rather than now, for heavy
+    modules that only some commands need.
+    """
+    return LazyModule(name)
+
+
+def percentile(values, p):
+    """
+    Get the ``p``th percentile of some values, which must already be sorted,
+    or 0 if there aren't any.
+    """
+    if not values:
+        return 0.0
+
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+
+_FORMATTING_RE = re.compile(r"(\x03(?:\d{1,2}(?:,\d{1,2})?)?|[\x02\x0f\x16\x1d\x1f])")
+_TOGGLES = "\x02\x16\x1d\x1f"
+
+
+def _utf8_len(s):
+    return len(s.encode("utf-8"))
+
+
+class _Formatting:
+    """
+    The IRC formatting in effect at some point in a line, so that it can be
+    carried over onto the next line when the line is split.
+    """
+
+    def __init__(self):
+        self.toggles = set([])
+        self.color = None
+
+    def update(self, code):
+        if code == "\x0f":
+            self.toggles.clear()
+            self.color = None
+        elif code[0] == "\x03":
+            self.color = code if len(code) > 1 else None
+        else:
+            self.toggles ^= set([code])
+
+    def prefix(self):
+        return "".join(c for c in _TOGGLES if c in self.toggles) + \
+            (self.color or "")
+
+
+def _split_line(line, max_length):
+    formatting = _Formatting()
+    chunks = []
+    chunk = ""
+    chunk_len = 0
+    # whether the chunk has anything but carried over formatting in it
+    chunk_used = False
+
+    def _break():
+        nonlocal chunk, chunk_len, chunk_used
+        if chunk_used:
+            chunks.append(chunk.rstrip(" "))
+        chunk = formatting.prefix()
+        chunk_len = _utf8_len(chunk)
+        chunk_used = False
+
+    def _append(piece, piece_len):
+        nonlocal chunk, chunk_len, chunk_used
+        chunk += piece
+        chunk_len += piece_len
+        chunk_used = True
+
+    for word in re.split(r"( +)", line):
+        if not word:
+            continue
+
+        if word[0] == " ":
+            # spaces at the start of a chunk are dropped
+            if chunk_used and chunk_len + len(word) <= max_length:
+                _append(word, len(word))
+            elif chunk_used:
+                _break()
+            continue
+
+        word_len = _utf8_len(word)
+
+        if chunk_len + word_len > max_length and chunk_used:
+            _break()
+
+        if chunk_len + word_len <= max_length:
+            for code in _FORMATTING_RE.findall(word):
+                formatting.update(code)
+            _append(word, word_len)
+            continue
+
+        # the word doesn't fit on a line by itself, so it has to be broken up
+        # somewhere, just not in the middle of a formatting code
+        for i, piece in enumerate(_FORMATTING_RE.split(word)):
+            atoms = [piece] if i % 2 else piece
+
+            for atom in atoms:
+                atom_len = _utf8_len(atom)
+
+                if chunk_len + atom_len > max_length and chunk_used:
+                    _break()
+
+                if i % 2:
+                    formatting.update(atom)
+
+                _append(atom, atom_len)
+
+    if chunk_used:
+        chunks.append(chunk.rstrip(" "))
+
+    return chunks
+
+
+def split_message(message, max_length, max_lines=None, suffix="..."):
+    """
+    Split a message into lines of at most ``max_length`` bytes when encoded
+    as UTF-8.
+
+    Lines are broken on newlines and then between words, only breaking up
+    words which are too long to fit on a line of their own. Formatting in
+    effect where a line is broken is carried over onto the next one. If
+    there would be more than ``max_lines`` lines, the last one is cut short
+    and ends with ``suffix``.
+    """
+    lines = []
+
+    for line in message.replace("\r\n", "\n").replace("\r", "\n").split("\n"):
+        lines.extend(_split_line(line, max_length))
+
+    if max_lines and len(lines) > max_lines:
+        lines = lines[:max_lines]
+        lines[-1] = _split_line(lines[-1],
+                                max_length - _utf8_len(suffix))[0] + suffix
+
+    return lines
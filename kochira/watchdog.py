@@ -0,0 +1,122 @@
+import logging
+import sys
+import threading
+import time
+import traceback
+from datetime import timedelta
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+LATENCY = metrics.registry.histogram(
+    "kochira_event_loop_latency_seconds",
+    "How late the event loop ran callbacks that were due.")
+STALLS = metrics.registry.counter(
+    "kochira_event_loop_stalls_total",
+    "Times the event loop was stalled for longer than the threshold.")
+HOOK_DURATION = metrics.registry.histogram(
+    "kochira_hook_duration_seconds",
+    "Time hooks spent running on the event loop.",
+    ["service", "hook", "function"])
+
+
+class Watchdog:
+    """
+    Monitors the event loop for stalls and keeps timing statistics for hooks.
+
+    A callback on the event loop ticks every ``interval`` seconds, recording
+    how late it ran as the loop latency. A separate thread checks that the
+    ticks keep coming, and if the loop has been stuck for longer than
+    ``stall_threshold`` seconds, logs the stack of whatever is running on
+    it.
+    """
+
+    def __init__(self, bot, stall_threshold, slow_hook_threshold):
+        self.bot = bot
+        self.stall_threshold = stall_threshold
+        self.slow_hook_threshold = slow_hook_threshold
+        self.interval = min(0.5, stall_threshold / 2) if stall_threshold else 0.5
+
+        self.latency = LATENCY.labels()
+        self.stalls = STALLS.labels()
+        self.hook_stats = {}
+
+        self._loop_thread = None
+        self._expected = None
+        self._timeout = None
+        self._reported = False
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._stopped.clear()
+        self._expected = time.monotonic()
+        self.bot.event_loop.schedule(self._tick)
+
+        if self.stall_threshold:
+            self._thread = threading.Thread(target=self._watch,
+                                            name="kochira-watchdog",
+                                            daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+
+        if self._timeout is not None:
+            self.bot.event_loop.unschedule(self._timeout)
+            self._timeout = None
+
+    def _tick(self):
+        now = time.monotonic()
+        self._loop_thread = threading.get_ident()
+
+        latency = max(0, now - self._expected)
+        self.latency.observe(latency)
+
+        if self.stall_threshold and latency > self.stall_threshold:
+            logger.warning("Event loop was stalled for %.3fs", latency)
+
+        self._reported = False
+        self._expected = now + self.interval
+
+        if not self._stopped.is_set():
+            self._timeout = self.bot.event_loop.schedule_in(
+                timedelta(seconds=self.interval), self._tick)
+
+    def _watch(self):
+        while not self._stopped.wait(self.interval):
+            if self._loop_thread is None or self._reported:
+                continue
+
+            stalled = time.monotonic() - self._expected
+
+            if stalled <= self.stall_threshold:
+                continue
+
+            # only report each stall once
+            self._reported = True
+            self.stalls.inc()
+
+            frame = sys._current_frames().get(self._loop_thread)
+
+            if frame is None:
+                continue
+
+            logger.warning("Event loop stalled for over %.3fs in:\n%s",
+                           stalled, "".join(traceback.format_stack(frame)))
+
+    def record_hook(self, hook, name, duration):
+        """
+        Record how long a hook ran on the event loop.
+        """
+        key = (hook.service.name, name, hook.__name__)
+
+        if key not in self.hook_stats:
+            self.hook_stats[key] = HOOK_DURATION.labels(*key)
+
+        self.hook_stats[key].observe(duration)
+
+        if self.slow_hook_threshold and duration > self.slow_hook_threshold:
+            logger.warning("Slow hook: %s.%s for %s took %.3fs",
+                           hook.service.name, hook.__name__, name, duration)
@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+"""
+Measure the cold import time of every module under ``kochira.services``.
+
+Each module is imported in a fresh interpreter, after the core of the bot
+has been imported, so the time is what the module itself costs. Results can
+be saved and compared against later, e.g. after pulling in updates:
+
+    scripts/benchmark_imports.py --save baseline.json
+    scripts/benchmark_imports.py --compare baseline.json
+"""
+
+import argparse
+import json
+import os
+import pkgutil
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# what every service imports anyway
+CORE_MODULES = ["kochira.config", "kochira.service", "kochira.http",
+                "kochira.userdata"]
+
+TIMER = """\
+import time
+{core}
+start = time.perf_counter()
+import {module}
+print(time.perf_counter() - start)
+"""
+
+
+def find_modules():
+    sys.path.insert(0, ROOT)
+    import kochira.services
+
+    return sorted(name for _, name, is_pkg in pkgutil.walk_packages(
+        kochira.services.__path__, kochira.services.__name__ + ".")
+        if not is_pkg)
+
+
+def time_import(module, repeat):
+    script = TIMER.format(
+        core="\n".join("import " + name for name in CORE_MODULES),
+        module=module
+    )
+
+    times = []
+
+    for _ in range(repeat):
+        proc = subprocess.Popen([sys.executable, "-c", script], cwd=ROOT,
+                                stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        out, err = proc.communicate()
+
+        if proc.returncode != 0:
+            lines = err.decode("utf-8", "replace").strip().splitlines()
+            raise RuntimeError(lines[-1] if lines else "exit status {}".format(proc.returncode))
+
+        times.append(float(out.decode("utf-8").strip()))
+
+    return times
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("modules", nargs="*",
+                        help="Modules to measure, instead of all services.")
+    parser.add_argument("--repeat", type=int, default=3,
+                        help="Times to import each module; the median is reported.")
+    parser.add_argument("--save", metavar="FILE",
+                        help="Save the results as JSON.")
+    parser.add_argument("--compare", metavar="FILE",
+                        help="Compare against results saved earlier.")
+    parser.add_argument("--threshold", type=float, default=0.2,
+                        help="Flag modules this much slower than before, as a fraction.")
+    args = parser.parse_args()
+
+    modules = args.modules or find_modules()
+    results = {}
+    errors = {}
+
+    for module in modules:
+        try:
+            times = time_import(module, args.repeat)
+        except RuntimeError as e:
+            errors[module] = str(e)
+            continue
+
+        results[module] = {"median": sorted(times)[len(times) // 2],
+                           "min": min(times)}
+
+    baseline = {}
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+
+    regressions = 0
+
+    print("{:<50} {:>9} {:>9} {:>9}".format("module", "median", "min",
+                                            "change" if baseline else ""))
+
+    for module, result in sorted(results.items(),
+                                 key=lambda x: -x[1]["median"]):
+        line = "{:<50} {:8.3f}s {:8.3f}s".format(module, result["median"],
+                                                 result["min"])
+
+        if module in baseline:
+            before = baseline[module]["median"]
+            change = (result["median"] - before) / before if before else 0
+            line += " {:+8.0%}".format(change)
+
+            if change > args.threshold:
+                line += " SLOWER"
+                regressions += 1
+
+        print(line)
+
+    print("{:<50} {:8.3f}s".format(
+        "total", sum(result["median"] for result in results.values())))
+
+    for module, error in sorted(errors.items()):
+        print("{}: couldn't import: {}".format(module, error), file=sys.stderr)
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+    if regressions:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+"""
+Run the bot against a fake IRC server with simulated busy channels, and
+report how far behind the traffic it falls.
+
+The bot is started with the core settings from the given configuration, but
+connects to one fake network instead of the configured ones, and joins the
+simulated channels there. Only the services named with ``--service`` are
+loaded, with their settings from the configuration, so nothing else binds
+ports or calls out to the network unless those services do:
+
+    scripts/load_test.py --channels 20 --users 50 --rate 500 --duration 60 \
+        --service core.admin --service web.weather
+
+Messages are picked from a few lines of chatter; give your own with
+``--message``, e.g. commands for the services under test. With
+``core.journal`` set in the configuration, the traffic is recorded too, to
+replay later with ``scripts/replay_journal.py``.
+"""
+
+import argparse
+import logging
+import os
+import shutil
+import sys
+import tempfile
+
+import yaml
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def make_config(base, port, channels, database, services):
+    if os.path.exists(base):
+        with open(base, "r") as f:
+            data = yaml.load(f) or {}
+    else:
+        data = {}
+
+    core = dict(data.get("core") or {})
+    core["database"] = database
+
+    networks = data.get("clients") or {}
+    nickname = next((network.get("nickname") for network in networks.values()
+                     if network.get("nickname")), "Kochira")
+
+    settings = data.get("services") or {}
+
+    return {
+        "core": core,
+        "clients": {
+            "fakeserver": {
+                "nickname": nickname,
+                "hostname": "127.0.0.1",
+                "port": port,
+                "channels": {name: {} for name in channels}
+            }
+        },
+        "services": {name: settings.get(name) or {} for name in services}
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--config", default="config.yml",
+                        help="Configuration to take services and core settings from.")
+    parser.add_argument("--service", action="append", dest="services",
+                        metavar="NAME",
+                        default=[],
+                        help="A service to load, with its settings from the configuration. May be given more than once.")
+    parser.add_argument("--channels", type=int, default=10,
+                        help="Simulated channels.")
+    parser.add_argument("--users", type=int, default=10,
+                        help="Simulated users in each channel.")
+    parser.add_argument("--rate", type=float, default=100.0,
+                        help="Messages a second, across all channels.")
+    parser.add_argument("--duration", type=float, default=30.0,
+                        help="Seconds to generate load for, once the bot has joined.")
+    parser.add_argument("--message", action="append", dest="messages",
+                        help="A message for simulated users to say. May be given more than once.")
+    parser.add_argument("--database", metavar="FILE",
+                        help="Database to run against a copy of.")
+    parser.add_argument("--seed", type=int,
+                        help="Seed for picking who says what, for repeatable runs.")
+    parser.add_argument("--verbose", action="store_true",
+                        help="Show the bot's and server's logs.")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING)
+
+    sys.path.insert(0, ROOT)
+    from kochira import Bot
+    from kochira.fakeserver import FakeServer, LoadGenerator
+
+    server = FakeServer()
+    port = server.serve_in_thread()
+
+    generator = LoadGenerator(server, channels=args.channels,
+                              users=args.users, rate=args.rate,
+                              messages=args.messages, seed=args.seed)
+
+    fd, database = tempfile.mkstemp(prefix="kochira-load-", suffix=".db")
+    os.close(fd)
+
+    if args.database is not None:
+        shutil.copyfile(args.database, database)
+
+    with tempfile.NamedTemporaryFile("w", prefix="kochira-load-",
+                                     suffix=".yml", delete=False) as f:
+        yaml.dump(make_config(args.config, port, generator.channel_names,
+                              database, args.services), f)
+        config_file = f.name
+
+    try:
+        bot = Bot(config_file)
+
+        server.call_on_loop(generator.setup)
+        server.call_on_loop(generator.start, args.duration,
+                            lambda: bot.event_loop.schedule(bot.stop))
+
+        bot.run()
+    finally:
+        server.shutdown()
+        os.unlink(config_file)
+        os.unlink(database)
+
+    print("\n".join(generator.report()))
+    print("Server: {} lines received, {} lines sent".format(
+        server.received_lines, server.sent_lines))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+"""
+Replay a journal of recorded traffic through the bot, and report throughput
+and hook latency.
+
+Record a journal by setting ``core.journal`` in the configuration, then
+replay it, at the recorded speed, ten times as fast, or as fast as the bot
+keeps up:
+
+    scripts/replay_journal.py traffic.journal.gz
+    scripts/replay_journal.py --speed 10 traffic.journal.gz
+    scripts/replay_journal.py --speed 0 traffic.journal.gz
+
+The bot runs against a copy of the database given with ``--database``, or an
+empty one, and nothing it sends goes anywhere.
+"""
+
+import argparse
+import logging
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("journal",
+                        help="Journal to replay.")
+    parser.add_argument("--config", default="config.yml",
+                        help="Configuration to run the bot with.")
+    parser.add_argument("--speed", type=float, default=1.0,
+                        help="Multiple of the recorded speed to replay at; 0 for as fast as possible.")
+    parser.add_argument("--drain", type=float, default=10.0,
+                        help="Seconds to wait for hooks still running at the end.")
+    parser.add_argument("--database", metavar="FILE",
+                        help="Database to run against a copy of.")
+    parser.add_argument("--verbose", action="store_true",
+                        help="Show the bot's log.")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING)
+
+    sys.path.insert(0, ROOT)
+    from kochira.replay import ReplayBot
+
+    bot = ReplayBot(args.config, args.journal, speed=args.speed,
+                    drain_timeout=args.drain, database=args.database)
+    bot.run()
+
+    print("\n".join(bot.replay.report()))
+
+
+if __name__ == "__main__":
+    main()
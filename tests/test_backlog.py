@@ -0,0 +1,123 @@
+import types
+import unittest
+from unittest import mock
+
+from kochira.backlog import Backlogs
+
+
+def make_client(channels=None, **core):
+    core_config = dict(max_backlog=3, backlog_timestamps=False,
+                       max_private_backlogs=2, private_backlog_ttl=60)
+    core_config.update(core)
+
+    return types.SimpleNamespace(
+        config=types.SimpleNamespace(channels=channels or {}),
+        bot=types.SimpleNamespace(
+            config=types.SimpleNamespace(
+                core=types.SimpleNamespace(**core_config))),
+        is_channel=lambda target: target.startswith("#"))
+
+
+class BacklogsTest(unittest.TestCase):
+    def setUp(self):
+        self.now = 1000.0
+        patcher = mock.patch("kochira.backlog.time.monotonic",
+                             lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def messages(self, backlogs, target):
+        return [line.message for line in backlogs[target]]
+
+    def test_keeps_newest_lines_first(self):
+        backlogs = Backlogs(make_client())
+
+        for message in ["a", "b", "c", "d"]:
+            backlogs.add("#foo", "someone", message)
+
+        self.assertEqual(self.messages(backlogs, "#foo"), ["d", "c", "b"])
+
+    def test_lines_have_increasing_ids(self):
+        backlogs = Backlogs(make_client())
+        backlogs.add("#foo", "someone", "a")
+        backlogs.add("#bar", "someone", "b")
+
+        self.assertLess(backlogs["#foo"][0].id, backlogs["#bar"][0].id)
+
+    def test_timestamps(self):
+        backlogs = Backlogs(make_client(backlog_timestamps=True))
+        backlogs.add("#foo", "someone", "a")
+
+        self.assertIsNotNone(backlogs["#foo"][0].ts)
+
+        backlogs = Backlogs(make_client())
+        backlogs.add("#foo", "someone", "a")
+
+        self.assertIsNone(backlogs["#foo"][0].ts)
+
+    def test_channel_max_backlog(self):
+        channels = {"#foo": types.SimpleNamespace(max_backlog=1)}
+        backlogs = Backlogs(make_client(channels))
+
+        for message in ["a", "b"]:
+            backlogs.add("#foo", "someone", message)
+            backlogs.add("#bar", "someone", message)
+
+        self.assertEqual(self.messages(backlogs, "#foo"), ["b"])
+        self.assertEqual(self.messages(backlogs, "#bar"), ["b", "a"])
+
+    def test_evicts_least_recently_active_private_backlog(self):
+        backlogs = Backlogs(make_client())
+
+        backlogs.add("alice", "alice", "a")
+        backlogs.add("bob", "bob", "b")
+        backlogs.add("alice", "alice", "c")
+        backlogs.add("carol", "carol", "d")
+
+        self.assertEqual(sorted(backlogs), ["alice", "carol"])
+
+    def test_evicts_idle_private_backlogs(self):
+        backlogs = Backlogs(make_client())
+
+        backlogs.add("alice", "alice", "a")
+        backlogs.add("#foo", "someone", "b")
+        self.now += 61
+        backlogs.add("bob", "bob", "c")
+
+        self.assertEqual(sorted(backlogs), ["#foo", "bob"])
+
+    def test_doesnt_evict_channels(self):
+        backlogs = Backlogs(make_client(max_private_backlogs=0))
+
+        for target in ["#a", "#b", "#c"]:
+            backlogs.add(target, "someone", "a")
+
+        self.assertEqual(sorted(backlogs), ["#a", "#b", "#c"])
+
+    def test_resize(self):
+        client = make_client()
+        backlogs = Backlogs(client)
+
+        for message in ["a", "b", "c"]:
+            backlogs.add("#foo", "someone", message)
+
+        client.bot.config.core.max_backlog = 2
+        backlogs.resize()
+
+        self.assertEqual(self.messages(backlogs, "#foo"), ["c", "b"])
+
+        backlogs.add("#foo", "someone", "d")
+        self.assertEqual(self.messages(backlogs, "#foo"), ["d", "c"])
+
+    def test_discard(self):
+        backlogs = Backlogs(make_client())
+        backlogs.add("alice", "alice", "a")
+        backlogs.discard("alice")
+        backlogs.discard("bob")
+
+        self.assertNotIn("alice", backlogs)
+        self.assertEqual(len(backlogs._private), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
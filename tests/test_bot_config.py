@@ -0,0 +1,84 @@
+import unittest
+
+from kochira import config
+from kochira.bot import Bot, _config_class_factory
+
+
+class FakeBot:
+    _qualify_service_name = Bot._qualify_service_name
+
+    def __init__(self):
+        self.services = {}
+
+
+class BotConfigTest(unittest.TestCase):
+    def setUp(self):
+        self.Config = _config_class_factory(FakeBot())
+
+    def test_minimal_config(self):
+        conf = self.Config({
+            "core": {},
+            "clients": {
+                "foonet": {
+                    "nickname": "Kochira",
+                    "hostname": "irc.foonet.net",
+                    "channels": {"#foo": {}}
+                }
+            },
+            "services": {}
+        })
+        conf.validate()
+
+        self.assertEqual(conf.core.database, "kochira.db")
+        self.assertEqual(conf.core.executors, {})
+        self.assertEqual(conf.clients["foonet"].flood.burst, 5)
+        self.assertTrue(conf.clients["foonet"].channels["#foo"].autojoin)
+
+    def test_executors(self):
+        conf = self.Config({
+            "core": {"executors": {"io": {"max_workers": 8}}},
+            "clients": {},
+            "services": {}
+        })
+
+        self.assertEqual(conf.core.executors["io"].max_workers, 8)
+        self.assertIsNone(conf.core.executors["io"].max_queue)
+
+    def test_missing_network_setting(self):
+        conf = self.Config({
+            "core": {},
+            "clients": {"foonet": {"nickname": "Kochira"}},
+            "services": {}
+        })
+
+        with self.assertRaises(config.ConfigError) as cm:
+            conf.validate()
+
+        self.assertEqual(cm.exception.path, "clients.foonet.hostname")
+
+    def test_invalid_service_settings(self):
+        with self.assertRaises(config.ConfigError) as cm:
+            self.Config({"core": {}, "clients": {},
+                         "services": {"foo": ["not", "a", "mapping"]}})
+
+        self.assertEqual(cm.exception.path, "services.foo")
+
+        with self.assertRaises(config.ConfigError) as cm:
+            self.Config({
+                "core": {},
+                "clients": {
+                    "foonet": {
+                        "nickname": "Kochira",
+                        "hostname": "irc.foonet.net",
+                        "channels": {"#foo": {"services": {"foo": "bar"}}}
+                    }
+                },
+                "services": {}
+            })
+
+        self.assertEqual(cm.exception.path,
+                         "clients.foonet.channels.#foo.services.foo")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,175 @@
+import pickle
+import unittest
+
+from kochira import config
+
+
+class Channel(config.Config):
+    autojoin = config.Field(default=True)
+    acl = config.Field(type=config.Mapping(config.Many(str, is_set=True)))
+
+
+class Network(config.Config):
+    hostname = config.Field()
+    port = config.Field(type=int, default=6667)
+    channels = config.Field(type=config.Mapping(Channel))
+    settings = config.Field(default={})
+
+
+class Root(config.Config):
+    clients = config.Field(type=config.Mapping(Network))
+
+
+class ConfigTest(unittest.TestCase):
+    def test_defaults(self):
+        network = Network({"hostname": "irc.foonet.net"})
+
+        self.assertEqual(network.port, 6667)
+        self.assertEqual(network.channels, {})
+        self.assertNotIn("port", network)
+        self.assertEqual(dict(network), {"hostname": "irc.foonet.net"})
+
+    def test_converts_values(self):
+        network = Network({"hostname": "irc.foonet.net", "port": "6697",
+                           "channels": {"#foo": {"acl": {"bob": ["admin"]}}}})
+
+        self.assertEqual(network.port, 6697)
+        self.assertIsInstance(network.channels["#foo"], Channel)
+        self.assertEqual(network.channels["#foo"].acl["bob"],
+                         frozenset(["admin"]))
+
+    def test_error_path(self):
+        with self.assertRaises(config.ConfigError) as cm:
+            Root({"clients": {"foo": {"channels": {"#x": {"acl": "admin"}}}}})
+
+        self.assertEqual(cm.exception.path, "clients.foo.channels.#x.acl")
+        self.assertTrue(str(cm.exception).startswith(
+            "clients.foo.channels.#x.acl: "))
+
+    def test_error_path_within_list(self):
+        class Ports(config.Config):
+            ports = config.Field(type=config.Many(int))
+
+        with self.assertRaises(config.ConfigError) as cm:
+            Ports({"ports": [6667, "sixty"]})
+
+        self.assertEqual(cm.exception.path, "ports.1")
+
+    def test_wrong_type(self):
+        with self.assertRaises(config.ConfigError) as cm:
+            Network({"hostname": "irc.foonet.net", "port": "sixty"})
+
+        self.assertEqual(cm.exception.path, "port")
+
+        with self.assertRaises(config.ConfigError) as cm:
+            Network(["not", "a", "mapping"])
+
+        self.assertEqual(cm.exception.path, "")
+
+    def test_required(self):
+        network = Network({})
+
+        with self.assertRaises(AttributeError):
+            network.hostname
+
+        with self.assertRaises(config.ConfigError) as cm:
+            network.validate()
+
+        self.assertEqual(cm.exception.path, "hostname")
+
+    def test_required_nested(self):
+        root = Root({"clients": {"foo": {}}})
+
+        with self.assertRaises(config.ConfigError) as cm:
+            root.validate()
+
+        self.assertEqual(cm.exception.path, "clients.foo.hostname")
+
+        Root({"clients": {"foo": {"hostname": "irc.foonet.net"}}}).validate()
+
+    def test_read_only(self):
+        network = Network({"hostname": "irc.foonet.net",
+                           "channels": {"#foo": {}}})
+
+        with self.assertRaises(AttributeError):
+            network.hostname = "irc.barnet.net"
+
+        with self.assertRaises(AttributeError):
+            del network.port
+
+        with self.assertRaises(AttributeError):
+            network.extra = 1
+
+        with self.assertRaises(TypeError):
+            network.channels["#bar"] = Channel()
+
+        with self.assertRaises(TypeError):
+            network.channels.update({"#bar": Channel()})
+
+        with self.assertRaises(TypeError):
+            network.channels.pop("#foo")
+
+        with self.assertRaises(TypeError):
+            network["hostname"] = "irc.barnet.net"
+
+    def test_combine(self):
+        base = Network({"hostname": "irc.foonet.net",
+                        "settings": {"a": 1, "b": 2}})
+        override = Network({"port": 6697, "settings": {"b": 3}})
+
+        combined = base.combine(override)
+
+        self.assertIsInstance(combined, Network)
+        self.assertEqual(combined.hostname, "irc.foonet.net")
+        self.assertEqual(combined.port, 6697)
+        self.assertEqual(combined.settings, {"a": 1, "b": 3})
+        self.assertIsInstance(combined.settings, config.FrozenDict)
+
+        with self.assertRaises(TypeError):
+            combined.settings["c"] = 4
+
+        # the originals are left alone
+        self.assertEqual(base.settings, {"a": 1, "b": 2})
+
+    def test_combine_nested_configs(self):
+        class Outer(config.Config):
+            channel = config.Field(type=Channel, default=Channel())
+
+        combined = Outer({"channel": {"autojoin": False}}).combine(
+            Outer({"channel": {"acl": {"bob": ["admin"]}}}))
+
+        self.assertFalse(combined.channel.autojoin)
+        self.assertEqual(combined.channel.acl["bob"], frozenset(["admin"]))
+
+    def test_combine_wider_type(self):
+        class Wider(Network):
+            extra = config.Field(default=None)
+
+        with self.assertRaises(TypeError):
+            Network({}).combine(Wider({}))
+
+        self.assertIsInstance(Wider({}).combine(Network({})), Wider)
+
+    def test_pickle(self):
+        root = Root({"clients": {"foo": {"hostname": "irc.foonet.net",
+                                         "channels": {"#foo": {}}}}})
+
+        copy = pickle.loads(pickle.dumps(root))
+
+        self.assertEqual(copy, root)
+        self.assertIsInstance(copy.clients, config.FrozenDict)
+        self.assertEqual(copy.clients["foo"].port, 6667)
+        self.assertIsInstance(copy.clients["foo"].channels["#foo"], Channel)
+
+        with self.assertRaises(TypeError):
+            copy.clients["bar"] = None
+
+    def test_pickle_frozen_dict(self):
+        d = pickle.loads(pickle.dumps(config.FrozenDict({"a": 1})))
+
+        self.assertIsInstance(d, config.FrozenDict)
+        self.assertEqual(d, {"a": 1})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,88 @@
+import importlib
+import os
+import pickle
+import shutil
+import sys
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+from kochira import executor
+
+
+MODULE = """\
+def version():
+    return {!r}
+"""
+
+
+class WorkerReloadTest(unittest.TestCase):
+    """
+    What a worker process does with the functions it's sent, run here.
+    """
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir)
+
+        sys.path.insert(0, self.dir)
+        self.addCleanup(sys.path.remove, self.dir)
+        self.addCleanup(sys.modules.pop, "kochira_test_worker", None)
+
+        patcher = mock.patch.dict(executor._module_generations, clear=True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def write(self, version):
+        path = os.path.join(self.dir, "kochira_test_worker.py")
+
+        with open(path, "w") as f:
+            f.write(MODULE.format(version))
+
+        # make sure the change is seen, however coarse the file system's
+        # timestamps are
+        mtime = time.time() + len(version)
+        os.utime(path, (mtime, mtime))
+        importlib.invalidate_caches()
+
+    def call(self, generation):
+        # functions are sent to workers pickled by name, which finds
+        # whichever version of the module the worker has
+        fn = pickle.loads(pickle.dumps(
+            sys.modules["kochira_test_worker"].version))
+        return pickle.loads(executor._call_in_process(fn, (), {}, generation))
+
+    def test_calls_function(self):
+        self.write("one")
+        importlib.import_module("kochira_test_worker")
+
+        self.assertEqual(self.call(0), "one")
+
+    def test_reloads_stale_module(self):
+        self.write("one")
+        importlib.import_module("kochira_test_worker")
+        self.assertEqual(self.call(0), "one")
+
+        self.write("two")
+        self.assertEqual(self.call(1), "two")
+
+        # and only once
+        with mock.patch.object(executor.imp, "reload") as reload:
+            self.assertEqual(self.call(1), "two")
+            self.assertFalse(reload.called)
+
+    def test_preload_records_generation(self):
+        self.write("one")
+        executor._import_modules({"kochira_test_worker": 0})
+
+        self.write("two")
+        executor._import_modules({"kochira_test_worker": 1})
+
+        with mock.patch.object(executor.imp, "reload") as reload:
+            self.assertEqual(self.call(1), "two")
+            self.assertFalse(reload.called)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,109 @@
+import os
+import shutil
+import tempfile
+import types
+import unittest
+
+from kochira.journal import JournalWriter, read_journal
+
+
+def make_client(name, nickname="Kochira"):
+    return types.SimpleNamespace(
+        name=name, nickname=nickname,
+        config=types.SimpleNamespace(hostname=name + ".example.com"))
+
+
+class JournalTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir)
+
+    def path(self, name):
+        return os.path.join(self.dir, name)
+
+    def write(self, path, records):
+        writer = JournalWriter(path)
+
+        for client, data in records:
+            writer.record(client, data)
+
+        writer.close()
+
+    def read(self, path):
+        return [(event.client, event.data)
+                for _, event in read_journal(path)]
+
+    def assertRoundTrips(self, path):
+        foo = make_client("foo")
+        bar = make_client("bar")
+
+        records = [(foo, b":a PRIVMSG #a :hello\r\n"),
+                   (bar, b":b PRIVMSG #b :hi\r\n"),
+                   (foo, b"PING :foo\r\n")]
+
+        self.write(path, records)
+
+        self.assertEqual(self.read(path),
+                         [(client.name, data) for client, data in records])
+
+    def test_round_trip(self):
+        self.assertRoundTrips(self.path("journal"))
+
+    def test_compressed_round_trip(self):
+        self.assertRoundTrips(self.path("journal.gz"))
+
+    def test_reads_client_details(self):
+        path = self.path("journal")
+        self.write(path, [(make_client("foo", "Bot"), b"PING :x\r\n")])
+
+        clients, event = next(read_journal(path))
+
+        self.assertEqual(clients, {"foo": {"name": "foo", "nickname": "Bot",
+                                           "hostname": "foo.example.com"}})
+        self.assertIsInstance(event.ts, float)
+
+    def test_reads_truncated_journal(self):
+        path = self.path("journal")
+        foo = make_client("foo")
+        self.write(path, [(foo, b"first\r\n"), (foo, b"second\r\n")])
+
+        with open(path, "r+b") as f:
+            f.truncate(os.path.getsize(path) - 3)
+
+        self.assertEqual(self.read(path), [("foo", b"first\r\n")])
+
+    def test_rejects_non_journal(self):
+        path = self.path("journal")
+
+        with open(path, "wb") as f:
+            f.write(b"not a journal\n")
+
+        with self.assertRaises(ValueError):
+            self.read(path)
+
+    def test_keeps_previous_journal(self):
+        path = self.path("journal.gz")
+        foo = make_client("foo")
+
+        self.write(path, [(foo, b"before\r\n")])
+        self.write(path, [(foo, b"after\r\n")])
+        self.write(path, [(foo, b"again\r\n")])
+
+        self.assertEqual(self.read(path), [("foo", b"again\r\n")])
+
+        rotated = sorted(name for name in os.listdir(self.dir)
+                         if name != "journal.gz")
+
+        self.assertEqual(len(rotated), 2)
+
+        for name in rotated:
+            self.assertTrue(name.startswith("journal."))
+            self.assertTrue(name.endswith(".gz"))
+
+        self.assertEqual(sorted(data for name in rotated
+                                for _, data in self.read(self.path(name))),
+                         [b"after\r\n", b"before\r\n"])
+
+
+if __name__ == "__main__":
+    unittest.main()
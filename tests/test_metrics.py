@@ -0,0 +1,85 @@
+import threading
+import unittest
+
+from kochira import metrics
+
+
+class MetricsTest(unittest.TestCase):
+    def setUp(self):
+        self.registry = metrics.Registry()
+
+    def test_counter_from_threads(self):
+        counter = self.registry.counter("test_total", "Test.").labels()
+
+        def work():
+            for _ in range(10000):
+                counter.inc()
+
+        threads = [threading.Thread(target=work) for _ in range(4)]
+
+        for thread in threads:
+            thread.start()
+
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(counter.value, 40000)
+
+    def test_gauge_function(self):
+        gauge = self.registry.gauge("test_gauge", "Test.", ["client"])
+        gauge.labels("foo").set_function(lambda: 42)
+
+        self.assertIn('test_gauge{client="foo"} 42', self.registry.expose())
+
+    def test_remove(self):
+        gauge = self.registry.gauge("test_gauge", "Test.", ["client"])
+        gauge.labels("foo").set_function(lambda: 42)
+        gauge.labels("bar").set(1)
+
+        gauge.remove("foo")
+        gauge.remove("baz")
+
+        self.assertEqual([values for values, _ in gauge.children()],
+                         [("bar",)])
+        self.assertNotIn('client="foo"', self.registry.expose())
+
+    def test_histogram(self):
+        histogram = self.registry.histogram("test_seconds", "Test.",
+                                            buckets=(1, 2)).labels()
+
+        for value in (0.5, 1.5, 1.5, 3):
+            histogram.observe(value)
+
+        exposed = self.registry.expose()
+
+        self.assertIn('test_seconds_bucket{le="1"} 1', exposed)
+        self.assertIn('test_seconds_bucket{le="2"} 3', exposed)
+        self.assertIn('test_seconds_bucket{le="+Inf"} 4', exposed)
+        self.assertIn("test_seconds_count 4", exposed)
+
+    def test_collectors(self):
+        def collect():
+            gauge = metrics.Metric("gauge", "test_collected", "Test.", [],
+                                   metrics.Gauge)
+            gauge.labels().set(7)
+            return [gauge]
+
+        self.registry.add_collector(collect)
+        self.assertIn("test_collected 7", self.registry.expose())
+
+        self.registry.remove_collector(collect)
+        self.registry.remove_collector(collect)
+        self.assertNotIn("test_collected", self.registry.expose())
+
+    def test_registered_differently(self):
+        self.registry.counter("test_total", "Test.", ["a"])
+
+        with self.assertRaises(ValueError):
+            self.registry.gauge("test_total", "Test.", ["a"])
+
+        with self.assertRaises(ValueError):
+            self.registry.counter("test_total", "Test.", ["b"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,179 @@
+import types
+import unittest
+from unittest import mock
+
+from kochira.outbox import Outbox, QUEUED
+
+
+class FakeEventLoop:
+    def __init__(self):
+        self.timeouts = []
+
+    def schedule_in(self, delay, f, *args):
+        handle = (delay, f)
+        self.timeouts.append(handle)
+        return handle
+
+    def unschedule(self, handle):
+        self.timeouts.remove(handle)
+
+
+class FakeClient:
+    def __init__(self, rate=1, burst=2, coalesce=False):
+        self.name = "test"
+        self.config = types.SimpleNamespace(flood=types.SimpleNamespace(
+            rate=rate, burst=burst, coalesce=coalesce))
+        self.bot = types.SimpleNamespace(event_loop=FakeEventLoop())
+        self.sent = []
+
+    def is_channel(self, target):
+        return target.startswith("#")
+
+    def _max_message_length(self, command, target):
+        return 30
+
+    def _deliver(self, command, target, message):
+        self.sent.append((target, message))
+
+
+class OutboxTest(unittest.TestCase):
+    def setUp(self):
+        self.now = 1000.0
+        patcher = mock.patch("kochira.outbox.time.monotonic",
+                             lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def advance(self, client, seconds):
+        self.now += seconds
+
+        # run whichever timeout is armed, as the event loop would
+        if client.bot.event_loop.timeouts:
+            _, f = client.bot.event_loop.timeouts.pop(0)
+            f()
+
+    def test_sends_burst_right_away(self):
+        client = FakeClient(burst=2)
+        outbox = Outbox(client)
+
+        for message in ["a", "b", "c"]:
+            outbox.put("PRIVMSG", "#foo", message)
+
+        self.assertEqual(client.sent, [("#foo", "a"), ("#foo", "b")])
+        self.assertEqual(len(outbox), 1)
+        self.assertEqual(len(client.bot.event_loop.timeouts), 1)
+
+    def test_refills_at_rate(self):
+        client = FakeClient(rate=2, burst=1)
+        outbox = Outbox(client)
+
+        for message in ["a", "b", "c"]:
+            outbox.put("PRIVMSG", "#foo", message)
+
+        self.assertEqual(len(client.sent), 1)
+
+        delay, _ = client.bot.event_loop.timeouts[0]
+        self.assertEqual(delay.total_seconds(), 0.5)
+
+        self.advance(client, 0.5)
+        self.assertEqual(len(client.sent), 2)
+
+        self.advance(client, 0.5)
+        self.assertEqual(len(client.sent), 3)
+        self.assertEqual(client.bot.event_loop.timeouts, [])
+
+    def test_unlimited_rate(self):
+        client = FakeClient(rate=0)
+        outbox = Outbox(client)
+
+        for i in range(10):
+            outbox.put("PRIVMSG", "#foo", str(i))
+
+        self.assertEqual(len(client.sent), 10)
+        self.assertEqual(client.bot.event_loop.timeouts, [])
+
+    def test_replies_go_first(self):
+        client = FakeClient(burst=1)
+        outbox = Outbox(client)
+
+        outbox.put("PRIVMSG", "#foo", "a")
+        outbox.put("PRIVMSG", "#foo", "b")
+        outbox.put("PRIVMSG", "#foo", "reply", Outbox.REPLY)
+
+        self.advance(client, 1)
+        self.assertEqual(client.sent[-1], ("#foo", "reply"))
+
+    def test_targets_take_turns(self):
+        client = FakeClient(burst=1)
+        outbox = Outbox(client)
+
+        outbox.put("PRIVMSG", "#busy", "first")
+
+        for i in range(3):
+            outbox.put("PRIVMSG", "#busy", str(i))
+
+        outbox.put("PRIVMSG", "#quiet", "hello")
+
+        self.advance(client, 1)
+        self.advance(client, 1)
+
+        self.assertEqual(client.sent, [("#busy", "first"), ("#busy", "0"),
+                                       ("#quiet", "hello")])
+
+    def test_coalesces_channel_lines_when_backed_up(self):
+        client = FakeClient(burst=1, coalesce=True)
+        outbox = Outbox(client)
+
+        outbox.put("PRIVMSG", "#foo", "first")
+
+        for message in ["a", "b", "c"]:
+            outbox.put("PRIVMSG", "#foo", message)
+            outbox.put("PRIVMSG", "someone", message)
+
+        self.advance(client, 1)
+
+        self.assertEqual(client.sent, [("#foo", "first"),
+                                       ("#foo", "a | b | c")])
+
+        self.advance(client, 1)
+        self.assertEqual(client.sent[-1], ("someone", "a"))
+
+    def test_doesnt_coalesce_past_max_length(self):
+        client = FakeClient(burst=1, coalesce=True)
+        outbox = Outbox(client)
+
+        outbox.put("PRIVMSG", "#foo", "first")
+
+        for message in ["x" * 20, "y" * 20]:
+            outbox.put("PRIVMSG", "#foo", message)
+
+        self.advance(client, 1)
+        self.assertEqual(client.sent[-1], ("#foo", "x" * 20))
+
+    def test_drain(self):
+        client = FakeClient(burst=0)
+        outbox = Outbox(client)
+
+        outbox.put("PRIVMSG", "#foo", "a")
+        outbox.put("NOTICE", "bar", "b", Outbox.REPLY)
+
+        self.assertEqual(outbox.drain(),
+                         [[Outbox.REPLY, "NOTICE", "bar", "b"],
+                          [Outbox.NORMAL, "PRIVMSG", "#foo", "a"]])
+        self.assertEqual(len(outbox), 0)
+        self.assertEqual(client.bot.event_loop.timeouts, [])
+
+    def test_close(self):
+        client = FakeClient(burst=0)
+        outbox = Outbox(client)
+        outbox.put("PRIVMSG", "#foo", "a")
+
+        self.assertEqual(QUEUED.labels("test").value, 1)
+
+        outbox.close()
+
+        self.assertNotIn(("test",), dict(QUEUED.children()))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,145 @@
+import copy
+import unittest
+
+from kochira.rehash import diff_config
+
+
+class AttrDict(dict):
+    """
+    A stand-in for a parsed configuration, which diff_config reads both as a
+    mapping and through attributes.
+    """
+
+    def __getattr__(self, name):
+        try:
+            return self[name]
+        except KeyError:
+            raise AttributeError(name)
+
+
+def make_config(data):
+    def _wrap(value):
+        if isinstance(value, dict):
+            return AttrDict((k, _wrap(v)) for k, v in value.items())
+        return value
+
+    return _wrap(data)
+
+
+BASE = {
+    "core": {"max_backlog": 10, "database": "kochira.db"},
+    "clients": {
+        "foonet": {
+            "nickname": "Kochira",
+            "hostname": "irc.foonet.net",
+            "channels": {
+                "#foo": {},
+                "#bar": {"services": {"kochira.services.a": {"x": 1}}}
+            },
+            "services": {"kochira.services.b": {}}
+        },
+        "barnet": {"nickname": "Kochira", "hostname": "irc.barnet.net"}
+    },
+    "services": {"kochira.services.a": {}, "kochira.services.b": {}}
+}
+
+
+class DiffConfigTest(unittest.TestCase):
+    def diff(self, change):
+        new = copy.deepcopy(BASE)
+        change(new)
+        return diff_config(make_config(BASE), make_config(new))
+
+    def test_no_changes(self):
+        diff = diff_config(make_config(BASE), make_config(BASE))
+
+        self.assertFalse(diff)
+        self.assertEqual(diff.summary(), [])
+
+    def test_clients_added_and_removed(self):
+        def change(new):
+            del new["clients"]["barnet"]
+            new["clients"]["baznet"] = {"nickname": "Kochira"}
+
+        diff = self.diff(change)
+
+        self.assertEqual(diff.clients_added, {"baznet"})
+        self.assertEqual(diff.clients_removed, {"barnet"})
+
+    def test_connection_change_reconnects(self):
+        def change(new):
+            new["clients"]["foonet"]["hostname"] = "irc2.foonet.net"
+            new["clients"]["foonet"]["channels"]["#baz"] = {}
+
+        diff = self.diff(change)
+
+        self.assertEqual(diff.clients_reconnected, {"foonet"})
+        # the channels are joined on reconnecting anyway
+        self.assertEqual(dict(diff.channels_added), {})
+
+    def test_channels(self):
+        def change(new):
+            channels = new["clients"]["foonet"]["channels"]
+            del channels["#foo"]
+            channels["#baz"] = {}
+            channels["#bar"]["password"] = "hunter2"
+
+        diff = self.diff(change)
+
+        self.assertFalse(diff.clients_reconnected)
+        self.assertEqual(dict(diff.channels_added), {"foonet": {"#baz"}})
+        self.assertEqual(dict(diff.channels_removed), {"foonet": {"#foo"}})
+        self.assertEqual(dict(diff.channels_changed), {"foonet": {"#bar"}})
+
+    def test_per_network_services(self):
+        def change(new):
+            new["clients"]["foonet"]["services"]["kochira.services.b"] = \
+                {"y": 2}
+
+        diff = self.diff(change)
+
+        self.assertEqual(diff.services_reconfigured,
+                         {("kochira.services.b", "foonet", None)})
+        self.assertFalse(diff.services_changed)
+        self.assertIn("Reconfiguring: kochira.services.b on foonet",
+                      diff.summary())
+
+    def test_per_channel_services(self):
+        def change(new):
+            channels = new["clients"]["foonet"]["channels"]
+            channels["#bar"]["services"]["kochira.services.a"]["x"] = 2
+            channels["#foo"]["services"] = {"kochira.services.b": {}}
+
+        diff = self.diff(change)
+
+        self.assertEqual(diff.services_reconfigured,
+                         {("kochira.services.a", "foonet", "#bar"),
+                          ("kochira.services.b", "foonet", "#foo")})
+
+    def test_services(self):
+        def change(new):
+            services = new["services"]
+            del services["kochira.services.a"]
+            services["kochira.services.b"] = {"z": 3}
+            services["kochira.services.c"] = {}
+
+        diff = self.diff(change)
+
+        self.assertEqual(diff.services_added, {"kochira.services.c"})
+        self.assertEqual(diff.services_removed, {"kochira.services.a"})
+        self.assertEqual(diff.services_changed, {"kochira.services.b"})
+
+    def test_core(self):
+        def change(new):
+            new["core"]["max_backlog"] = 20
+            new["core"]["database"] = "other.db"
+
+        diff = self.diff(change)
+
+        self.assertEqual(diff.core_changed, {"max_backlog", "database"})
+        self.assertEqual(diff.restart_required, {"database"})
+        self.assertIn("Needs a restart: core.database", diff.summary())
+
+
+if __name__ == "__main__":
+    unittest.main()
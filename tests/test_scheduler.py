@@ -0,0 +1,221 @@
+import types
+import unittest
+from datetime import timedelta
+from unittest import mock
+
+from kochira import metrics
+from kochira.scheduler import Scheduler
+
+
+class FakeEventLoop:
+    def __init__(self):
+        self.timeouts = []
+
+    def schedule_in(self, delay, f, *args):
+        handle = (delay, f, args)
+        self.timeouts.append(handle)
+        return handle
+
+    def unschedule(self, handle):
+        if handle in self.timeouts:
+            self.timeouts.remove(handle)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+SERVICE = types.SimpleNamespace(name="test")
+
+
+def make_task(name, calls, service=SERVICE):
+    def task(ctx, *args, **kwargs):
+        calls.append((name, args, kwargs))
+
+    task.__name__ = name
+    task.service = service
+    return task
+
+
+class SchedulerTest(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+
+        for patcher in [mock.patch("kochira.scheduler.time.monotonic",
+                                   self.clock),
+                        mock.patch("kochira.scheduler.HookContext")]:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+        self.bot = types.SimpleNamespace(event_loop=FakeEventLoop())
+        self.scheduler = Scheduler(self.bot)
+        self.addCleanup(self.scheduler.close)
+        self.calls = []
+
+    def advance(self, seconds):
+        self.clock.now += seconds
+        self.scheduler._run_due()
+
+    def names(self):
+        return [name for name, _, _ in self.calls]
+
+    def test_runs_jobs_in_due_order(self):
+        self.scheduler.schedule_after(3, make_task("c", self.calls))
+        self.scheduler.schedule_after(1, make_task("a", self.calls))
+        self.scheduler.schedule_after(2, make_task("b", self.calls))
+
+        self.advance(3)
+
+        self.assertEqual(self.names(), ["a", "b", "c"])
+        self.assertEqual(self.scheduler.pending(), 0)
+
+    def test_doesnt_run_jobs_early(self):
+        self.scheduler.schedule_after(timedelta(seconds=5),
+                                      make_task("a", self.calls), 1, x=2)
+
+        self.advance(4.9)
+        self.assertEqual(self.calls, [])
+
+        self.advance(0.1)
+        self.assertEqual(self.calls, [("a", (1,), {"x": 2})])
+
+    def test_arms_one_timeout_for_earliest_job(self):
+        self.scheduler.schedule_after(5, make_task("a", self.calls))
+        self.scheduler.schedule_after(1, make_task("b", self.calls))
+
+        self.assertEqual(len(self.bot.event_loop.timeouts), 1)
+        delay, _, _ = self.bot.event_loop.timeouts[0]
+        self.assertEqual(delay, timedelta(seconds=1))
+
+    def test_cancelled_job_doesnt_run(self):
+        job = self.scheduler.schedule_after(1, make_task("a", self.calls))
+        job.cancel()
+
+        self.advance(2)
+
+        self.assertEqual(self.calls, [])
+        self.assertEqual(self.scheduler.pending(), 0)
+        self.assertEqual(self.bot.event_loop.timeouts, [])
+
+    def test_cancelling_twice_is_harmless(self):
+        job = self.scheduler.schedule_after(1, make_task("a", self.calls))
+        job.cancel()
+        job.cancel()
+
+        self.assertEqual(self.scheduler._num_cancelled, 0)
+
+    def test_compacts_cancelled_jobs(self):
+        task = make_task("a", self.calls)
+        jobs = [self.scheduler.schedule_after(i + 1, task) for i in range(10)]
+
+        # cancel the latest ones, which stay in the heap until compacted
+        for job in jobs[4:]:
+            job.cancel()
+
+        self.assertLessEqual(self.scheduler._num_cancelled,
+                             len(self.scheduler._heap) *
+                             Scheduler.COMPACT_RATIO)
+        self.assertLess(len(self.scheduler._heap), 10)
+
+        self.advance(10)
+        self.assertEqual(len(self.calls), 4)
+
+    def test_periodic_job_runs_every_interval(self):
+        self.scheduler.schedule_every(2, make_task("a", self.calls))
+
+        self.advance(2)
+        self.advance(2)
+        self.advance(1)
+
+        self.assertEqual(len(self.calls), 2)
+        self.assertEqual(self.scheduler.pending(), 1)
+
+    def test_periodic_job_coalesces_missed_runs(self):
+        self.scheduler.schedule_every(1, make_task("a", self.calls))
+
+        # five runs are missed while the loop is busy
+        self.advance(5.5)
+        self.assertEqual(len(self.calls), 1)
+
+        # the next run is an interval after the late one
+        self.advance(0.5)
+        self.assertEqual(len(self.calls), 1)
+
+        self.advance(0.5)
+        self.assertEqual(len(self.calls), 2)
+
+    def test_cancelled_periodic_job_stops(self):
+        job = self.scheduler.schedule_every(1, make_task("a", self.calls))
+
+        self.advance(1)
+        job.cancel()
+        self.advance(5)
+
+        self.assertEqual(len(self.calls), 1)
+        self.assertEqual(self.scheduler.pending(), 0)
+
+    def test_rejects_non_positive_intervals(self):
+        task = make_task("a", self.calls)
+
+        with self.assertRaises(ValueError):
+            self.scheduler.schedule_every(0, task)
+
+        with self.assertRaises(ValueError):
+            self.scheduler.schedule_every(timedelta(seconds=-1), task)
+
+        self.assertEqual(self.scheduler.pending(), 0)
+
+    def test_skips_misfired_runs(self):
+        self.scheduler.schedule_after(1, make_task("a", self.calls),
+                                      _misfire_grace=0.5)
+
+        self.advance(2)
+
+        self.assertEqual(self.calls, [])
+        self.assertEqual(self.scheduler.pending(), 0)
+
+    def test_failing_task_doesnt_stop_others(self):
+        def fail(ctx):
+            raise RuntimeError("oops")
+
+        fail.service = SERVICE
+
+        self.scheduler.schedule_after(1, fail)
+        self.scheduler.schedule_after(1, make_task("a", self.calls))
+
+        with self.assertLogs("kochira.scheduler", "ERROR"):
+            self.advance(1)
+
+        self.assertEqual(self.names(), ["a"])
+
+    def test_unschedule_service(self):
+        other = types.SimpleNamespace(name="other")
+
+        self.scheduler.schedule_after(1, make_task("a", self.calls))
+        self.scheduler.schedule_every(1, make_task("b", self.calls))
+        self.scheduler.schedule_after(1, make_task("c", self.calls, other))
+
+        self.scheduler.unschedule_service(SERVICE)
+        self.advance(1)
+
+        self.assertEqual(self.names(), ["c"])
+        self.assertEqual(self.scheduler.pending(SERVICE), 0)
+
+    def test_close(self):
+        self.scheduler.schedule_after(1, make_task("a", self.calls))
+        self.assertIn(self.scheduler._collect_metrics,
+                      metrics.registry.collectors)
+
+        self.scheduler.close()
+
+        self.assertNotIn(self.scheduler._collect_metrics,
+                         metrics.registry.collectors)
+        self.assertEqual(self.bot.event_loop.timeouts, [])
+
+
+if __name__ == "__main__":
+    unittest.main()
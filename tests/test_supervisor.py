@@ -0,0 +1,33 @@
+import unittest
+
+from kochira.supervisor import Settings, primary_shard, shard_of, shards
+
+
+class ShardTest(unittest.TestCase):
+    def test_network_without_shard_gets_its_own(self):
+        self.assertEqual(shard_of("foonet", {}), "foonet")
+        self.assertEqual(shard_of("foonet", {"shard": None}), "foonet")
+
+    def test_numeric_shards_are_strings(self):
+        self.assertEqual(shard_of("foonet", {"shard": 1}), "1")
+        self.assertEqual(shard_of("foonet", {"shard": 0}), "0")
+
+    def test_groups_networks(self):
+        self.assertEqual(shards({"foonet": {"shard": 1},
+                                 "barnet": {"shard": "1"},
+                                 "baznet": {}}),
+                         {"1": ["barnet", "foonet"], "baznet": ["baznet"]})
+
+    def test_primary_shard(self):
+        clients = {"foonet": {}, "barnet": {"shard": 2}}
+
+        self.assertEqual(primary_shard(Settings(), clients), "2")
+        self.assertEqual(primary_shard(Settings({"primary": "foonet"}),
+                                       clients), "foonet")
+        self.assertEqual(primary_shard(Settings({"primary": 2}), clients),
+                         "2")
+        self.assertIsNone(primary_shard(Settings(), {}))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,103 @@
+import unittest
+
+from kochira.util import percentile, split_message
+
+
+def utf8_len(s):
+    return len(s.encode("utf-8"))
+
+
+class SplitMessageTest(unittest.TestCase):
+    def assertFits(self, lines, max_length):
+        for line in lines:
+            self.assertLessEqual(utf8_len(line), max_length, line)
+
+    def test_short_message_is_unchanged(self):
+        self.assertEqual(split_message("hello world", 100), ["hello world"])
+
+    def test_breaks_between_words(self):
+        lines = split_message("the quick brown fox jumps over the lazy dog", 15)
+
+        self.assertEqual(lines, ["the quick brown", "fox jumps over",
+                                 "the lazy dog"])
+
+    def test_keeps_all_words(self):
+        message = " ".join("word{}".format(i) for i in range(100))
+        lines = split_message(message, 50)
+
+        self.assertFits(lines, 50)
+        self.assertEqual(" ".join(lines).split(), message.split())
+
+    def test_breaks_up_long_words(self):
+        lines = split_message("a " + "x" * 25, 10)
+
+        self.assertEqual(lines, ["a", "xxxxxxxxxx", "xxxxxxxxxx", "xxxxx"])
+
+    def test_breaks_on_newlines(self):
+        self.assertEqual(split_message("one\ntwo\r\nthree\rfour", 100),
+                         ["one", "two", "three", "four"])
+
+    def test_drops_empty_lines(self):
+        self.assertEqual(split_message("one\n\n  \ntwo", 100), ["one", "two"])
+
+    def test_counts_utf8_bytes(self):
+        message = "é" * 30
+        lines = split_message(message, 11)
+
+        self.assertFits(lines, 11)
+        self.assertEqual("".join(lines), message)
+
+    def test_doesnt_break_up_formatting_codes(self):
+        lines = split_message("x" * 9 + "\x0304,12" + "y" * 9, 12)
+
+        self.assertFits(lines, 12)
+        self.assertTrue(any(line.startswith("\x0304,12") for line in lines))
+
+    def test_carries_formatting_over(self):
+        lines = split_message("\x02bold words \x1funderlined too\x0f plain", 16)
+
+        self.assertEqual(lines, ["\x02bold words",
+                                 "\x02\x1funderlined",
+                                 "\x02\x1ftoo\x0f plain"])
+
+    def test_carries_color_over(self):
+        lines = split_message("\x0304red words here", 12)
+
+        self.assertEqual(lines[0], "\x0304red words")
+        self.assertEqual(lines[1], "\x0304here")
+
+    def test_limits_lines(self):
+        lines = split_message("one two three four five six", 9, max_lines=2)
+
+        self.assertEqual(len(lines), 2)
+        self.assertFits(lines, 9)
+        self.assertTrue(lines[-1].endswith("..."))
+
+    def test_limits_lines_with_custom_suffix(self):
+        lines = split_message("é" * 50, 10, max_lines=1,
+                              suffix="…")
+
+        self.assertEqual(len(lines), 1)
+        self.assertFits(lines, 10)
+        self.assertTrue(lines[0].endswith("…"))
+
+    def test_no_suffix_when_lines_fit(self):
+        self.assertEqual(split_message("one\ntwo", 100, max_lines=2),
+                         ["one", "two"])
+
+
+class PercentileTest(unittest.TestCase):
+    def test_percentile(self):
+        values = list(range(1, 101))
+
+        self.assertEqual(percentile(values, 0), 1)
+        self.assertEqual(percentile(values, 50), 51)
+        self.assertEqual(percentile(values, 99), 99)
+        self.assertEqual(percentile(values, 100), 100)
+
+    def test_no_values(self):
+        self.assertEqual(percentile([], 50), 0.0)
+
+
+if __name__ == "__main__":
+    unittest.main()